@@ -6,6 +6,7 @@ This script loops over videos in a local folder and adds them as streams via API
 Features:
 - Automatic stream name deduplication (appends 1, 2, etc. if name exists)
 - Dry-run mode to preview actions
+- Single batch request (/streams/batch_start) with server-side parallelism and ramp
 - Configurable stream settings
 - Progress tracking and error handling
 """
@@ -209,11 +210,69 @@ class StreamCreator:
             print(f"❌ Invalid JSON response for stream '{stream_name}': {e}")
             return False
     
+    def create_streams_batch(self,
+                             video_files: List[Path],
+                             stream_config: Dict,
+                             existing_streams: List[str],
+                             parallelism: Optional[int] = None,
+                             ramp_per_sec: Optional[float] = None) -> Optional[Dict[str, int]]:
+        """Create all streams with one /streams/batch_start request.
+        Returns None if the server has no batch endpoint so the caller can fall back."""
+        streams = []
+        for video_file in video_files:
+            base_name = self.generate_stream_name(video_file)
+            stream_name = self.get_unique_stream_name(base_name, existing_streams)
+            if stream_name != base_name:
+                print(f"⚠️  Stream name '{base_name}' already exists, using '{stream_name}' instead")
+            existing_streams.append(stream_name)
+            streams.append({
+                "stream_name": stream_name,
+                "stream_type": "file",
+                "file_source_type": "custom",
+                "video_file_path": str(video_file.absolute()),
+            })
+        
+        body = {"streams": streams, "defaults": stream_config}
+        if parallelism:
+            body["parallelism"] = parallelism
+        if ramp_per_sec:
+            body["ramp_per_sec"] = ramp_per_sec
+        
+        try:
+            print(f"🚀 Submitting {len(streams)} streams in one batch request...")
+            # The server launches the whole batch before replying, so allow for slow ramps
+            timeout = 60 + (len(streams) / ramp_per_sec if ramp_per_sec else len(streams))
+            response = self.session.post(f"{self.api_url}/streams/batch_start", json=body, timeout=timeout)
+            if response.status_code in (404, 405):
+                return None
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"❌ Network error submitting batch: {e}")
+            return {"total": len(streams), "success": 0, "failed": len(streams)}
+        except json.JSONDecodeError as e:
+            print(f"❌ Invalid JSON response for batch: {e}")
+            return {"total": len(streams), "success": 0, "failed": len(streams)}
+        
+        if "results" not in result:
+            print(f"❌ Batch rejected: {result.get('message', 'Unknown error')}")
+            return {"total": len(streams), "success": 0, "failed": len(streams)}
+        for item in result["results"]:
+            if item.get("success"):
+                print(f"✅ Stream '{item['stream_name']}' created successfully")
+                print(f"   📺 RTSP URL: {item.get('stream_url', 'N/A')}")
+            else:
+                print(f"❌ Failed to create stream '{item.get('stream_name')}': {item.get('message', 'Unknown error')}")
+        print(f"\n⏱️  Batch finished in {result.get('elapsed_seconds', '?')}s")
+        return {"total": len(streams), "success": result.get("started", 0), "failed": len(streams) - result.get("started", 0)}
+    
     def create_streams_from_directory(self, 
                                     directory: str, 
                                     stream_config: Dict,
                                     delay_between_streams: float = 1.0,
-                                    dry_run: bool = False) -> Dict[str, int]:
+                                    dry_run: bool = False,
+                                    use_batch: bool = True,
+                                    parallelism: Optional[int] = None,
+                                    ramp_per_sec: Optional[float] = None) -> Dict[str, int]:
         """Create streams from all videos in a directory"""
         video_files = self.get_video_files(directory)
         
@@ -245,6 +304,13 @@ class StreamCreator:
         print(f"\n🎬 Creating {len(video_files)} streams...")
         print("=" * 60)
         
+        if use_batch:
+            stats = self.create_streams_batch(video_files, stream_config, list(existing_streams),
+                                              parallelism, ramp_per_sec)
+            if stats is not None:
+                return stats
+            print("⚠️  Server has no batch endpoint, creating streams one by one")
+        
         stats = {"total": len(video_files), "success": 0, "failed": 0}
         
         for i, video_file in enumerate(video_files, 1):
@@ -272,6 +338,8 @@ Examples:
   python add_streams.py -d /path/to/videos --dry-run      # Test without creating
   python add_streams.py --codec h265 --resolution 720    # Custom encoding
   python add_streams.py --duration 2 --fps 15            # Limited duration, lower FPS
+  python add_streams.py --parallelism 8 --ramp 5         # Batch start, 8 at a time, 5 streams/sec
+  python add_streams.py --no-batch --delay 2             # One request per stream, 2s apart
         """
     )
     
@@ -322,7 +390,21 @@ Examples:
     parser.add_argument("--delay", 
                        type=float,
                        default=1.0,
-                       help="Delay between stream creation requests in seconds (default: 1.0)")
+                       help="Delay between stream creation requests in seconds, only with --no-batch (default: 1.0)")
+    
+    parser.add_argument("--no-batch", 
+                       action="store_true",
+                       help="Send one /start_stream request per video instead of a single batch request")
+    
+    parser.add_argument("--parallelism", 
+                       type=int,
+                       default=None,
+                       help="Streams the server launches concurrently in batch mode (default: server setting)")
+    
+    parser.add_argument("--ramp", 
+                       type=float,
+                       default=None,
+                       help="Batch launch rate in streams per second (default: server setting)")
     
     args = parser.parse_args()
     
@@ -352,7 +434,10 @@ Examples:
         args.directory, 
         stream_config,
         args.delay,
-        args.dry_run
+        args.dry_run,
+        use_batch=not args.no_batch,
+        parallelism=args.parallelism,
+        ramp_per_sec=args.ramp
     )
     
     # Print summary
@@ -18,6 +18,26 @@ from logging.handlers import RotatingFileHandler
 import atexit
 import glob # For cleanup
 import stat # For cleanup, to get file mode
+import functools
+import collections
+import hashlib
+import shlex
+import uuid
+import random
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from process_reaper import EXIT_UNKNOWN, ChildReaper
+from process_adoption import adopt, process_identity
+from supervisor_ipc import SupervisorClient, SupervisorError, SupervisorUnavailable
+from cluster import ClusterState
+from restart_policy import RestartPolicy, RestartTracker, TokenBucket
+from timer_scheduler import TimerScheduler
+from stream_registry import StreamRecord, StreamRegistry
+from proc_sampler import ProcessSampler
+from cgroup_limits import CgroupManager, resolve_limits
+from cpu_placement import PlacementEngine, apply_affinity, estimate_cost, parse_cpu_list, read_topology, spawn_affinity
+from thread_budget import ThreadBudget, apply_thread_budget
 
 # Import configuration
 try:
@@ -159,35 +179,92 @@ if hasattr(config, 'BROWSEABLE_VIDEO_DIR') and config.BROWSEABLE_VIDEO_DIR:
 for d_path in [config.LOG_DIR, config.CRASH_LOG_DIR, config.PID_DIR, config.STATUS_DIR, getattr(config, 'BROWSEABLE_VIDEO_DIR', DEFAULT_BROWSEABLE_DIR), UPLOAD_DIR_TO_CREATE, getattr(config, 'STREAM_PERSISTENCE_DIR', os.path.join(config.BASE_DIR, 'data')), getattr(config, 'HLS_DIR', os.path.join(config.BASE_TMP_DIR, 'hls_streams'))]: # Added UPLOAD_DIR_TO_CREATE, STREAM_PERSISTENCE_DIR, and HLS_DIR
     os.makedirs(d_path, exist_ok=True)
 
-active_streams = {}
+# "embedded": this process serves the web UI and owns every ffmpeg/MediaMTX process (the default).
+# "supervisor": stream_supervisor.py owns the processes and serves the control socket.
+# "client": a web worker that forwards stream-control routes to the supervisor and starts nothing itself.
+_SUPERVISOR_MODE = getattr(config, 'SUPERVISOR_MODE', 'embedded')
+_OWNS_STREAMS = _SUPERVISOR_MODE != 'client'
+
+active_streams = StreamRegistry() # name -> StreamRecord; copy-on-write, safe to iterate from any thread
 _shutdown_in_progress = False  # Flag to track if we're shutting down
+_shutdown_complete = False  # Set once cleanup_all_streams has run (signal handler and atexit both call it)
+
+# One reaper thread detects ffmpeg exits for every stream (pidfd on Linux, polling elsewhere)
+_child_reaper = ChildReaper(
+    workers=getattr(config, 'REAPER_CALLBACK_WORKERS', 4),
+    poll_interval=getattr(config, 'REAPER_POLL_INTERVAL', 0.05),
+    logger=app.logger)
+if _OWNS_STREAMS:
+    _child_reaper.start()
+
+# One scheduler thread runs all timed work: stream expiry, staggered health checks, restarts, idle checks,
+# cleanup and cluster heartbeats. Slow jobs get their own lanes so they can't delay an expiry.
+_scheduler = TimerScheduler(
+    workers=getattr(config, 'SCHEDULER_WORKERS', 2),
+    lanes={'launch': getattr(config, 'SCHEDULER_LAUNCH_WORKERS', 4), 'health': getattr(config, 'HEALTH_CHECK_WORKERS', 2), 'maintenance': 2, 'cluster': 2},
+    logger=app.logger)
+
+# With ENABLE_CGROUP_LIMITS, each stream gets its own cgroup with kernel-enforced CPU/memory/IO limits where the host
+# delegates a cgroup v2 tree to the app; elsewhere the health check's polling limits (MAX_CPU_USAGE/MAX_MEMORY_USAGE) apply as before
+_cgroups = CgroupManager(root=getattr(config, 'CGROUP_ROOT', ''), logger=app.logger)
+if _OWNS_STREAMS and getattr(config, 'ENABLE_CGROUP_LIMITS', False):
+    if _cgroups.setup():
+        _cgroups.prune() # Empty cgroups of streams that ended while the app was down; adopted streams' cgroups aren't empty
+        app.logger.info(f"Per-stream cgroup limits enabled under {_cgroups.streams_dir} ({', '.join(_cgroups.controllers)})")
+    else:
+        app.logger.info(f"Per-stream cgroup limits unavailable, using polling health limits: {_cgroups.reason}")
+
+# Each encoder is pinned to whole cores sized to its expected cost, NUMA node first, and rebalanced as streams stop
+_placement = None
+if _OWNS_STREAMS and getattr(config, 'ENABLE_CPU_PLACEMENT', False) and hasattr(os, 'sched_setaffinity'):
+    try:
+        _placement_cores = read_topology(reserved=parse_cpu_list(getattr(config, 'PLACEMENT_RESERVED_CPUS', '')))
+        if _placement_cores:
+            _placement = PlacementEngine(_placement_cores)
+            app.logger.info(f"CPU placement enabled: {len(_placement_cores)} cores on {len(_placement.nodes)} NUMA node(s)")
+        else:
+            app.logger.warning("CPU placement disabled: no usable CPUs left after PLACEMENT_RESERVED_CPUS")
+    except (OSError, ValueError) as e:
+        app.logger.warning(f"CPU placement disabled: could not read the CPU topology: {e}")
+
+# Encoder/decoder/filter thread counts come from one host-wide budget shared by running streams by expected cost
+_thread_budget = None
+if getattr(config, 'ENABLE_THREAD_BUDGET', False):
+    _budget_cores = getattr(config, 'THREAD_BUDGET_CORES', 0) or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+    _thread_budget = ThreadBudget(_budget_cores, oversubscription=getattr(config, 'THREAD_BUDGET_OVERSUBSCRIPTION', 1.5),
+                                  max_threads=getattr(config, 'THREAD_BUDGET_MAX_THREADS', 16))
 
 # --- Stream Persistence Functions ---
+# Streams start and stop concurrently (async jobs, batches, restore), so every read-modify-write
+# of the persistence file holds this lock
+_persistence_lock = threading.RLock()
+
 def save_stream_state(stream_name, stream_config):
     """Save a stream's configuration to persistent storage"""
     if not config.ENABLE_STREAM_PERSISTENCE:
         return
     
     try:
-        # Load existing streams
-        persistent_streams = load_persistent_streams()
-        
-        # Add/update this stream
-        persistent_streams[stream_name] = {
-            'config': stream_config,
-            'saved_at': time.time(),
-            'status': 'active'
-        }
-        
-        # Create backup of current file if it exists
-        if os.path.exists(config.STREAM_PERSISTENCE_FILE):
-            backup_file = f"{config.STREAM_PERSISTENCE_FILE}.backup"
-            shutil.copy2(config.STREAM_PERSISTENCE_FILE, backup_file)
-        
-        # Save to file
-        os.makedirs(os.path.dirname(config.STREAM_PERSISTENCE_FILE), exist_ok=True)
-        with open(config.STREAM_PERSISTENCE_FILE, 'w') as f:
-            json.dump(persistent_streams, f, indent=2)
+        with _persistence_lock:
+            # Load existing streams
+            persistent_streams = load_persistent_streams()
+            
+            # Add/update this stream
+            persistent_streams[stream_name] = {
+                'config': stream_config,
+                'saved_at': time.time(),
+                'status': 'active'
+            }
+            
+            # Create backup of current file if it exists
+            if os.path.exists(config.STREAM_PERSISTENCE_FILE):
+                backup_file = f"{config.STREAM_PERSISTENCE_FILE}.backup"
+                shutil.copy2(config.STREAM_PERSISTENCE_FILE, backup_file)
+            
+            # Save to file
+            os.makedirs(os.path.dirname(config.STREAM_PERSISTENCE_FILE), exist_ok=True)
+            with open(config.STREAM_PERSISTENCE_FILE, 'w') as f:
+                json.dump(persistent_streams, f, indent=2)
         
         app.logger.info(f"Saved stream state for {stream_name}")
         
@@ -200,15 +277,16 @@ def remove_stream_state(stream_name):
         return
     
     try:
-        persistent_streams = load_persistent_streams()
-        if stream_name in persistent_streams:
-            del persistent_streams[stream_name]
-            
-            # Save updated file
-            with open(config.STREAM_PERSISTENCE_FILE, 'w') as f:
-                json.dump(persistent_streams, f, indent=2)
-            
-            app.logger.info(f"Removed stream state for {stream_name}")
+        with _persistence_lock:
+            persistent_streams = load_persistent_streams()
+            if stream_name in persistent_streams:
+                del persistent_streams[stream_name]
+                
+                # Save updated file
+                with open(config.STREAM_PERSISTENCE_FILE, 'w') as f:
+                    json.dump(persistent_streams, f, indent=2)
+                
+                app.logger.info(f"Removed stream state for {stream_name}")
         
     except Exception as e:
         app.logger.error(f"Failed to remove stream state for {stream_name}: {e}")
@@ -237,89 +315,134 @@ def load_persistent_streams():
     
     return {}
 
+# Restore progress, reported by GET /restore_status
+_restore_status = {'state': 'idle', 'total': 0, 'restored': 0, 'failed': 0, 'skipped': 0, 'adopted': 0,
+                   'started_at': None, 'finished_at': None, 'streams': {}}
+_restore_lock = threading.Lock()
+
+def _restore_priority(stream_config):
+    try: return int(stream_config.get('priority', 0))
+    except (TypeError, ValueError): return 0
+
+def _restore_plan(persistent_streams):
+    """Filter persisted streams down to restorable ones. Returns ([(name, config, remaining_hours_str)], skipped)."""
+    plan, skipped = [], {}
+    for stream_name, stream_data in persistent_streams.items():
+        stream_config = dict(stream_data.get('config', {}))
+        saved_at = stream_data.get('saved_at', 0)
+        
+        # Check if stream should still be running based on duration
+        try: duration_hours = float(stream_config.get('duration_hours', '0'))
+        except (TypeError, ValueError): duration_hours = 0
+        remaining_duration = '0'
+        if duration_hours > 0:
+            elapsed_hours = (time.time() - saved_at) / 3600
+            if elapsed_hours >= duration_hours:
+                app.logger.info(f"Stream {stream_name} duration expired ({elapsed_hours:.1f}h >= {duration_hours}h), skipping restore")
+                remove_stream_state(stream_name)
+                skipped[stream_name] = 'duration expired'
+                continue
+            remaining_duration = str(duration_hours - elapsed_hours)
+        
+        # Validate required fields
+        if not stream_config.get('stream_type'):
+            app.logger.warning(f"Stream {stream_name} missing stream_type, skipping")
+            skipped[stream_name] = 'missing stream_type'
+            continue
+        
+        # Validate file existence for file streams
+        if stream_config.get('stream_type') == 'file':
+            video_file_path = stream_config.get('video_file_path')
+            if video_file_path and not os.path.exists(video_file_path):
+                app.logger.warning(f"Stream {stream_name} source file not found: {video_file_path}, skipping")
+                skipped[stream_name] = 'source file not found'
+                continue
+        
+        if stream_name in active_streams:
+            skipped[stream_name] = 'already running'
+            continue
+        
+        # Add stream_name to config for construct_ffmpeg_command
+        stream_config['stream_name'] = stream_name
+        plan.append((stream_name, stream_config, remaining_duration, saved_at))
+    
+    # Highest priority first, then the longest-running streams
+    plan.sort(key=lambda item: (-_restore_priority(item[1]), item[3]))
+    return [item[:3] for item in plan], skipped
+
 def restore_streams_on_startup():
-    """Restore active streams from persistent storage on application startup"""
+    """Restore active streams from persistent storage on application startup.
+    Streams are launched on RESTORE_PARALLELISM threads at RESTORE_RAMP_PER_SEC, highest priority first,
+    so a host with hundreds of persisted streams neither restores serially nor starts them all at once."""
     if not config.ENABLE_STREAM_PERSISTENCE:
         app.logger.info("Stream persistence is disabled")
         return
     
-    persistent_streams = load_persistent_streams()
-    if not persistent_streams:
-        app.logger.info("No persistent streams found")
-        return
-    
-    app.logger.info(f"Found {len(persistent_streams)} persistent streams to restore")
-    
-    restored_count = 0
-    failed_count = 0
-    
-    for stream_name, stream_data in persistent_streams.items():
-        try:
-            stream_config = stream_data.get('config', {})
-            saved_at = stream_data.get('saved_at', 0)
-            
-            # Check if stream should still be running based on duration
-            duration_hours = float(stream_config.get('duration_hours', '0'))
-            if duration_hours > 0:
-                elapsed_hours = (time.time() - saved_at) / 3600
-                if elapsed_hours >= duration_hours:
-                    app.logger.info(f"Stream {stream_name} duration expired ({elapsed_hours:.1f}h >= {duration_hours}h), skipping restore")
-                    remove_stream_state(stream_name)
-                    continue
-            
-            # Validate required fields
-            if not stream_config.get('stream_type'):
-                app.logger.warning(f"Stream {stream_name} missing stream_type, skipping")
-                continue
-            
-            # Validate file existence for file streams
-            if stream_config.get('stream_type') == 'file':
-                video_file_path = stream_config.get('video_file_path')
-                if video_file_path and not os.path.exists(video_file_path):
-                    app.logger.warning(f"Stream {stream_name} source file not found: {video_file_path}, skipping")
-                    continue
-            
-            app.logger.info(f"Restoring stream: {stream_name}")
-            
-            # Get encoder info
-            vid_codec = stream_config.get('video_codec', 'h264')
-            hw_accel = stream_config.get('hardware_accel') == 'yes'
-            avail_encs = get_available_encoders()
-            
-            if not avail_encs or not avail_encs.get(vid_codec):
-                app.logger.error(f"No encoders available for {vid_codec}, skipping {stream_name}")
-                continue
-            
-            enc_info = get_best_encoder(vid_codec, avail_encs, hw_accel)
-            
-            # Add stream_name to config for construct_ffmpeg_command
-            stream_config['stream_name'] = stream_name
-            
-            ff_cmd = construct_ffmpeg_command(stream_config, enc_info)
-            
-            # Calculate remaining duration
-            remaining_duration = '0'
-            if duration_hours > 0:
-                elapsed_hours = (time.time() - saved_at) / 3600
-                remaining_hours = max(0, duration_hours - elapsed_hours)
-                remaining_duration = str(remaining_hours)
-            
-            # Start the stream
-            ok, msg = exec_and_monitor_ffmpeg(stream_name, ff_cmd, remaining_duration, stream_config, enc_info)
-            
+    with _restore_lock:
+        if _restore_status['state'] == 'running':
+            app.logger.info("Stream restoration already running")
+            return
+        _restore_status.update(state='running', total=0, restored=0, failed=0, skipped=0, adopted=0,
+                               started_at=time.time(), finished_at=None, streams={})
+    try:
+        persistent_streams = load_persistent_streams()
+        if not persistent_streams:
+            app.logger.info("No persistent streams found")
+            return
+        
+        app.logger.info(f"Found {len(persistent_streams)} persistent streams to restore")
+        adopted = {n for n, result in _adopt_running_streams(persistent_streams).items() if result == 'adopted'}
+        plan, skipped = _restore_plan(persistent_streams)
+        with _restore_lock:
+            _restore_status.update(total=len(persistent_streams), skipped=len(skipped) - len(adopted), adopted=len(adopted))
+            _restore_status['streams'].update({n: f"skipped: {why}" for n, why in skipped.items() if n not in adopted})
+            _restore_status['streams'].update({n: 'adopted' for n in adopted})
+            _restore_status['streams'].update({n: 'pending' for n, _, _ in plan})
+        
+        # Encoders are resolved once per codec/hardware combination, before the pool starts, so workers only read the map
+        encoders = {}
+        for _, stream_config, _ in plan:
+            enc_key = (stream_config.get('video_codec', 'h264'), stream_config.get('hardware_accel') == 'yes')
+            if enc_key not in encoders:
+                try:
+                    encoders[enc_key] = resolve_encoder(*enc_key)
+                except ValueError as e:
+                    encoders[enc_key] = e
+        def restore_one(item):
+            stream_name, stream_config, remaining_duration = item
+            with _restore_lock: _restore_status['streams'][stream_name] = 'starting'
+            ok, msg = False, ''
+            try:
+                enc_info = encoders[(stream_config.get('video_codec', 'h264'), stream_config.get('hardware_accel') == 'yes')]
+                if isinstance(enc_info, ValueError):
+                    msg = f"No encoders available: {enc_info}"
+                else:
+                    app.logger.info(f"Restoring stream: {stream_name}")
+                    ok, msg, _ = _launch_stream(stream_name, stream_config, enc_info, remaining_duration)
+            except ValueError as e:
+                msg = f"No encoders available: {e}"
+            except Exception as e:
+                msg = str(e)
+                app.logger.error(f"Error restoring stream {stream_name}: {e}")
             if ok:
                 app.logger.info(f"Successfully restored stream: {stream_name}")
-                restored_count += 1
             else:
                 app.logger.error(f"Failed to restore stream {stream_name}: {msg}")
-                failed_count += 1
-                remove_stream_state(stream_name)
-                
-        except Exception as e:
-            app.logger.error(f"Error restoring stream {stream_name}: {e}")
-            failed_count += 1
-    
-    app.logger.info(f"Stream restoration complete: {restored_count} restored, {failed_count} failed")
+                if msg != "Stream name active.":
+                    remove_stream_state(stream_name)
+            with _restore_lock:
+                _restore_status['restored' if ok else 'failed'] += 1
+                _restore_status['streams'][stream_name] = 'restored' if ok else f"failed: {msg}"
+        
+        _ramped_map(restore_one, plan, getattr(config, 'RESTORE_PARALLELISM', 8), getattr(config, 'RESTORE_RAMP_PER_SEC', 5))
+        app.logger.info(f"Stream restoration complete: {_restore_status['adopted']} adopted, {_restore_status['restored']} restored, {_restore_status['failed']} failed, "
+                        f"{_restore_status['skipped']} skipped in {time.time() - _restore_status['started_at']:.1f}s")
+    finally:
+        with _restore_lock:
+            _restore_status.update(state='done', finished_at=time.time())
+
+def _start_restore_thread():
+    threading.Thread(target=restore_streams_on_startup, name='stream-restore', daemon=True).start()
 
 # --- End Stream Persistence Functions ---
 
@@ -490,9 +613,17 @@ def _stop_mediamtx():
     try:
         app.logger.info(f"Stopping MediaMTX with PID {pid}")
         
-        # Try graceful shutdown first
+        # Try graceful shutdown first, waiting only as long as MediaMTX actually takes
         os.kill(pid, signal.SIGTERM)
-        time.sleep(2)
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            try:
+                # Reap it if it is our child, otherwise its zombie would look alive to kill(pid, 0)
+                if os.waitpid(pid, os.WNOHANG)[0] == pid: break
+            except ChildProcessError: pass
+            try: os.kill(pid, 0)
+            except ProcessLookupError: break
+            time.sleep(0.05)
         
         # Check if still running
         try:
@@ -515,8 +646,36 @@ def _stop_mediamtx():
         app.logger.error(f"Failed to stop MediaMTX: {e}")
         return False
 
+MEDIAMTX_API_URL = getattr(config, 'MEDIAMTX_API_URL', 'http://127.0.0.1:9997')
+
+def _mediamtx_api(api_path, method='GET', body=None, timeout=2):
+    """Call the MediaMTX control API. Returns (http_status, parsed_json_or_None); status 0 if unreachable."""
+    req = urllib.request.Request(f"{MEDIAMTX_API_URL}{api_path}", method=method,
+                                 data=json.dumps(body).encode() if body is not None else None,
+                                 headers={'Content-Type': 'application/json'} if body is not None else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            raw = resp.read()
+            return resp.status, (json.loads(raw) if raw else None)
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except Exception:
+        return 0, None
+
+def _wait_for_mediamtx_path(path_name, timeout):
+    """Wait until MediaMTX reports a publisher on path_name. Returns False on timeout or if the API is unreachable."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, info = _mediamtx_api(f"/v3/paths/get/{path_name}")
+        if status == 200 and info and info.get('ready'):
+            return True
+        if status == 0:
+            return False
+        time.sleep(0.2)
+    return False
+
 # Start MediaMTX on app startup
-if not _start_mediamtx():
+if _OWNS_STREAMS and not _start_mediamtx():
     app.logger.error("Failed to start MediaMTX, streaming functionality will not work!")
     # You might want to exit here or show a warning in the UI
 
@@ -560,19 +719,24 @@ def _test_vaapi_encoder(codec_name):
     ).strip()
     return _run_command(test_command, timeout=10).returncode == 0
 
-def get_available_encoders():
+def _probe_available_encoders():
+    """Run every encoder probe (nvidia-smi, VAAPI trial encodes) in parallel and return the encoder table."""
     available = {c: {'software': None, 'hardware_nvidia': None, 'hardware_amd': None} for c in ['h264', 'h265']}
     available['mpeg4'] = {'software': None}
-    if not shutil.which("ffmpeg"): return available
-    if _check_ffmpeg_encoder('libx264'): available['h264']['software'] = 'libx264'
-    if _check_ffmpeg_encoder('libx265'): available['h265']['software'] = 'libx265'
-    if _check_ffmpeg_encoder('mpeg4'): available['mpeg4']['software'] = 'mpeg4'
-    if _check_nvidia_gpu():
-        if _check_ffmpeg_encoder('h264_nvenc'): available['h264']['hardware_nvidia'] = 'h264_nvenc'
-        if _check_ffmpeg_encoder('hevc_nvenc'): available['h265']['hardware_nvidia'] = 'hevc_nvenc'
-    if _check_vaapi_device():
-        if _test_vaapi_encoder('h264'): available['h264']['hardware_amd'] = 'h264_vaapi'
-        if _test_vaapi_encoder('h265'): available['h265']['hardware_amd'] = 'hevc_vaapi'
+    if not shutil.which("ffmpeg"): return {}
+    _get_ffmpeg_encoders_info() # Fill the -encoders cache once before the probes share it
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix='encoder-probe') as pool:
+        nvidia_f = pool.submit(_check_nvidia_gpu)
+        vaapi_h264_f = pool.submit(_test_vaapi_encoder, 'h264')
+        vaapi_h265_f = pool.submit(_test_vaapi_encoder, 'h265')
+        if _check_ffmpeg_encoder('libx264'): available['h264']['software'] = 'libx264'
+        if _check_ffmpeg_encoder('libx265'): available['h265']['software'] = 'libx265'
+        if _check_ffmpeg_encoder('mpeg4'): available['mpeg4']['software'] = 'mpeg4'
+        if nvidia_f.result():
+            if _check_ffmpeg_encoder('h264_nvenc'): available['h264']['hardware_nvidia'] = 'h264_nvenc'
+            if _check_ffmpeg_encoder('hevc_nvenc'): available['h265']['hardware_nvidia'] = 'hevc_nvenc'
+        if vaapi_h264_f.result(): available['h264']['hardware_amd'] = 'h264_vaapi'
+        if vaapi_h265_f.result(): available['h265']['hardware_amd'] = 'hevc_vaapi'
     return {c: e for c, e in available.items() if any(e.values())}
 
 def get_best_encoder(codec, available_encoders, use_hardware_accel=True):
@@ -584,27 +748,436 @@ def get_best_encoder(codec, available_encoders, use_hardware_accel=True):
     if options.get('software'): return {'name': options['software'], 'type': 'software'}
     raise ValueError(f"No suitable encoder for {codec} with preferences.")
 
-def construct_ffmpeg_command(data, encoder_info):
-    stream_name = data['stream_name']
-    resolution_map = {
-        '480': {'w': 854, 'h': 480, 'dim': '854x480'}, '720': {'w': 1280, 'h': 720, 'dim': '1280x720'},
-        '1080': {'w': 1920, 'h': 1080, 'dim': '1920x1080'}, '1440': {'w': 2560, 'h': 1440, 'dim': '2560x1440'},
-        '2160': {'w': 3840, 'h': 2160, 'dim': '3840x2160'}}
-    res_details = resolution_map.get(data.get('resolution', '1080'), resolution_map['1080'])
-    res_wh, res_dim = f"{res_details['w']}:{res_details['h']}", res_details['dim']
+# --- Encoder Capability Registry ---
+# Encoder probes run once (in parallel) and are cached on disk, keyed by a fingerprint of the
+# ffmpeg binary and the GPU device nodes. Stream starts and restores then resolve encoders from memory.
+ENCODER_CACHE_FILE = getattr(config, 'ENCODER_CACHE_FILE', os.path.join(BASE_TMP_DIR, 'encoder_capabilities.json'))
+_encoder_registry = None
+_encoder_registry_lock = threading.Lock()
+_encoder_registry_ready = threading.Event()
+
+def _encoder_fingerprint():
+    """Identify the encoding environment: ffmpeg path, mtime and version plus /dev/dri and NVIDIA device nodes."""
+    ffmpeg_path = shutil.which("ffmpeg") or ""
+    real_path, mtime, version = "", 0, ""
+    if ffmpeg_path:
+        real_path = os.path.realpath(ffmpeg_path)
+        try: mtime = os.path.getmtime(real_path)
+        except OSError: pass
+        ver = _run_command("ffmpeg -version", timeout=10)
+        if ver.returncode == 0 and ver.stdout: version = ver.stdout.splitlines()[0]
+    dri_devices = sorted(os.listdir("/dev/dri")) if os.path.isdir("/dev/dri") else []
+    nvidia_devices = sorted(os.path.basename(d) for d in glob.glob("/dev/nvidia[0-9]*"))
+    parts = {'ffmpeg_path': real_path, 'ffmpeg_mtime': mtime, 'ffmpeg_version': version,
+             'dri_devices': dri_devices, 'nvidia_devices': nvidia_devices}
+    parts['key'] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return parts
+
+def _build_encoder_registry(fingerprint, encoders, probe_seconds):
+    """Precompute the best encoder for every (codec, hardware_accel) pair for O(1) lookups."""
+    best = {}
+    for codec in encoders:
+        for hw in (True, False):
+            try: best[f"{codec}:{'hw' if hw else 'sw'}"] = get_best_encoder(codec, encoders, hw)
+            except ValueError: pass
+    return {'fingerprint': fingerprint, 'encoders': encoders, 'best': best,
+            'probed_at': time.time(), 'probe_seconds': round(probe_seconds, 3)}
+
+def _load_encoder_registry(fingerprint):
+    try:
+        if os.path.exists(ENCODER_CACHE_FILE):
+            with open(ENCODER_CACHE_FILE, 'r') as f: cached = json.load(f)
+            if cached.get('fingerprint', {}).get('key') == fingerprint['key']:
+                return cached
+            app.logger.info("Encoder capability cache is stale (ffmpeg or GPU devices changed), re-probing")
+    except Exception as e:
+        app.logger.warning(f"Could not read encoder capability cache {ENCODER_CACHE_FILE}: {e}")
+    return None
+
+def refresh_encoder_registry(force=False):
+    """Load the encoder registry from disk, or probe and persist it when missing, stale or forced."""
+    global _encoder_registry, _ffmpeg_encoders_cache
+    with _encoder_registry_lock:
+        fingerprint = _encoder_fingerprint()
+        registry = None if force else _load_encoder_registry(fingerprint)
+        if registry is None:
+            _ffmpeg_encoders_cache = None # Re-read ffmpeg -encoders as well
+            t0 = time.time()
+            encoders = _probe_available_encoders()
+            registry = _build_encoder_registry(fingerprint, encoders, time.time() - t0)
+            app.logger.info(f"Encoder probe finished in {registry['probe_seconds']}s: {encoders}")
+            try:
+                os.makedirs(os.path.dirname(ENCODER_CACHE_FILE), exist_ok=True)
+                tmp_file = f"{ENCODER_CACHE_FILE}.tmp"
+                with open(tmp_file, 'w') as f: json.dump(registry, f, indent=2)
+                os.replace(tmp_file, ENCODER_CACHE_FILE)
+            except Exception as e:
+                app.logger.error(f"Failed to save encoder capability cache: {e}")
+        else:
+            app.logger.info(f"Loaded encoder capabilities from cache: {registry['encoders']}")
+        _encoder_registry = registry
+        _encoder_registry_ready.set()
+        return registry
+
+def _get_encoder_registry():
+    if not _encoder_registry_ready.wait(timeout=30) or _encoder_registry is None:
+        return refresh_encoder_registry()
+    return _encoder_registry
+
+def get_available_encoders():
+    return _get_encoder_registry()['encoders']
+
+def resolve_encoder(codec, use_hardware_accel=True):
+    """O(1) encoder selection from the registry; raises ValueError like get_best_encoder."""
+    registry = _get_encoder_registry()
+    if codec not in registry['encoders']:
+        raise ValueError(f"No encoders for {codec}. Avail: {list(registry['encoders'].keys()) or 'None'}")
+    enc_info = registry['best'].get(f"{codec}:{'hw' if use_hardware_accel else 'sw'}")
+    if not enc_info: raise ValueError(f"No suitable encoder for {codec} with preferences.")
+    return dict(enc_info)
+
+def _encoder_registry_startup():
+    try: refresh_encoder_registry()
+    except Exception as e:
+        app.logger.error(f"Encoder capability probe failed: {e}", exc_info=True)
+        _encoder_registry_ready.set()
+
+if _OWNS_STREAMS:
+    threading.Thread(target=_encoder_registry_startup, name='encoder-registry', daemon=True).start()
+
+# --- End Encoder Capability Registry ---
+
+# --- Transcode Loop Cache ---
+# File streams loop the same source forever, so the encoded output never changes between loops.
+# A (source, encoder, resolution, fps, GOP, bitrate, audio) combination is encoded once in the background
+# into a loop-safe file; later starts of that combination publish it with "-c copy".
+TRANSCODE_CACHE_DIR = getattr(config, 'TRANSCODE_CACHE_DIR', os.path.join(BASE_TMP_DIR, 'transcode_cache'))
+TRANSCODE_CACHE_INDEX = os.path.join(TRANSCODE_CACHE_DIR, 'index.json')
+_transcode_cache_lock = threading.Lock()
+_transcode_cache_index = None
+_transcode_jobs = {} # key -> Future for queued/running transcodes
+_transcode_pool = ThreadPoolExecutor(max_workers=getattr(config, 'TRANSCODE_CACHE_WORKERS', 2), thread_name_prefix='transcode')
+_source_hash_memo = collections.OrderedDict() # (path, size, mtime_ns) -> content hash, least recently used first
+_source_hash_memo_lock = threading.Lock()
+_SOURCE_HASH_MEMO_MAX = 256
+
+def _transcode_cache_enabled_for(data):
+    return getattr(config, 'ENABLE_TRANSCODE_CACHE', False) and data.get('use_transcode_cache', 'yes') != 'no'
+
+def _source_identity(path):
+    """Identify a source file by content hash or by (path, size, mtime), depending on TRANSCODE_CACHE_KEY_MODE."""
+    real_path = os.path.realpath(path)
+    st = os.stat(real_path)
+    stat_key = (real_path, st.st_size, st.st_mtime_ns)
+    if getattr(config, 'TRANSCODE_CACHE_KEY_MODE', 'mtime') != 'content':
+        return f"{real_path}:{st.st_size}:{st.st_mtime_ns}"
+    with _source_hash_memo_lock:
+        if stat_key in _source_hash_memo:
+            _source_hash_memo.move_to_end(stat_key)
+            return _source_hash_memo[stat_key]
+    h = hashlib.sha256()
+    with open(real_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''): h.update(chunk)
+    with _source_hash_memo_lock:
+        # Earlier versions of the same file can't be asked for again
+        for stale in [k for k in _source_hash_memo if k[0] == real_path]: del _source_hash_memo[stale]
+        _source_hash_memo[stat_key] = f"sha256:{h.hexdigest()}"
+        while len(_source_hash_memo) > _SOURCE_HASH_MEMO_MAX: _source_hash_memo.popitem(last=False)
+        return _source_hash_memo[stat_key]
+
+def _load_transcode_index():
+    global _transcode_cache_index
+    if _transcode_cache_index is None:
+        _transcode_cache_index = {}
+        try:
+            if os.path.exists(TRANSCODE_CACHE_INDEX):
+                with open(TRANSCODE_CACHE_INDEX, 'r') as f: _transcode_cache_index = json.load(f)
+        except Exception as e:
+            app.logger.error(f"Failed to load transcode cache index: {e}")
+        # Drop entries whose files were deleted behind our back
+        _transcode_cache_index = {k: v for k, v in _transcode_cache_index.items() if os.path.exists(v.get('file', ''))}
+    return _transcode_cache_index
+
+def _save_transcode_index():
+    try:
+        os.makedirs(TRANSCODE_CACHE_DIR, exist_ok=True)
+        tmp_file = f"{TRANSCODE_CACHE_INDEX}.tmp"
+        with open(tmp_file, 'w') as f: json.dump(_transcode_cache_index, f, indent=2)
+        os.replace(tmp_file, TRANSCODE_CACHE_INDEX)
+    except Exception as e:
+        app.logger.error(f"Failed to save transcode cache index: {e}")
+
+def _transcode_cache_lookup(source_path, cache_params, hw_params, encode_args):
+    """Return (cached_file, state). On a miss, queue a background transcode and return (None, 'queued')."""
+    try:
+        source_id = _source_identity(source_path)
+    except OSError as e:
+        return None, f"unavailable ({e})"
+    key = hashlib.sha256(json.dumps([source_id, cache_params], sort_keys=True).encode()).hexdigest()[:24]
+    with _transcode_cache_lock:
+        entry = _load_transcode_index().get(key)
+        if entry and os.path.exists(entry['file']):
+            entry['last_used'] = time.time()
+            _save_transcode_index()
+            return entry['file'], 'hit'
+        if key not in _transcode_jobs:
+            _transcode_jobs[key] = _transcode_pool.submit(_run_transcode_job, key, source_path, source_id, cache_params, hw_params, encode_args)
+            return None, 'queued'
+        return None, 'transcoding'
+
+def _run_transcode_job(key, source_path, source_id, cache_params, hw_params, encode_args):
+    out_file = os.path.join(TRANSCODE_CACHE_DIR, f"{key}.mkv")
+    tmp_file = os.path.join(TRANSCODE_CACHE_DIR, f"{key}.partial.mkv")
+    log_file = os.path.join(LOG_DIR, f"transcode_{key}.log")
+    # Closed, fixed-size GOPs so the looped file restarts cleanly on a keyframe; Matroska holds any codec pair we emit
+    if '-movflags' in encode_args:
+        idx = encode_args.index('-movflags')
+        encode_args = encode_args[:idx] + encode_args[idx + 2:]
+    nice_prefix = ['nice', '-n', '10'] if shutil.which('nice') else []
+    cmd = (nice_prefix + ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error'] + hw_params + ['-i', source_path] + encode_args +
+           ['-sc_threshold', '0', '-flags', '+cgop', '-fflags', '+genpts', '-avoid_negative_ts', 'make_zero', '-f', 'matroska', tmp_file])
+    try:
+        os.makedirs(TRANSCODE_CACHE_DIR, exist_ok=True)
+        app.logger.info(f"Transcode cache: encoding {source_path} ({cache_params}) -> {out_file}")
+        t0 = time.time()
+        with open(log_file, 'w') as lf:
+            rc = subprocess.run(cmd, stdout=lf, stderr=lf, stdin=subprocess.DEVNULL).returncode
+        if rc != 0 or not os.path.exists(tmp_file):
+            app.logger.error(f"Transcode cache: encode of {source_path} failed (code {rc}), see {log_file}")
+            return False
+        os.replace(tmp_file, out_file)
+        with _transcode_cache_lock:
+            _load_transcode_index()[key] = {
+                'file': out_file, 'source': source_path, 'source_id': source_id, 'params': cache_params,
+                'size': os.path.getsize(out_file), 'created': time.time(), 'last_used': time.time(),
+                'encode_seconds': round(time.time() - t0, 1)}
+            _evict_transcode_cache()
+            _save_transcode_index()
+        app.logger.info(f"Transcode cache: {out_file} ready after {time.time() - t0:.1f}s")
+        return True
+    except Exception as e:
+        app.logger.error(f"Transcode cache: error encoding {source_path}: {e}", exc_info=True)
+        return False
+    finally:
+        if os.path.exists(tmp_file):
+            try: os.remove(tmp_file)
+            except OSError: pass
+        with _transcode_cache_lock:
+            _transcode_jobs.pop(key, None)
+
+def _transcode_files_in_use():
+    """Inputs (-i arguments) of running streams and of crashed streams waiting to restart with the same command."""
+    cmds = [d.get('cmd') for d in list(active_streams.values())]
+    with _restart_lock: cmds += [e.get('cmd') for e in _pending_restarts.values()]
+    inputs = set()
+    for cmd in cmds:
+        args = shlex.split(cmd) if isinstance(cmd, str) else list(cmd or [])
+        inputs.update(args[i + 1] for i, arg in enumerate(args[:-1]) if arg == '-i')
+    return inputs
+
+def _evict_transcode_cache():
+    """Remove least recently used cache files until the cache fits TRANSCODE_CACHE_MAX_MB. Caller holds the lock."""
+    budget = getattr(config, 'TRANSCODE_CACHE_MAX_MB', 10240) * 1024 * 1024
+    index = _load_transcode_index()
+    total = sum(e.get('size', 0) for e in index.values())
+    in_use = _transcode_files_in_use()
+    for key, entry in sorted(index.items(), key=lambda kv: kv[1].get('last_used', 0)):
+        if total <= budget: break
+        if entry['file'] in in_use: continue # Never pull a file out from under a running stream
+        try: os.remove(entry['file'])
+        except OSError: pass
+        total -= entry.get('size', 0)
+        index.pop(key, None)
+        app.logger.info(f"Transcode cache: evicted {entry['file']} ({entry.get('size', 0) / (1024*1024):.1f} MB)")
+
+@app.route('/transcode_cache', methods=['GET'])
+def get_transcode_cache_route():
+    """List cached loop assets and pending transcodes"""
+    with _transcode_cache_lock:
+        entries = [dict(v, key=k) for k, v in _load_transcode_index().items()]
+        pending = list(_transcode_jobs.keys())
+    return jsonify(success=True, enabled=getattr(config, 'ENABLE_TRANSCODE_CACHE', False), entries=entries, pending=pending,
+                   total_mb=round(sum(e.get('size', 0) for e in entries) / (1024*1024), 1),
+                   budget_mb=getattr(config, 'TRANSCODE_CACHE_MAX_MB', 10240))
+
+@app.route('/transcode_cache/clear', methods=['POST'])
+def clear_transcode_cache_route():
+    """Delete cached loop assets that no running stream is using"""
+    with _transcode_cache_lock:
+        index = _load_transcode_index()
+        in_use = _transcode_files_in_use()
+        removed = 0
+        for key, entry in list(index.items()):
+            if entry['file'] in in_use: continue
+            try: os.remove(entry['file'])
+            except OSError: pass
+            index.pop(key, None)
+            removed += 1
+        _save_transcode_index()
+    return jsonify(success=True, message=f"Removed {removed} cached transcodes", removed=removed)
+
+# --- End Transcode Loop Cache ---
+
+# --- Source-aware Passthrough ---
+# Probe the source once and copy each track (video, audio) that already matches the requested output.
+_source_probe_cache = collections.OrderedDict() # source -> (identity, probed_at, probe), least recently used first
+_source_probe_lock = threading.Lock()
+_SOURCE_PROBE_CACHE_MAX = 512
+_PROBE_CODEC_FAMILY = {'h264': 'h264', 'avc1': 'h264', 'hevc': 'h265', 'hev1': 'h265', 'hvc1': 'h265',
+                       'mpeg4': 'mpeg4', 'mp4v': 'mpeg4', 'fmp4': 'mpeg4'}
+
+def _probe_video_with_cv2(file_path):
+    """Read basic video properties with OpenCV. Returns None if the file can't be opened."""
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        return None
+    try:
+        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
+        return {
+            'fps': cap.get(cv2.CAP_PROP_FPS),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            'codec_tag_string': "".join([chr((fourcc >> 8 * i) & 0xFF) for i in range(4)]),
+        }
+    finally:
+        cap.release()
+
+def _parse_frame_rate(rate):
+    try:
+        num, _, den = str(rate).partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+def _probe_source(data):
+    """Describe the source's first video and audio track: {'video': {...} or None, 'audio': {...} or None}."""
+    if data.get('stream_type') == 'file':
+        source = data.get('video_file_path') or ''
+        try:
+            st = os.stat(source); identity = (st.st_size, st.st_mtime_ns); ttl = None
+        except OSError:
+            return None
+    else:
+        source = data.get('source_url') or ''
+        identity, ttl = None, getattr(config, 'PASSTHROUGH_PROBE_TTL', 60)
+    with _source_probe_lock:
+        cached = _source_probe_cache.get(source)
+        if cached and cached[0] == identity and (ttl is None or time.time() - cached[1] < ttl):
+            _source_probe_cache.move_to_end(source)
+            return cached[2]
+    probe = None
+    if shutil.which('ffprobe'):
+        cmd = ['ffprobe', '-v', 'error', '-show_streams', '-of', 'json']
+        if data.get('stream_type') == 'rtsp': cmd += ['-rtsp_transport', 'tcp']
+        try:
+            res = subprocess.run(cmd + ['-i', source], capture_output=True, text=True,
+                                 timeout=getattr(config, 'PASSTHROUGH_PROBE_TIMEOUT', 8))
+            if res.returncode == 0:
+                streams = json.loads(res.stdout or '{}').get('streams', [])
+                video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+                audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+                probe = {
+                    'video': {'codec': video.get('codec_name'), 'width': video.get('width'), 'height': video.get('height'),
+                              'fps': _parse_frame_rate(video.get('avg_frame_rate') or video.get('r_frame_rate')),
+                              'pix_fmt': video.get('pix_fmt')} if video else None,
+                    'audio': {'codec': audio.get('codec_name'), 'sample_rate': int(audio.get('sample_rate') or 0),
+                              'channels': audio.get('channels')} if audio else None,
+                    'prober': 'ffprobe'}
+        except (subprocess.TimeoutExpired, ValueError, OSError) as e: # The caller transcodes without a probe
+            app.logger.warning(f"ffprobe of {source} failed: {e}")
+    elif data.get('stream_type') == 'file':
+        info = _probe_video_with_cv2(source)
+        if info:
+            # OpenCV sees no audio, so audio is always transcoded on this path
+            probe = {'video': {'codec': info['codec_tag_string'].strip().lower(), 'width': info['width'],
+                               'height': info['height'], 'fps': info['fps'], 'pix_fmt': None},
+                     'audio': None, 'audio_unknown': True, 'prober': 'opencv'}
+    if probe:
+        with _source_probe_lock:
+            # One entry per source: a changed file or an expired live probe replaces the old one
+            _source_probe_cache[source] = (identity, time.time(), probe)
+            _source_probe_cache.move_to_end(source)
+            while len(_source_probe_cache) > _SOURCE_PROBE_CACHE_MAX: _source_probe_cache.popitem(last=False)
+    return probe
+
+def _plan_tracks(data, res_details, target_fps):
+    """Decide per track whether to copy or transcode. Returns {'video': ..., 'audio': ..., 'reasons': [...]}."""
+    audio_wanted = data.get('audio_enabled') == 'yes'
+    plan = {'video': 'transcode', 'audio': 'transcode' if audio_wanted else 'none', 'reasons': []}
+    if not getattr(config, 'ENABLE_PASSTHROUGH', False) or data.get('passthrough', 'auto') == 'off':
+        plan['reasons'].append('passthrough disabled')
+        return plan
+    source_url = (data.get('source_url') or '').lower()
+    if data.get('stream_type') == 'rtsp' and any(d in source_url for d in ['youtube.com', 'youtu.be', 'youtube-nocookie.com']):
+        plan['reasons'].append('YouTube sources are always transcoded')
+        return plan
+    probe = _probe_source(data)
+    if not probe:
+        plan['reasons'].append('source probe failed')
+        return plan
     
-    audio_codec_val = data.get('audio_codec')
-    if data.get('audio_enabled') == 'yes':
-        if audio_codec_val == 'aac':
-            audio_params = '-c:a aac -b:a 128k -ar 44100 -ac 2'
-        elif audio_codec_val == 'pcm_alaw':
-            audio_params = '-c:a pcm_alaw -ar 8000 -ac 1'
-        else: # Default to AAC if audio is enabled but codec is unknown
-            audio_params = '-c:a aac -b:a 128k -ar 44100 -ac 2' 
+    video = probe.get('video')
+    wanted_family = data.get('video_codec', 'h264')
+    if not video:
+        plan['reasons'].append('no video track found')
+    elif _PROBE_CODEC_FAMILY.get(str(video.get('codec')).lower()) != wanted_family:
+        plan['reasons'].append(f"video codec {video.get('codec')} != {wanted_family}")
+    elif (video.get('width'), video.get('height')) != (res_details['w'], res_details['h']):
+        plan['reasons'].append(f"video size {video.get('width')}x{video.get('height')} != {res_details['dim']}")
+    elif abs((video.get('fps') or 0) - target_fps) > 0.5:
+        plan['reasons'].append(f"video fps {video.get('fps') or 0:.2f} != {target_fps}")
+    elif video.get('pix_fmt') not in (None, 'yuv420p', 'yuvj420p'):
+        plan['reasons'].append(f"video pixel format {video.get('pix_fmt')} != yuv420p")
     else:
-        audio_params = '-an'
-        
-    # --- Bitrate and GOP selection based on resolution and FPS ---
+        plan['video'] = 'copy'
+    
+    if audio_wanted:
+        audio = probe.get('audio')
+        wanted_audio = data.get('audio_codec') if data.get('audio_codec') in ('aac', 'pcm_alaw') else 'aac'
+        wanted_format = {'aac': (44100, 2), 'pcm_alaw': (8000, 1)}[wanted_audio]
+        if not audio:
+            if not probe.get('audio_unknown'):
+                plan['audio'] = 'none'
+            plan['reasons'].append('no audio track found' if not probe.get('audio_unknown') else 'audio not probed')
+        elif audio.get('codec') != wanted_audio:
+            plan['reasons'].append(f"audio codec {audio.get('codec')} != {wanted_audio}")
+        elif (audio.get('sample_rate'), audio.get('channels')) != wanted_format:
+            plan['reasons'].append(f"audio format {audio.get('sample_rate')}Hz/{audio.get('channels')}ch != {wanted_format[0]}Hz/{wanted_format[1]}ch")
+        else:
+            plan['audio'] = 'copy'
+    return plan
+
+# --- End Source-aware Passthrough ---
+
+_RESOLUTION_MAP = {
+    '480': {'w': 854, 'h': 480, 'dim': '854x480'}, '720': {'w': 1280, 'h': 720, 'dim': '1280x720'},
+    '1080': {'w': 1920, 'h': 1080, 'dim': '1920x1080'}, '1440': {'w': 2560, 'h': 1440, 'dim': '2560x1440'},
+    '2160': {'w': 3840, 'h': 2160, 'dim': '3840x2160'}}
+
+# Base bitrates (kbps) at 15 fps per resolution for each codec
+h264_base_kbps = {
+    '480': 800,
+    '720': 1500,
+    '1080': 2500,
+    '1440': 4500,
+    '2160': 9000,
+}
+h265_base_kbps = {
+    '480': 500,
+    '720': 900,
+    '1080': 1600,
+    '1440': 3000,
+    '2160': 6000,
+}
+mpeg4_base_kbps = {
+    '480': 1000,
+    '720': 2000,
+    '1080': 4000,
+    '1440': 7000,
+    '2160': 12000,
+}
+
+def _target_fps(data):
     # Determine target FPS (fallback to 15)
     try:
         target_fps_int = int(str(data.get('target_fps', '15')))
@@ -612,53 +1185,46 @@ def construct_ffmpeg_command(data, encoder_info):
             target_fps_int = 15
     except Exception:
         target_fps_int = 15
+    return target_fps_int
 
-    # Base bitrates (kbps) at 15 fps per resolution for each codec
-    h264_base_kbps = {
-        '480': 800,
-        '720': 1500,
-        '1080': 2500,
-        '1440': 4500,
-        '2160': 9000,
-    }
-    h265_base_kbps = {
-        '480': 500,
-        '720': 900,
-        '1080': 1600,
-        '1440': 3000,
-        '2160': 6000,
-    }
-    mpeg4_base_kbps = {
-        '480': 1000,
-        '720': 2000,
-        '1080': 4000,
-        '1440': 7000,
-        '2160': 12000,
-    }
-
+def _select_bitrates_kbps(encoder_name, res_key, target_fps_int):
+    # Map encoder name to codec family
+    if '265' in encoder_name or 'hevc' in encoder_name:
+        base = h265_base_kbps
+    elif 'mpeg4' in encoder_name:
+        base = mpeg4_base_kbps
+    else:
+        base = h264_base_kbps
     # Scale bitrate approximately linearly with FPS relative to 15 fps
     fps_scale = max(0.5, min(2.0, target_fps_int / 15.0))
+    base_kbps = base.get(res_key, base['1080'])
+    target_kbps = int(base_kbps * fps_scale)
+    maxrate_kbps = int(target_kbps * 1.2)
+    bufsize_kbps = int(maxrate_kbps * 2)
+    return target_kbps, maxrate_kbps, bufsize_kbps
 
-    def _select_bitrates_kbps(encoder_name: str, res_key: str):
-        # Map encoder name to codec family
-        if '265' in encoder_name or 'hevc' in encoder_name:
-            base = h265_base_kbps
-        elif 'mpeg4' in encoder_name:
-            base = mpeg4_base_kbps
-        else:
-            base = h264_base_kbps
-        base_kbps = base.get(res_key, base['1080'])
-        target_kbps = int(base_kbps * fps_scale)
-        maxrate_kbps = int(target_kbps * 1.2)
-        bufsize_kbps = int(maxrate_kbps * 2)
-        return target_kbps, maxrate_kbps, bufsize_kbps
-
-    # Compute bitrate params and GOP
-    b_kbps, max_kbps, buf_kbps = _select_bitrates_kbps(encoder_info['name'], data.get('resolution', '1080'))
+def _audio_params(data):
+    audio_codec_val = data.get('audio_codec')
+    if data.get('audio_enabled') == 'yes':
+        if audio_codec_val == 'aac':
+            return ['-c:a', 'aac', '-b:a', '128k', '-ar', '44100', '-ac', '2']
+        elif audio_codec_val == 'pcm_alaw':
+            return ['-c:a', 'pcm_alaw', '-ar', '8000', '-ac', '1']
+        else: # Default to AAC if audio is enabled but codec is unknown
+            return ['-c:a', 'aac', '-b:a', '128k', '-ar', '44100', '-ac', '2']
+    return ['-an']
+
+def _video_encoder_params(encoder_info, res_key, target_fps_int, prescaled=False):
+    """Encoder argv for one rendition. Returns (vid_params, hw_params, bitrate_kbps, gop).
+    With prescaled=True the frames come already scaled from a filter graph, so no -s/-vf is added."""
+    res_details = _RESOLUTION_MAP.get(res_key, _RESOLUTION_MAP['1080'])
+    res_wh, res_dim = f"{res_details['w']}:{res_details['h']}", res_details['dim']
+    b_kbps, max_kbps, buf_kbps = _select_bitrates_kbps(encoder_info['name'], res_key, target_fps_int)
     gop_val = max(2, target_fps_int * 2)
+    size_arg = '' if prescaled else f'-s {res_dim} '
 
     # Build encoder-specific params
-    enc_name, enc_type = encoder_info['name'], encoder_info['type']
+    enc_name = encoder_info['name']
     vid_params, hw_params = '', ''
     if enc_name == 'h264_nvenc':
         vid_params = f'-c:v h264_nvenc -preset llhq -rc:v vbr -cq:v 19 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
@@ -666,71 +1232,211 @@ def construct_ffmpeg_command(data, encoder_info):
         vid_params = f'-c:v hevc_nvenc -preset llhq -rc:v vbr -cq:v 19 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
     elif enc_name == 'h264_vaapi':
         hw_params = '-hwaccel vaapi -hwaccel_device /dev/dri/renderD128 -hwaccel_output_format vaapi'
-        vid_params = f'-vf "format=nv12,hwupload,scale_vaapi={res_wh}:force_original_aspect_ratio=decrease" -c:v h264_vaapi -qp 23 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
+        vf = '' if prescaled else f'-vf "format=nv12,hwupload,scale_vaapi={res_wh}:force_original_aspect_ratio=decrease" '
+        vid_params = f'{vf}-c:v h264_vaapi -qp 23 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
     elif enc_name == 'hevc_vaapi':
         hw_params = '-hwaccel vaapi -hwaccel_device /dev/dri/renderD128 -hwaccel_output_format vaapi'
-        vid_params = f'-vf "format=nv12|vaapi,hwupload,scale_vaapi={res_wh}:force_original_aspect_ratio=decrease" -c:v hevc_vaapi -qp 23 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
+        vf = '' if prescaled else f'-vf "format=nv12|vaapi,hwupload,scale_vaapi={res_wh}:force_original_aspect_ratio=decrease" '
+        vid_params = f'{vf}-c:v hevc_vaapi -qp 23 -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val}'
     elif enc_name == 'libx264':
-        vid_params = f'-c:v libx264 -preset veryfast -profile:v baseline -level 3.0 -s {res_dim} -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -pix_fmt yuv420p -movflags +faststart'
+        vid_params = f'-c:v libx264 -preset veryfast -profile:v baseline -level 3.0 {size_arg}-b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -pix_fmt yuv420p -movflags +faststart'
     elif enc_name == 'libx265':
-        vid_params = f'-c:v libx265 -preset veryfast -tune zerolatency -profile:v main -level 4.0 -s {res_dim} -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -pix_fmt yuv420p'
+        vid_params = f'-c:v libx265 -preset veryfast -tune zerolatency -profile:v main -level 4.0 {size_arg}-b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -b:v {b_kbps}k -maxrate {max_kbps}k -bufsize {buf_kbps}k -pix_fmt yuv420p'
     elif enc_name == 'mpeg4':
-        vid_params = f'-c:v mpeg4 -s {res_dim} -b:v {b_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -pix_fmt yuv420p'
+        vid_params = f'-c:v mpeg4 {size_arg}-b:v {b_kbps}k -b_strategy 0 -bf 0 -g {gop_val} -keyint_min {gop_val} -pix_fmt yuv420p'
     else: raise ValueError(f"Unsupported encoder: {enc_name}")
-    
+    # The templates above only hold fixed option text, so splitting them is safe
+    return shlex.split(vid_params), shlex.split(hw_params), b_kbps, gop_val
+
+def _resolve_youtube_url(source_url):
+    """Ask yt-dlp for the direct media URL of a YouTube page. Raises ValueError if it can't."""
+    if not shutil.which('yt-dlp'):
+        raise ValueError("yt-dlp is not installed; YouTube sources are unavailable")
+    try:
+        res = subprocess.run(['yt-dlp', '-f', 'best', '-g', source_url], capture_output=True, text=True,
+                             timeout=getattr(config, 'YTDLP_TIMEOUT', 30), stdin=subprocess.DEVNULL)
+    except subprocess.TimeoutExpired:
+        raise ValueError(f"yt-dlp timed out resolving {source_url}")
+    media_url = next((line.strip() for line in res.stdout.splitlines() if line.strip()), '')
+    if res.returncode != 0 or not media_url:
+        raise ValueError(f"yt-dlp could not resolve {source_url}: {res.stderr.strip()[-300:]}")
+    return media_url
+
+def _input_args(data):
     source_url_val = data.get('source_url','') # ensure source_url_val is defined
     if data['stream_type'] == 'rtsp':
         # Check if it's a YouTube URL
         if config.ENABLE_YOUTUBE_SUPPORT and any(domain in source_url_val.lower() for domain in ['youtube.com', 'youtu.be', 'youtube-nocookie.com']):
-            # Use yt-dlp to get the best stream URL
-            input_cmd = f'-re -i "$(yt-dlp -f best -g \'{source_url_val}\')"'
-        else:
-            input_cmd = f"-re -i '{source_url_val}'"
+            # Resolved here rather than in a $(yt-dlp ...) subshell, so ffmpeg needs no shell
+            return ['-re', '-i', _resolve_youtube_url(source_url_val)]
+        return ['-re', '-i', source_url_val]
     elif data['stream_type'] == 'file':
-        input_cmd = f"-re -stream_loop -1 -i '{data['video_file_path']}'"
-    else: # Should not happen due to prior validation
-        input_cmd = ""
+        return ['-re', '-stream_loop', '-1', '-i', data['video_file_path']]
+    return [] # Should not happen due to prior validation
+
+def _cmd_str(cmd):
+    """Printable form of an argv list, for logs, crash reports and API responses."""
+    return shlex.join(cmd) if isinstance(cmd, (list, tuple)) else str(cmd or '')
+
+def _apply_thread_budget(name, cmd):
+    """Cap the command's encoder, decoder and filter threads at this stream's share of the host thread budget.
+    The share is reserved under ``name`` straight away, so streams built in parallel (batches, jobs, restore) are sized
+    against each other rather than against an idle host. Launch paths release it with _release_cpu if the spawn fails."""
+    if not _thread_budget: return cmd
+    return apply_thread_budget(cmd, _thread_budget.reserve(name, estimate_cost(cmd)))
+
+def construct_ffmpeg_command(data, encoder_info, start_hls=True):
+    stream_name = data['stream_name']
+    if _abr_ladder(data):
+        return _apply_thread_budget(stream_name, _construct_abr_command(data, encoder_info))
+    res_key = data.get('resolution', '1080')
+    res_details = _RESOLUTION_MAP.get(res_key, _RESOLUTION_MAP['1080'])
+    res_dim = res_details['dim']
+    audio_params = _audio_params(data)
+    
+    # --- Bitrate and GOP selection based on resolution and FPS ---
+    target_fps_int = _target_fps(data)
+    vid_params, hw_params, b_kbps, gop_val = _video_encoder_params(encoder_info, res_key, target_fps_int)
+    enc_name, enc_type = encoder_info['name'], encoder_info['type']
+    input_cmd = _input_args(data)
         
-    # Create HLS directory for this stream
-    hls_dir = os.path.join(config.HLS_DIR, stream_name)
+    scale_params = ['-s', res_dim] if enc_type != 'hardware_amd' and '-s' not in vid_params else []
+    rate_params = ['-r', str(target_fps_int)]
+    
+    # Copy each track that already matches the requested output instead of re-encoding it
+    track_plan = _plan_tracks(data, res_details, target_fps_int)
+    data['track_plan'] = track_plan
+    if track_plan['video'] == 'copy':
+        hw_params, vid_params, rate_params, scale_params = [], ['-c:v', 'copy'], [], []
+        # Copying keeps the source's own bitrate and keyframe spacing; say so rather than drop them silently
+        track_plan['reasons'].append(f"video copied: source bitrate and GOP kept instead of {b_kbps}k and GOP {gop_val}")
+    if track_plan['audio'] == 'copy':
+        audio_params = ['-c:a', 'copy']
+    
+    cached_file = None
+    if data['stream_type'] == 'file' and track_plan['video'] == 'transcode' and _transcode_cache_enabled_for(data):
+        cache_params = {'encoder': enc_name, 'resolution': res_dim, 'fps': target_fps_int, 'gop': gop_val,
+                        'bitrate_kbps': b_kbps, 'audio': " ".join(audio_params)}
+        encode_args = audio_params + vid_params + rate_params + scale_params
+        cached_file, cache_state = _transcode_cache_lookup(data['video_file_path'], cache_params, hw_params, encode_args)
+        data['transcode_cache'] = cache_state
+    
+    cmd = ['ffmpeg']
+    if cached_file:
+        # Loop the pre-encoded asset with stream copy: no decode or encode in steady state
+        cmd += ['-re', '-stream_loop', '-1', '-i', cached_file, '-map', '0', '-c', 'copy']
+    else:
+        cmd += hw_params + input_cmd + audio_params + vid_params + rate_params + scale_params
+    
+    # In tee mode this one process writes both RTSP and HLS; otherwise HLS comes from a separate converter
+    cmd += _stream_output_args(stream_name, with_hls=start_hls, mapped=bool(cached_file))
+    # In converter mode the caller starts a supervised HLS converter once the stream is registered.
+    # A duration limit is enforced by the reaper deadline rather than a timeout(1) wrapper.
+    return _apply_thread_budget(stream_name, cmd)
+
+def _hls_tee_enabled():
+    return getattr(config, 'HLS_OUTPUT_MODE', 'tee') == 'tee'
+
+_RTSP_TEE_OPTS = "f=rtsp:rtsp_transport=tcp:rtsp_flags=prefer_tcp"
+
+def _hls_tee_target(hls_dir):
+    """tee muxer slave that writes an HLS playlist and its segments into hls_dir."""
     os.makedirs(hls_dir, exist_ok=True)
+    # onfail=ignore keeps RTSP publishing if the HLS slave fails (disk full, dir removed)
+    hls_opts = ":".join([
+        "f=hls", "onfail=ignore", f"hls_time={config.HLS_SEGMENT_DURATION}", f"hls_list_size={config.HLS_PLAYLIST_SIZE}",
+        "hls_flags=delete_segments+append_list+independent_segments", "hls_allow_cache=0",
+        f"hls_segment_filename={hls_dir}/segment_%03d.ts"])
+    return f"[{hls_opts}]{hls_dir}/playlist.m3u8"
+
+def _stream_output_args(stream_name, with_hls=True, mapped=False):
+    """Output section of an ffmpeg command: RTSP only, or RTSP plus HLS through the tee muxer."""
+    rtsp_url = f"rtsp://localhost:8554/{stream_name}"
+    if not (with_hls and _hls_tee_enabled()):
+        return ['-f', 'rtsp', '-rtsp_transport', 'tcp', '-rtsp_flags', 'prefer_tcp', rtsp_url]
+    tee_targets = f"[{_RTSP_TEE_OPTS}]{rtsp_url}|{_hls_tee_target(os.path.join(config.HLS_DIR, stream_name))}"
+    # The tee muxer only receives explicitly mapped streams
+    map_args = [] if mapped else ['-map', '0:v:0', '-map', '0:a:0?']
+    return map_args + ['-f', 'tee', tee_targets]
+
+def _cleanup_hls_dir(stream_name):
+    """Remove a stopped stream's HLS playlist and segments."""
+    hls_dir = os.path.join(config.HLS_DIR, stream_name)
+    if os.path.isdir(hls_dir):
+        shutil.rmtree(hls_dir, ignore_errors=True)
+
+# --- ABR Ladder ---
+# A stream with "abr_ladder" (e.g. ["1080", "720", "480"]) decodes its source once, splits and scales
+# it to every rendition, and encodes them with one keyframe cadence so the renditions switch cleanly.
+# Each rendition is published to rtsp://.../<name>_<res>p (the top one also to <name>) and to its own
+# HLS variant under HLS_DIR/<name>/<res>p/, referenced by HLS_DIR/<name>/master.m3u8.
+
+def _validate_abr_ladder(value):
+    """Normalise an abr_ladder request value (list or comma string) to heights, highest first."""
+    if isinstance(value, str):
+        value = [v for v in value.split(',') if v.strip()]
+    if not isinstance(value, (list, tuple)):
+        raise ValueError("abr_ladder must be a list of resolutions")
+    ladder = []
+    for res in value:
+        res = str(res).strip().lower().rstrip('p')
+        if res not in _RESOLUTION_MAP:
+            raise ValueError(f"Bad ABR rendition '{res}'. Allowed: {', '.join(_RESOLUTION_MAP)}")
+        if res not in ladder: ladder.append(res)
+    return sorted(ladder, key=int, reverse=True)
+
+def _abr_ladder(data):
+    try:
+        return _validate_abr_ladder(data.get('abr_ladder') or [])
+    except ValueError:
+        return []
+
+def _abr_rendition_path(stream_name, res):
+    return f"{stream_name}_{res}p"
+
+def _write_abr_master_playlist(stream_name, ladder, fps, encoder_info, audio_params):
+    hls_root = os.path.join(config.HLS_DIR, stream_name)
+    os.makedirs(hls_root, exist_ok=True)
+    audio_bps = 128000 if 'aac' in audio_params else (64000 if 'pcm_alaw' in audio_params else 0)
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+    for res in ladder:
+        b_kbps, max_kbps, _ = _select_bitrates_kbps(encoder_info['name'], res, fps)
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={max_kbps * 1000 + audio_bps},AVERAGE-BANDWIDTH={b_kbps * 1000 + audio_bps},"
+                     f"RESOLUTION={_RESOLUTION_MAP[res]['dim']},FRAME-RATE={fps:.3f}")
+        lines.append(f"{res}p/playlist.m3u8")
+    tmp_path = os.path.join(hls_root, "master.m3u8.tmp")
+    with open(tmp_path, 'w') as f: f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, os.path.join(hls_root, "master.m3u8"))
+
+def _construct_abr_command(data, encoder_info):
+    stream_name = data['stream_name']
+    ladder = _abr_ladder(data)
+    fps = _target_fps(data)
+    audio_params = _audio_params(data)
+    hls_root = os.path.join(config.HLS_DIR, stream_name)
+    on_vaapi = encoder_info['name'].endswith('_vaapi')
     
-    cmd_parts = ["ffmpeg"]
-    if hw_params: cmd_parts.append(hw_params)
-    cmd_parts.extend([input_cmd, audio_params, vid_params, f"-r {target_fps_int}"])
-    if enc_type != 'hardware_amd' and f'-s {res_dim}' not in vid_params: cmd_parts.append(f"-s {res_dim}")
-    
-    # For now, let's use RTSP only to avoid dual output issues
-    # We'll implement HLS conversion separately for better stability
-    rtsp_output = f"-f rtsp -rtsp_transport tcp -rtsp_flags prefer_tcp rtsp://localhost:8554/{stream_name}"
-    
-    cmd_parts.append(rtsp_output)
-    cmd_str = " ".join(filter(None, cmd_parts))
-    
-    # Start HLS conversion in background after a short delay
-    def start_hls_conversion():
-        time.sleep(5)  # Wait for RTSP stream to start
-        hls_cmd = f"ffmpeg -i rtsp://localhost:8554/{stream_name} -c:v copy -c:a copy -f hls -hls_time {config.HLS_SEGMENT_DURATION} -hls_list_size {config.HLS_PLAYLIST_SIZE} -hls_flags delete_segments+append_list+independent_segments -hls_segment_filename {hls_dir}/segment_%03d.ts -hls_allow_cache 0 {hls_dir}/playlist.m3u8"
-        subprocess.Popen(hls_cmd, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    
-    # Start HLS conversion in background thread
-    hls_thread = threading.Thread(target=start_hls_conversion, daemon=True)
-    hls_thread.start()
-    dur_hr = data.get('duration_hours', '0'); 
-    if dur_hr.isdigit() and int(dur_hr) > 0: 
-        # Use cross-platform timeout approach
-        if config.IS_WINDOWS:
-            # Windows doesn't have timeout command, we'll handle duration in Python
-            pass  # Duration will be handled by the monitoring thread
-        elif config.IS_MACOS:
-            # macOS doesn't have timeout command by default, use gtimeout if available or handle in Python
-            if shutil.which('gtimeout'):
-                cmd_str = f"gtimeout {int(dur_hr)*3600} {cmd_str}"
-            # Otherwise, duration will be handled by the monitoring thread
-        else:
-            # Linux - use timeout command
-            cmd_str = f"timeout {int(dur_hr)*3600} {cmd_str}"
-    return cmd_str
+    # Decode once, normalise the frame rate, then split: every rendition sees identical frame timing
+    graph = [f"[0:v]fps={fps},split={len(ladder)}" + "".join(f"[v{i}]" for i in range(len(ladder)))]
+    outputs, hw_params = [], []
+    for i, res in enumerate(ladder):
+        w, h = _RESOLUTION_MAP[res]['w'], _RESOLUTION_MAP[res]['h']
+        scaler = f"scale_vaapi={w}:{h}:force_original_aspect_ratio=decrease" if on_vaapi else f"scale={w}:{h}"
+        graph.append(f"[v{i}]{scaler}[s{i}]")
+        vid_params, hw_params, _, gop_val = _video_encoder_params(encoder_info, res, fps, prescaled=True)
+        # Same GOP length, no scene-cut keyframes and forced keyframes on the same timestamps in every rendition
+        keyframes = ['-sc_threshold', '0', '-force_key_frames', f"expr:gte(t,n_forced*{gop_val / fps:g})"]
+        if encoder_info['name'] == 'libx265':
+            keyframes += ['-x265-params', 'scenecut=0:open-gop=0']
+        rtsp_names = [_abr_rendition_path(stream_name, res)] + ([stream_name] if i == 0 else [])
+        targets = [f"[{_RTSP_TEE_OPTS}]rtsp://localhost:8554/{n}" for n in rtsp_names]
+        targets.append(_hls_tee_target(os.path.join(hls_root, f"{res}p")))
+        outputs += ['-map', f"[s{i}]", '-map', '0:a:0?'] + audio_params + vid_params + keyframes + ['-f', 'tee', '|'.join(targets)]
+    
+    _write_abr_master_playlist(stream_name, ladder, fps, encoder_info, audio_params)
+    return ['ffmpeg'] + hw_params + _input_args(data) + ['-filter_complex', ';'.join(graph)] + outputs
+
+# --- End ABR Ladder ---
 
 def _get_stream_paths(name):
     return {k: os.path.join(d, f"ffmpeg_{name}{ext}") for k, d, ext in [
@@ -738,7 +1444,15 @@ def _get_stream_paths(name):
         ('pid_file', PID_DIR, ".pid"), ('status_file', STATUS_DIR, ".status"), ('error_file', STATUS_DIR, ".error"),
         ('crash_report_file', CRASH_LOG_DIR, "_crash.log")]}
 
+def _stream_name_of_status_file(status_file):
+    """The stream a status file belongs to, or None for files not made by _get_stream_paths (shared encoders, HLS converters)."""
+    name = os.path.basename(status_file or '')[len("ffmpeg_"):-len(".status")]
+    return name if name and _get_stream_paths(name)['status_file'] == status_file else None
+
 def _update_status(paths, status_msg, error_msg=None):
+    name = _stream_name_of_status_file(paths.get('status_file'))
+    if name: # Keep the registry's status index in step with the status files
+        active_streams.set_status(name, status_msg, error_msg)
     try:
         with open(paths['status_file'], 'w') as f: f.write(status_msg)
         if error_msg: 
@@ -792,7 +1506,7 @@ def _read_log_tail(file_path, num_lines):
 
 def _save_crash_report(name, paths, cmd, code, reason="Unknown"):
     _update_status(paths, "error", f"{reason} (Code: {code}) Report: {paths['crash_report_file']}")
-    report = [f"FFmpeg Crash: {name} @ {time.strftime('%Y-%m-%d %H:%M:%S')}", f"Code: {code}, Reason: {reason}", f"Cmd: {cmd}", ""]
+    report = [f"FFmpeg Crash: {name} @ {time.strftime('%Y-%m-%d %H:%M:%S')}", f"Code: {code}, Reason: {reason}", f"Cmd: {_cmd_str(cmd)}", ""]
     for desc, key, n_lines in [("Wrapper", 'log_file', 50), ("STDOUT", 'out_file', 50), ("STDERR", 'err_file', 100)]:
         report.append(f"--- {desc} (last {n_lines}) ---"); report.extend(_read_log_tail(paths.get(key, ''), n_lines)); report.append("")
     report.append("--- System Info ---")
@@ -815,62 +1529,68 @@ def _save_crash_report(name, paths, cmd, code, reason="Unknown"):
         _log(paths, f"Crash report: {paths['crash_report_file']}")
     except Exception as e: _log(paths, f"Error saving crash report: {e}")
 
-def _terminate_process_group(pid, log_paths, stream_name):
+def _group_alive(pgid, proc=None):
+    """True while the process group still has members. A Popen leader is polled (and so reaped) first,
+    since an unreaped zombie leader would keep the group visible to killpg."""
+    if proc is not None and proc.poll() is None: return True
+    try: os.killpg(pgid, 0)
+    except ProcessLookupError: return False
+    except PermissionError: return True
+    return True
+
+def _signal_group(pid, sig, log_paths, stream_name):
+    """Send sig to a process group. Returns False if the group is already gone."""
+    try:
+        os.killpg(pid, sig)
+        _log(log_paths, f"Sent {signal.Signals(sig).name} to PGID {pid} for {stream_name}")
+        return True
+    except ProcessLookupError: _log(log_paths, f"PGID {pid} not found for {signal.Signals(sig).name}."); return False
+    except Exception as e: _log(log_paths, f"Error sending {signal.Signals(sig).name} to PGID {pid}: {e}"); return True
+
+def _terminate_process_group(pid, log_paths, stream_name, proc=None, grace=None):
+    """SIGTERM a process group, wait up to `grace` seconds for it to actually exit, then SIGKILL what is left."""
     _log(log_paths, f"Terminating process group {pid} for {stream_name}")
-    try: 
-        os.killpg(pid, signal.SIGTERM)
-        _log(log_paths, f"Sent SIGTERM to PGID {pid} for {stream_name}")
-    except ProcessLookupError: _log(log_paths, f"PGID {pid} not found for SIGTERM."); return
-    except Exception as e: _log(log_paths, f"Error sending SIGTERM to PGID {pid}: {e}")
-    time.sleep(2) # Grace period
-    try: 
-        os.killpg(pid, signal.SIGKILL)
-        _log(log_paths, f"Sent SIGKILL to PGID {pid} for {stream_name}")
-    except ProcessLookupError: _log(log_paths, f"PGID {pid} not found for SIGKILL.")
-    except Exception as e: _log(log_paths, f"Error sending SIGKILL to PGID {pid}: {e}")
+    if not _signal_group(pid, signal.SIGTERM, log_paths, stream_name): return
+    deadline = time.monotonic() + (getattr(config, 'STOP_GRACE_PERIOD', 2.0) if grace is None else grace)
+    while _group_alive(pid, proc):
+        if time.monotonic() >= deadline:
+            _signal_group(pid, signal.SIGKILL, log_paths, stream_name)
+            return
+        time.sleep(0.02)
+    _log(log_paths, f"PGID {pid} for {stream_name} exited after SIGTERM")
 
-def _monitor_ffmpeg(name, cmd, proc, duration_s, paths, stop_event):
-    _log(paths, f"Monitor started for {name} (PID {proc.pid}).")
-    start_t = time.time(); normal_exit = False
-    try:
-        while not stop_event.is_set():
-            rc = proc.poll()
-            if rc is not None:
-                elapsed = time.time() - start_t
-                _log(paths, f"{name} (PID {proc.pid}) exited (code {rc}) after {elapsed:.1f}s.")
-                is_timeout_kill = ("timeout " in cmd or "gtimeout " in cmd) and rc == 124 # timeout utility exit code for timeout
-                was_stopped_by_event = stop_event.is_set()
-                
-                if rc == 0 or (duration_s and is_timeout_kill and abs(elapsed - duration_s) < 20) or was_stopped_by_event:
-                    _update_status(paths, "stopped", "Stream stopped normally."); normal_exit = True
-                else:
-                    reason = "FFmpeg crashed"
-                    if ("timeout " in cmd or "gtimeout " in cmd) and rc != 0 and rc != 124: # Error from timeout utility itself or ffmpeg called by it
-                        reason += f" (via timeout utility, code {rc})"
-                    elif is_timeout_kill: # Timeout happened but not near expected duration_s (premature)
-                        reason += f" (killed by timeout utility prematurely or unexpectedly, code {rc})"
-                    _save_crash_report(name, paths, cmd, rc, reason)
-                break 
-            if duration_s and (time.time() - start_t) > duration_s and not stop_event.is_set():
-                _log(paths, f"Duration {duration_s}s up for {name}. Terminating PID {proc.pid}.")
-                _terminate_process_group(proc.pid, paths, name)
-                # _terminate_process_group will attempt to kill, poll should pick it up soon
-            if stop_event.wait(timeout=10): break
-    except Exception as e: 
-        _log(paths, f"Monitor error for {name} (PID {proc.pid if proc else 'N/A'}): {e}")
-        if proc and proc.poll() is None: _save_crash_report(name, paths, cmd, -99, f"Monitor exception: {e}")
+def _handle_ffmpeg_deadline(name, proc, duration_s, paths, stop_event):
+    """Reaper deadline callback: the stream's duration is up."""
+    if proc.poll() is not None or stop_event.is_set(): return
+    _log(paths, f"Duration {duration_s}s up for {name}. Terminating PID {proc.pid}.")
+    stop_event.set() # Expiry is a normal stop, not a crash
+    _terminate_process_group(proc.pid, paths, name, proc)
+
+def _handle_ffmpeg_exit(name, cmd, start_t, duration_s, paths, stop_event, exit_event, proc, rc):
+    """Reaper exit callback: runs once per stream when its ffmpeg process exits."""
+    normal_exit = False
+    # Adopted processes always report ADOPTED_EXIT_UNKNOWN (-1, which reads like SIGHUP): their status is not ours to collect
+    unknown_exit = rc is EXIT_UNKNOWN or getattr(proc, 'adopted', False)
+    try:
+        elapsed = time.time() - start_t
+        _log(paths, f"{name} (PID {proc.pid}) exited (code {rc}) after {elapsed:.1f}s.")
+        # Duration expiry goes through _handle_ffmpeg_deadline, which sets stop_event first
+        if rc == 0 or stop_event.is_set():
+            _update_status(paths, "stopped", "Stream stopped normally."); normal_exit = True
+        else:
+            if getattr(proc, 'adopted', False):
+                reason = "Adopted FFmpeg exited (exit code unavailable)"
+            else:
+                reason = "FFmpeg exited (exit code unknown)" if unknown_exit else "FFmpeg crashed" if rc > 0 else f"FFmpeg killed by signal {-rc}"
+            if not unknown_exit and rc == -signal.SIGKILL and _stream_oom_killed(name, proc):
+                reason = "FFmpeg killed by the kernel OOM killer (stream cgroup reached memory.max)"
+            _save_crash_report(name, paths, cmd, rc, reason)
+    except Exception as e:
+        _log(paths, f"Exit handler error for {name} (PID {proc.pid}): {e}")
     finally:
-        if proc: 
-            if proc.stdout: proc.stdout.close()
-            if proc.stderr: proc.stderr.close()
-            if proc.poll() is None and stop_event.is_set(): 
-                _log(paths, f"Ensuring {name} (PID {proc.pid}) is stopped due to stop_event.")
-                _terminate_process_group(proc.pid, paths, name)
         if os.path.exists(paths['pid_file']): 
             try: os.remove(paths['pid_file'])
             except OSError: pass 
-        if not normal_exit and not stop_event.is_set() and proc and proc.poll() is None:
-             _save_crash_report(name, paths, cmd, -1, "Monitor ended; process may be running or unpolled")
         
         # Always set final status to "stopped" for cleanup, regardless of how the stream ended
         # This ensures crashed/errored streams don't persist indefinitely in the UI
@@ -879,93 +1599,904 @@ def _monitor_ffmpeg(name, cmd, proc, duration_s, paths, stop_event):
             _update_status(paths, "stopped", "Stream cleanup completed")
         
         _log(paths, f"Monitor stopped for {name}.")
-        active_streams.pop(name, None)
+        details = active_streams.get(name)
+        owned = bool(details and details.get('process') is proc)
+        suspended = owned and bool(details.get('suspend_requested'))
+        # Decided before the entry is dropped, so a restart keeps the name reserved throughout.
+        # An unknown exit code is not treated as a crash: the stream may well have been stopped on purpose
+        crashed = owned and not normal_exit and not suspended and not _shutdown_in_progress and not unknown_exit
+        restart = _record_crash(name, details['config'], time.time() - start_t) if crashed else None
+        if owned:
+            active_streams.discard(name, details)
+            _scheduler.cancel(f"expire:{name}"); _scheduler.cancel(f"health:{name}")
+            if details['config'].get('shared_encoder'):
+                _release_shared_encoder(details['config']['shared_encoder'], name)
+            _stop_hls_converter(name, details)
+            _release_stream_cgroup(details.get('cgroup'))
+            _release_cpu(name)
+            if not (restart and restart[0] == 'restart'): # ABR master playlists outlive a restart
+                _cleanup_hls_dir(name)
         
+        if suspended:
+            # Idle-suspended streams stay persisted and are relaunched on the next reader
+            _update_status(paths, "suspended")
+            _log(paths, f"{name} suspended (no readers).")
+        elif restart and restart[0] == 'restart':
+            # Stays persisted while it waits, so a server restart in between restores it
+            _schedule_restart(name, {'cmd': cmd, 'config': details['config'], 'start_time': start_t, 'duration_s': duration_s,
+                                     'reason': f"exit code {rc}"}, restart[1])
+        elif restart:
+            _park_stream(name, details['config'], restart[1])
         # Only remove stream state from persistence if we're not shutting down
-        if not _shutdown_in_progress:
+        elif not _shutdown_in_progress:
             remove_stream_state(name)
         else:
             _log(paths, f"Preserving stream state for {name} due to shutdown")
+        exit_event.set()
+
+_spawn_latencies = collections.deque(maxlen=1000) # Seconds per Popen, most recent last
+_spawn_counts = {'total': 0, 'failed': 0}
+
+def _spawn_ffmpeg(name, cmd, paths, cpus=None):
+    """Start an ffmpeg argv in its own session with stdout/stderr going to the stream's log files.
+    No shell and no preexec_fn, so CPython can use its vfork/posix_spawn fast path and proc.pid is ffmpeg itself.
+    With ``cpus``, ffmpeg inherits that CPU set from the spawning thread, so none of its threads start elsewhere."""
+    out_log, err_log = None, None
+    try:
+        out_log = open(paths['out_file'], 'wb'); err_log = open(paths['err_file'], 'wb')
+        t0 = time.perf_counter()
+        try:
+            with spawn_affinity(cpus):
+                proc = subprocess.Popen(cmd, stdout=out_log, stderr=err_log, stdin=subprocess.DEVNULL, start_new_session=True)
+        except Exception:
+            _spawn_counts['failed'] += 1
+            raise
+        _spawn_latencies.append(time.perf_counter() - t0)
+        _spawn_counts['total'] += 1
+        app.logger.info(f"[{name}] Popen successful, PID: {proc.pid} ({_spawn_latencies[-1] * 1000:.1f} ms)")
+        with open(paths['pid_file'], 'w') as f: f.write(str(proc.pid))
+        return proc
+    finally:
+        # The child holds its own copies of the log descriptors
+        if out_log: out_log.close()
+        if err_log: err_log.close()
+
+@app.route('/spawn_stats', methods=['GET'])
+def spawn_stats_route():
+    """Latency of recent ffmpeg process spawns (Popen call only), in milliseconds"""
+    samples = sorted(_spawn_latencies)
+    def pct(p): return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2) if samples else None
+    return jsonify(success=True, total=_spawn_counts['total'], failed=_spawn_counts['failed'], window=len(samples),
+                   last_ms=round(_spawn_latencies[-1] * 1000, 2) if samples else None,
+                   mean_ms=round(sum(samples) / len(samples) * 1000, 2) if samples else None,
+                   p50_ms=pct(0.5), p95_ms=pct(0.95), max_ms=round(samples[-1] * 1000, 2) if samples else None)
+
+def _stream_limits(stream_config):
+    return resolve_limits(stream_config, getattr(config, 'STREAM_RESOURCE_CLASSES', {}), getattr(config, 'DEFAULT_RESOURCE_CLASS', 'standard'))
+
+def _place_in_cgroup(name, proc, stream_config):
+    """Move a new stream's ffmpeg into a cgroup of its own with the stream's limits. Returns the cgroup path, or None."""
+    if not _cgroups.enabled: return None
+    path = None
+    try:
+        path = _cgroups.create(name, _stream_limits(stream_config))
+        _cgroups.attach(path, proc.pid)
+        return path
+    except (OSError, ValueError) as e:
+        app.logger.warning(f"[{name}] Not placed in a cgroup, polling health limits apply: {e}")
+        if path:
+            try: _cgroups.remove(path)
+            except OSError: pass
+        return None
+
+def _release_stream_cgroup(path, attempt=0):
+    """Remove a finished stream's cgroup. Whatever is still inside after the stop grace period is killed first."""
+    if not path: return
+    if attempt: _cgroups.kill(path)
+    try:
+        if _cgroups.remove(path): return
+    except OSError as e:
+        app.logger.warning(f"Could not remove cgroup {path}: {e}")
+        return
+    if attempt < 5: # Otherwise left for the next startup's prune
+        delay = getattr(config, 'STOP_GRACE_PERIOD', 2) + 1 if not attempt else 1
+        _scheduler.call_later(delay, _release_stream_cgroup, path, attempt + 1, name=f"cgroup-rm:{os.path.basename(path)}", lane='maintenance')
+
+def _claim_cpu(name, cmd):
+    """Count an encoder about to start against the thread budget (confirming the share reserved when its command was
+    built, or adding one for restarts and adopted streams) and pick cores of its own, sized to its expected cost.
+    Returns the CPU list to spawn it on, or None. Callers release the claim with _release_cpu if the spawn fails."""
+    cost = estimate_cost(cmd)
+    if _thread_budget: _thread_budget.commit(name, cost)
+    return _placement.place(name, cost) if _placement else None
+
+def _release_cpu(name):
+    """Return a stopped encoder's share of the thread budget, free its cores and rebalance shortly after
+    (one pass for a whole batch of stops)."""
+    if _thread_budget: _thread_budget.release(name)
+    if _placement and _placement.release(name):
+        _scheduler.call_later(getattr(config, 'PLACEMENT_REBALANCE_DELAY', 2), _rebalance_placement, name='placement-rebalance', lane='maintenance')
+
+def _placement_processes(name):
+    """Running processes pinned under a placement name: a stream's ffmpeg and HLS converter, or a shared encoder."""
+    if name.startswith('shared_'):
+        with _shared_encoders_lock:
+            entry = _shared_encoders.get(name[len('shared_'):])
+        return [entry['process']] if entry else []
+    details = active_streams.get(name)
+    if not details: return []
+    hls = details.get('hls_converter')
+    return [p for p in (details.get('process'), hls['process'] if hls else None) if p and p.poll() is None]
+
+def _rebalance_placement():
+    moved = _placement.rebalance() if _placement else {}
+    for name, cpus in moved.items():
+        for proc in _placement_processes(name):
+            apply_affinity(proc.pid, cpus)
+    if moved:
+        app.logger.info(f"CPU placement: moved {len(moved)} streams onto less loaded cores")
+
+def _stream_oom_killed(name, proc):
+    """True if the kernel OOM-killed something in the stream's cgroup (it hit memory.max)."""
+    details = active_streams.get(name)
+    path = details.get('cgroup') if details and details.get('process') is proc else None
+    usage = _cgroups.usage(path) if path else None
+    return bool(usage and usage['oom_kills'])
+
+@app.route('/timers', methods=['GET'])
+def timers_route():
+    """Pending scheduler timers, soonest first. ?prefix=health: filters by name, ?limit= caps the list"""
+    timers = _scheduler.pending(prefix=request.args.get('prefix') or None)
+    try: limit = max(0, int(request.args.get('limit', 1000)))
+    except ValueError: return jsonify(success=False, message="limit must be an integer"), 400
+    return jsonify(success=True, total=len(timers), timers=timers[:limit], scheduler=_scheduler.stats(), reaper=_child_reaper.stats())
 
 def exec_and_monitor_ffmpeg(name, cmd, duration_hrs_str, data, encoder_info):
     if name in active_streams: return False, "Stream name active."
     paths = _get_stream_paths(name)
-    for f_key in paths: 
-        if os.path.exists(paths[f_key]): 
-            try: os.remove(paths[f_key])
-            except OSError as e: _log(paths, f"Could not remove old file {paths[f_key]}: {e}")
-    _log(paths, f"Starting {name}. Cmd: {cmd}"); _update_status(paths, "starting")
-    proc, out_log, err_log = None, None, None
-    try:
-        out_log = open(paths['out_file'], 'wb'); err_log = open(paths['err_file'], 'wb')
-        proc = subprocess.Popen(cmd, shell=True, stdout=out_log, stderr=err_log, 
-                                stdin=subprocess.DEVNULL, preexec_fn=os.setsid)
-        app.logger.info(f"[{name}] Popen successful, PID: {proc.pid}")
-        with open(paths['pid_file'], 'w') as f: f.write(str(proc.pid))
-    except Exception as e: 
-        _log(paths, f"Popen fail for {name}: {e}"); _save_crash_report(name, paths, cmd, -1, f"Popen fail: {e}")
-        if out_log: out_log.close(); 
-        if err_log: err_log.close()
-        app.logger.info(f"[{name}] Returning False: Popen exception.")
-        return False, f"FFmpeg Popen failed: {e}"
-    
-    time.sleep(0.5) 
-    
-    poll_result = proc.poll()
-    app.logger.info(f"[{name}] proc.poll() result after 0.5s: {poll_result}")
-    
-    if poll_result is not None:
-        rc = poll_result
-        app.logger.info(f"[{name}] FFmpeg died immediately (code {rc}). Saving crash report.")
-        _save_crash_report(name, paths, cmd, rc, "FFmpeg died immediately")
-        if out_log: out_log.close(); 
-        if err_log: err_log.close()
-        if os.path.exists(paths['pid_file']): 
-            try: os.remove(paths['pid_file'])
-            except OSError: pass
-        app.logger.info(f"[{name}] Returning False: FFmpeg failed on start.")
-        return False, "FFmpeg failed on start."
-    
-    app.logger.info(f"[{name}] FFmpeg process seems alive. Updating status to running.")
-    _update_status(paths, "running"); _log(paths, f"{name} running post-check.")
-    
-    dur_s = int(duration_hrs_str) * 3600 if duration_hrs_str.isdigit() and int(duration_hrs_str) > 0 else 0
-    stop_ev = threading.Event()
-    
-    app.logger.info(f"[{name}] Starting monitor thread.")
-    mon_thread = threading.Thread(target=_monitor_ffmpeg, args=(name, cmd, proc, dur_s, paths, stop_ev), daemon=True)
-    mon_thread.start()
+    for f_key in paths: 
+        if os.path.exists(paths[f_key]): 
+            try: os.remove(paths[f_key])
+            except OSError as e: _log(paths, f"Could not remove old file {paths[f_key]}: {e}")
+    _log(paths, f"Starting {name}. Cmd: {_cmd_str(cmd)}"); _update_status(paths, "starting")
+    cpus = _claim_cpu(name, cmd)
+    try:
+        proc = _spawn_ffmpeg(name, cmd, paths, cpus)
+    except Exception as e: 
+        _release_cpu(name)
+        _log(paths, f"Popen fail for {name}: {e}"); _save_crash_report(name, paths, cmd, -1, f"Popen fail: {e}")
+        app.logger.info(f"[{name}] Returning False: Popen exception.")
+        return False, f"FFmpeg Popen failed: {e}"
+    cgroup = _place_in_cgroup(name, proc, data) # Straight after the spawn, before ffmpeg gets going
+    
+    # Catch commands that die straight away (bad args, missing input); later exits go to the reaper
+    spawn_check = getattr(config, 'SPAWN_CHECK_DELAY', 0.5)
+    try:
+        poll_result = proc.wait(timeout=spawn_check) if spawn_check > 0 else proc.poll()
+    except subprocess.TimeoutExpired:
+        poll_result = None
+    app.logger.info(f"[{name}] proc.poll() result after {spawn_check}s: {poll_result}")
+    
+    if poll_result is not None:
+        rc = poll_result
+        app.logger.info(f"[{name}] FFmpeg died immediately (code {rc}). Saving crash report.")
+        _save_crash_report(name, paths, cmd, rc, "FFmpeg died immediately")
+        _release_stream_cgroup(cgroup); _release_cpu(name)
+        if os.path.exists(paths['pid_file']): 
+            try: os.remove(paths['pid_file'])
+            except OSError: pass
+        app.logger.info(f"[{name}] Returning False: FFmpeg failed on start.")
+        return False, "FFmpeg failed on start."
+    
+    app.logger.info(f"[{name}] FFmpeg process seems alive. Updating status to running.")
+    _update_status(paths, "running"); _log(paths, f"{name} running post-check.")
+    
+    # Restores pass the remaining fraction of an hour, so accept floats
+    try:
+        dur_s = max(0, int(float(duration_hrs_str or 0) * 3600))
+    except ValueError:
+        dur_s = 0
+    start_t = time.time()
+    
+    initial_config = {
+        'video_codec': data.get('video_codec', 'h264'),
+        'resolution': data.get('resolution', '1080'),
+        'target_fps': data.get('target_fps', '15'),
+        'audio_enabled': data.get('audio_enabled', 'no'),
+        'audio_codec': data.get('audio_codec', 'aac'),
+        'hardware_accel': data.get('hardware_accel', 'no'),
+        'duration_hours': data.get('duration_hours', '0'),
+        'encoder_details': encoder_info,
+        'stream_type': data.get('stream_type'),
+        'source_url': data.get('source_url') if data.get('stream_type') == 'rtsp' else None,
+        'video_file': data.get('video_file') if data.get('stream_type') == 'file' and data.get('file_source_type') != 'custom' else None,
+        'file_source_type': data.get('file_source_type') if data.get('stream_type') == 'file' else None,
+        'video_file_path': data.get('video_file_path') if data.get('stream_type') == 'file' else None,
+        'shared_encoder': data.get('shared_encoder'),
+        'transcode_cache': data.get('transcode_cache'),
+        'track_plan': data.get('track_plan'),
+        # Per-request opt-outs, kept so restores and wakes behave like the original start
+        'passthrough': data.get('passthrough', 'auto'),
+        'fanout': data.get('fanout', 'yes'),
+        'use_transcode_cache': data.get('use_transcode_cache', 'yes'),
+        'on_demand': data.get('on_demand', 'yes'),
+        'abr_ladder': _abr_ladder(data) or None,
+        'priority': data.get('priority', 0), # Restore order after a restart, highest first
+        'restart_policy': data.get('restart_policy', 'on-failure'),
+        'max_restarts': data.get('max_restarts'), # None = RESTART_MAX_RETRIES
+        # cgroup limits: the class's defaults, then any per-stream overrides
+        'resource_class': data.get('resource_class'),
+        'cpu_limit': data.get('cpu_limit'),
+        'memory_limit_mb': data.get('memory_limit_mb'),
+        'io_weight': data.get('io_weight'),
+    }
+    _register_stream(name, proc, cmd, paths, initial_config, start_t, dur_s, cgroup=cgroup)
+    app.logger.info(f"[{name}] Returning True: Stream started.")
+    return True, "Stream started."
+
+def _register_stream(name, proc, cmd, paths, stream_config, start_t, dur_s, persist=True, cgroup=None):
+    """Track a running ffmpeg in active_streams and hand it to the reaper (new or adopted process)."""
+    stop_ev = threading.Event()
+    exit_ev = threading.Event()
+    if cgroup is None:
+        cgroup = _cgroups.find(proc.pid) # An adopted ffmpeg is still in the cgroup the previous instance made
+    app.logger.info(f"[{name}] Storing stream details in active_streams.")
+    active_streams.add(StreamRecord(name, proc, cmd, stop_ev, exit_ev, paths, stream_config, start_t, dur_s, cgroup=cgroup))
+    
+    # Save stream state for persistence
+    if persist:
+        save_stream_state(name, stream_config)
+    
+    if dur_s:
+        _scheduler.call_later(start_t + dur_s - time.time(), _handle_ffmpeg_deadline, name, proc, dur_s, paths, stop_ev, name=f"expire:{name}")
+    _schedule_health_check(name, proc)
+    
+    # Registered last so an early exit always finds the active_streams entry to clean up
+    _log(paths, f"Monitor started for {name} (PID {proc.pid}).")
+    _child_reaper.watch(proc, functools.partial(_handle_ffmpeg_exit, name, cmd, start_t, dur_s, paths, stop_ev, exit_ev))
+
+# --- Shared Encoder Fan-out ---
+# Streams with an identical encode signature (same source, codec, resolution, fps, audio and encoder)
+# share one ffmpeg encoder that publishes to an internal MediaMTX path. Each stream name is then a cheap
+# "-c copy" relay of that path. The encoder is reference counted and stops with its last subscriber.
+_shared_encoders = {}
+_shared_encoders_lock = threading.Lock()
+_shared_starting = {} # sig -> {'done': Event, 'subscribers': set, 'error': str}; the command is built and spawned outside the lock
+
+def _encode_signature(data, encoder_info):
+    if data.get('stream_type') == 'file':
+        source = os.path.realpath(data.get('video_file_path') or '')
+    else:
+        source = data.get('source_url') or ''
+    audio = data.get('audio_codec', 'aac') if data.get('audio_enabled') == 'yes' else 'none'
+    parts = [data.get('stream_type'), source, data.get('video_codec', 'h264'), data.get('resolution', '1080'),
+             str(data.get('target_fps', '15')), audio, encoder_info['name']]
+    return hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:12]
+
+def _get_shared_encoder_paths(sig):
+    # "shared_" prefix keeps these files out of the per-stream status listing
+    return {k: os.path.join(d, f"shared_{sig}{ext}") for k, d, ext in [
+        ('log_file', LOG_DIR, ".log"), ('out_file', LOG_DIR, ".out"), ('err_file', LOG_DIR, ".err"),
+        ('pid_file', PID_DIR, ".pid"), ('status_file', STATUS_DIR, ".shared_status"), ('error_file', STATUS_DIR, ".shared_error"),
+        ('crash_report_file', CRASH_LOG_DIR, "_shared_crash.log")]}
+
+def _handle_shared_encoder_exit(sig, cmd, paths, stop_event, proc, rc):
+    _log(paths, f"Shared encoder {sig} (PID {proc.pid}) exited (code {rc}).")
+    if rc != 0 and not stop_event.is_set():
+        _save_crash_report(f"shared_{sig}", paths, cmd, rc, "Shared encoder crashed")
+    if os.path.exists(paths['pid_file']):
+        try: os.remove(paths['pid_file'])
+        except OSError: pass
+    with _shared_encoders_lock:
+        entry = _shared_encoders.get(sig)
+        if entry and entry['process'] is proc:
+            _shared_encoders.pop(sig, None)
+        replaced = bool(entry and entry['process'] is not proc) or sig in _shared_starting
+    if not replaced: _release_cpu(f"shared_{sig}")
+    # Subscriber relays lose their input and exit on their own; their exit handlers release their references.
+
+def _acquire_shared_encoder(sig, stream_name, data, encoder_info):
+    """Subscribe stream_name to the encoder for sig, starting it if needed. Returns the internal path name.
+    Building the command can probe the source for seconds, so it happens outside _shared_encoders_lock;
+    concurrent starts of the same signature wait for the first one instead of spawning a second encoder."""
+    path_name = f"shared_{sig}"
+    with _shared_encoders_lock:
+        entry = _shared_encoders.get(sig)
+        if entry and entry['process'].poll() is None:
+            entry['subscribers'].add(stream_name)
+            _log(entry['paths'], f"Subscriber {stream_name} added to shared encoder {sig} ({len(entry['subscribers'])} total)")
+            return entry['path_name']
+        starting = _shared_starting.get(sig)
+        owner = starting is None
+        if owner:
+            # A dead encoder's subscribers move to its replacement, so their releases still count down the new one
+            carried = _shared_encoders.pop(sig)['subscribers'] if entry else set()
+            starting = _shared_starting[sig] = {'done': threading.Event(), 'subscribers': carried | {stream_name}, 'error': None}
+        else:
+            starting['subscribers'].add(stream_name)
+    if owner:
+        _start_shared_encoder(sig, path_name, starting, data, encoder_info, stream_name)
+    else:
+        starting['done'].wait()
+        if starting['error']:
+            raise RuntimeError(f"Shared encoder {sig} failed to start: {starting['error']}")
+    # Relays fail immediately if the internal path has no publisher yet
+    if not _wait_for_mediamtx_path(path_name, getattr(config, 'FANOUT_READY_TIMEOUT', 10)):
+        app.logger.warning(f"Shared encoder {sig} not reported ready by MediaMTX, starting relay for {stream_name} anyway")
+    return path_name
+
+def _start_shared_encoder(sig, path_name, starting, data, encoder_info, stream_name):
+    """Build and spawn the encoder for a "starting" marker, then publish it under the lock. Always wakes the waiters."""
+    try:
+        enc_data = dict(data, stream_name=path_name, duration_hours='0')
+        cmd = construct_ffmpeg_command(enc_data, encoder_info, start_hls=False)
+        paths = _get_shared_encoder_paths(sig)
+        _log(paths, f"Starting shared encoder {sig} for {stream_name}. Cmd: {_cmd_str(cmd)}")
+        cpus = _claim_cpu(path_name, cmd)
+        try:
+            proc = _spawn_ffmpeg(path_name, cmd, paths, cpus)
+        except Exception:
+            _release_cpu(path_name)
+            raise
+        stop_ev = threading.Event()
+        with _shared_encoders_lock:
+            entry = {'path_name': path_name, 'process': proc, 'cmd': cmd, 'paths': paths, 'stop_event': stop_ev,
+                     'subscribers': starting['subscribers'], 'start_time': time.time(), 'encoder_details': encoder_info}
+            _shared_encoders[sig] = entry
+            _shared_starting.pop(sig, None)
+        _child_reaper.watch(proc, functools.partial(_handle_shared_encoder_exit, sig, cmd, paths, stop_ev))
+    except Exception as e:
+        with _shared_encoders_lock:
+            _shared_starting.pop(sig, None)
+        starting['error'] = str(e)
+        raise
+    finally:
+        starting['done'].set()
+
+def _release_shared_encoder(path_name, stream_name):
+    """Drop stream_name's reference; stop the shared encoder once nobody subscribes to it."""
+    sig = path_name[len("shared_"):]
+    with _shared_encoders_lock:
+        if sig in _shared_starting: # Still being started; the new encoder just won't count this subscriber
+            _shared_starting[sig]['subscribers'].discard(stream_name)
+            return
+        entry = _shared_encoders.get(sig)
+        if not entry: return
+        entry['subscribers'].discard(stream_name)
+        if entry['subscribers']:
+            _log(entry['paths'], f"Subscriber {stream_name} released shared encoder {sig} ({len(entry['subscribers'])} left)")
+            return
+        _shared_encoders.pop(sig, None)
+    _log(entry['paths'], f"Last subscriber {stream_name} released shared encoder {sig}, stopping it")
+    entry['stop_event'].set()
+    if entry['process'].poll() is None:
+        _terminate_process_group(entry['process'].pid, entry['paths'], path_name, entry['process'])
+
+def _construct_relay_command(path_name, stream_name):
+    return (['ffmpeg', '-hide_banner', '-rtsp_transport', 'tcp', '-i', f"rtsp://localhost:8554/{path_name}", '-map', '0', '-c', 'copy']
+            + _stream_output_args(stream_name, mapped=True))
+
+def _fanout_enabled_for(data):
+    # ABR streams already share one decode across their renditions
+    return getattr(config, 'ENABLE_ENCODE_FANOUT', False) and data.get('fanout', 'yes') != 'no' and not _abr_ladder(data)
+
+_launching_names = set() # Names reserved by launches still in progress
+_launching_lock = threading.Lock()
+
+def _launch_stream(name, data, enc_info, duration_hrs_str):
+    """Build the command for a validated stream request and start it. Returns (ok, msg, cmd)."""
+    # Reserve the name so parallel launches (async jobs, batches, restore) can't start it twice
+    with _launching_lock:
+        if name in active_streams or name in _launching_names: return False, "Stream name active.", None
+        _launching_names.add(name)
+    try:
+        return _launch_reserved_stream(name, data, enc_info, duration_hrs_str)
+    finally:
+        with _launching_lock:
+            _launching_names.discard(name)
+
+def _launch_reserved_stream(name, data, enc_info, duration_hrs_str):
+    for derived_key in ('shared_encoder', 'transcode_cache', 'track_plan'): data.pop(derived_key, None)
+    shared_path = None
+    if _fanout_enabled_for(data):
+        sig = _encode_signature(data, enc_info)
+        shared_path = _acquire_shared_encoder(sig, name, data, enc_info)
+        data['shared_encoder'] = shared_path
+        ff_cmd = _construct_relay_command(shared_path, name)
+    else:
+        ff_cmd = construct_ffmpeg_command(data, enc_info)
+    try:
+        ok, msg = exec_and_monitor_ffmpeg(name, ff_cmd, duration_hrs_str, data, enc_info)
+    except Exception:
+        _release_cpu(name) # The thread budget share reserved while building the command
+        raise
+    if not ok:
+        _release_cpu(name)
+    if not ok and shared_path:
+        _release_shared_encoder(shared_path, name)
+    if ok and not _hls_tee_enabled() and not _abr_ladder(data):
+        # Relays are ordinary streams too, so every launched stream gets its own converter
+        _start_hls_converter(name)
+    return ok, msg, ff_cmd
+
+@app.route('/shared_encoders', methods=['GET'])
+def get_shared_encoders_route():
+    """List shared fan-out encoders and the streams subscribed to each"""
+    with _shared_encoders_lock:
+        encoders = [{
+            'signature': sig,
+            'path': entry['path_name'],
+            'pid': entry['process'].pid,
+            'encoder': entry['encoder_details'].get('name'),
+            'subscribers': sorted(entry['subscribers']),
+            'start_timestamp': entry['start_time'],
+        } for sig, entry in _shared_encoders.items()]
+    return jsonify(success=True, enabled=getattr(config, 'ENABLE_ENCODE_FANOUT', False), encoders=encoders)
+
+# --- End Shared Encoder Fan-out ---
+
+# --- HLS Converter Supervision ---
+# In HLS_OUTPUT_MODE=converter each stream gets a child ffmpeg that remuxes its RTSP output to HLS.
+# The converter lives in the stream's active_streams entry, is killed with it, and is restarted
+# whenever it exits while its upstream is still running (e.g. after the RTSP publisher reconnects).
+
+def _get_hls_converter_paths(name):
+    # "hls_" prefix keeps these files out of the per-stream status listing
+    return {k: os.path.join(d, f"hls_{name}{ext}") for k, d, ext in [
+        ('log_file', LOG_DIR, ".log"), ('out_file', LOG_DIR, ".out"), ('err_file', LOG_DIR, ".err"),
+        ('pid_file', PID_DIR, ".pid")]}
+
+def _construct_hls_converter_command(stream_name):
+    hls_dir = os.path.join(config.HLS_DIR, stream_name)
+    os.makedirs(hls_dir, exist_ok=True)
+    return ['ffmpeg', '-hide_banner', '-rtsp_transport', 'tcp', '-i', f"rtsp://localhost:8554/{stream_name}", '-c:v', 'copy', '-c:a', 'copy',
+            '-f', 'hls', '-hls_time', str(config.HLS_SEGMENT_DURATION), '-hls_list_size', str(config.HLS_PLAYLIST_SIZE),
+            '-hls_flags', 'delete_segments+append_list+independent_segments', '-hls_segment_filename', f"{hls_dir}/segment_%03d.ts",
+            '-hls_allow_cache', '0', f"{hls_dir}/playlist.m3u8"]
+
+def _hls_upstream_alive(stream_name, upstream):
+    details = active_streams.get(stream_name)
+    if not details or details.get('process') is not upstream or details['stop_event'].is_set() or upstream.poll() is not None:
+        return None
+    return details
+
+def _start_hls_converter(stream_name):
+    """Attach a supervised HLS converter to an active stream."""
+    details = active_streams.get(stream_name)
+    if not details: return
+    details['hls_converter'] = {'process': None, 'cmd': None, 'paths': _get_hls_converter_paths(stream_name),
+                                'restarts': 0, 'failures': 0, 'started_at': None, 'lock': threading.Lock()}
+    threading.Thread(target=_run_hls_converter, args=(stream_name, details['process']), daemon=True).start()
+
+def _run_hls_converter(stream_name, upstream):
+    """Spawn the converter once upstream publishes. Does nothing if the stream has stopped or been replaced."""
+    ready = _wait_for_mediamtx_path(stream_name, getattr(config, 'HLS_CONVERTER_READY_TIMEOUT', 10))
+    details = _hls_upstream_alive(stream_name, upstream)
+    if not details: return
+    hls = details['hls_converter']
+    with hls['lock']:
+        if hls['process'] and hls['process'].poll() is None: return
+        if not ready:
+            _log(hls['paths'], f"RTSP path {stream_name} not reported ready, starting HLS converter anyway")
+        cmd = _construct_hls_converter_command(stream_name)
+        try: # Shares its stream's cores
+            proc = _spawn_ffmpeg(f"{stream_name} HLS", cmd, hls['paths'], _placement.cpus_of(stream_name) if _placement else None)
+        except Exception as e:
+            _log(hls['paths'], f"HLS converter spawn failed for {stream_name}: {e}")
+            return
+        if details.get('cgroup'): # Counted and limited together with the stream's ffmpeg
+            try: _cgroups.attach(details['cgroup'], proc.pid)
+            except OSError as e: _log(hls['paths'], f"Could not move HLS converter for {stream_name} into {details['cgroup']}: {e}")
+        hls.update(process=proc, cmd=cmd, started_at=time.time())
+        _log(hls['paths'], f"HLS converter for {stream_name} started (PID {proc.pid}). Cmd: {_cmd_str(cmd)}")
+    _child_reaper.watch(proc, functools.partial(_handle_hls_converter_exit, stream_name, upstream))
+
+def _handle_hls_converter_exit(stream_name, upstream, proc, rc):
+    paths = _get_hls_converter_paths(stream_name)
+    if os.path.exists(paths['pid_file']):
+        try: os.remove(paths['pid_file'])
+        except OSError: pass
+    details = _hls_upstream_alive(stream_name, upstream)
+    if not details or details['hls_converter']['process'] is not proc:
+        _log(paths, f"HLS converter for {stream_name} (PID {proc.pid}) exited (code {rc}).")
+        return
+    hls = details['hls_converter']
+    # Back off while the converter keeps failing fast; a converter that ran a while restarts promptly
+    hls['failures'] = 0 if time.time() - (hls['started_at'] or 0) > 30 else hls['failures'] + 1
+    hls['restarts'] += 1
+    delay = min(getattr(config, 'HLS_CONVERTER_RESTART_DELAY', 2) * (hls['failures'] + 1), 30)
+    _log(paths, f"HLS converter for {stream_name} (PID {proc.pid}) exited (code {rc}) while upstream is running, restarting in {delay}s")
+    _scheduler.call_later(delay, _run_hls_converter, stream_name, upstream, name=f"hls-restart:{stream_name}", lane='launch')
+
+def _stop_hls_converter(stream_name, details):
+    hls = details.get('hls_converter')
+    if not hls: return
+    with hls['lock']:
+        proc = hls['process']
+    if proc and proc.poll() is None:
+        _terminate_process_group(proc.pid, hls['paths'], f"{stream_name} HLS", proc)
+
+# --- End HLS Converter Supervision ---
+
+# --- On-demand Encoding ---
+# Streams nobody is watching are stopped after IDLE_SUSPEND_GRACE seconds with zero MediaMTX readers
+# (and no HLS requests). A suspended stream keeps its persisted config; a MediaMTX path entry with a
+# runOnDemand hook calls /streams/<name>/wake when a reader connects, and HLS playlist requests wake it too.
+_suspended_streams = {} # name -> {'config', 'suspended_at', 'wakes', 'waking'}
+_suspend_lock = threading.Lock()
+_idle_since = {} # name -> time the stream was first seen without readers
+_hls_last_access = {} # name -> time of the last HLS playlist request
+
+def _on_demand_enabled_for(stream_config):
+    if not getattr(config, 'ENABLE_IDLE_SUSPEND', False) or stream_config.get('on_demand', 'yes') == 'no':
+        return False
+    # Timed streams keep running so their duration means wall-clock time
+    return str(stream_config.get('duration_hours') or '0') in ('0', '0.0')
+
+def _configure_on_demand_path(name, enable):
+    """Add (or remove) the MediaMTX path entry whose runOnDemand hook wakes a suspended stream."""
+    if not enable:
+        status, _ = _mediamtx_api(f"/v3/config/paths/delete/{name}", 'DELETE')
+        return status in (200, 404)
+    wake_url = f"http://127.0.0.1:{config.PORT}/streams/{name}/wake"
+    body = {'source': 'publisher', 'runOnDemand': f"curl -fsS -X POST {wake_url}", 'runOnDemandRestart': False,
+            'runOnDemandStartTimeout': f"{int(getattr(config, 'IDLE_WAKE_TIMEOUT', 20))}s"}
+    status, _ = _mediamtx_api(f"/v3/config/paths/add/{name}", 'POST', body)
+    if status == 400: # Already configured, e.g. by a previous run of the app
+        status, _ = _mediamtx_api(f"/v3/config/paths/patch/{name}", 'PATCH', body)
+    return status == 200
+
+def _suspend_stream(name):
+    """Stop an idle stream's ffmpeg but keep it registered for wake-up. Returns True if suspended."""
+    details = active_streams.get(name)
+    if not details or details['stop_event'].is_set(): return False
+    if not _configure_on_demand_path(name, True):
+        app.logger.warning(f"Could not register runOnDemand hook for {name}; leaving it running")
+        return False
+    with _suspend_lock:
+        wakes = _suspended_streams.get(name, {}).get('wakes', 0)
+        _suspended_streams[name] = {'config': dict(details['config']), 'suspended_at': time.time(), 'wakes': wakes, 'waking': False}
+    _log(details['paths'], f"Suspending {name}: no readers for {getattr(config, 'IDLE_SUSPEND_GRACE', 60)}s")
+    details['suspend_requested'] = True
+    details['stop_event'].set()
+    if details['process'].poll() is None:
+        _terminate_process_group(details['process'].pid, details['paths'], name, details['process'])
+    return True
+
+def _wake_stream(name):
+    """Relaunch a suspended stream. Returns (ok, msg)."""
+    with _suspend_lock:
+        entry = _suspended_streams.get(name)
+        if not entry:
+            return (True, f"{name} is running.") if name in active_streams else (False, f"{name} is not suspended.")
+        if entry['waking']:
+            return True, f"{name} is already waking."
+        entry['waking'] = True
+    return _run_wake(name, entry)
+
+def _request_wake(name):
+    """Schedule one wake for a suspended stream on the launch lane. Returns False if it is not suspended."""
+    with _suspend_lock:
+        entry = _suspended_streams.get(name)
+        if not entry:
+            return False
+        if entry['waking']:
+            return True
+        entry['waking'] = True
+    _scheduler.call_later(0, _run_wake, name, entry, name=f"wake:{name}", lane='launch')
+    return True
+
+_hls_reader_reports = collections.OrderedDict() # client mode: name -> (reported_at, waking) from the supervisor
+_hls_reader_reports_lock = threading.Lock()
+_HLS_READER_REPORTS_MAX = 1024
+
+def _note_hls_reader(name, wake=True):
+    """Count an HLS playlist request as a reader for idle suspend and, with ``wake``, wake a suspended stream.
+    Returns True while the stream is waking. Client workers report to the supervisor at most every
+    HLS_READER_REPORT_INTERVAL seconds per stream, and on every request while it is waking."""
+    if _OWNS_STREAMS:
+        _hls_last_access[name] = time.time()
+        return _request_wake(name) if wake else False
+    now = time.monotonic()
+    with _hls_reader_reports_lock:
+        last = _hls_reader_reports.get(name)
+        if last and not last[1] and now - last[0] < getattr(config, 'HLS_READER_REPORT_INTERVAL', 5):
+            return False
+    try:
+        waking = bool(_supervisor_client().call('hls_reader', timeout=5, name=name, wake=wake))
+    except (SupervisorUnavailable, SupervisorError) as e:
+        app.logger.warning(f"Could not report HLS reader for {name}: {e}")
+        return False
+    with _hls_reader_reports_lock:
+        _hls_reader_reports[name] = (now, waking)
+        _hls_reader_reports.move_to_end(name)
+        while len(_hls_reader_reports) > _HLS_READER_REPORTS_MAX:
+            _hls_reader_reports.popitem(last=False)
+    return waking
+
+def _run_wake(name, entry):
+    """Launch a suspended stream whose entry the caller has marked as waking. Returns (ok, msg)."""
+    wake_t = time.time()
+    ok, msg = False, ""
+    try:
+        details = active_streams.get(name)
+        if details and details.get('suspend_requested'):
+            details['exit_event'].wait(timeout=7) # Suspend still tearing the old process down
+        stream_config = dict(entry['config'], stream_name=name)
+        enc_info = resolve_encoder(stream_config.get('video_codec', 'h264'), stream_config.get('hardware_accel') == 'yes')
+        ok, msg, _ = _launch_stream(name, stream_config, enc_info, '0')
+    except ValueError as e:
+        msg = str(e)
+    finally:
+        with _suspend_lock:
+            if ok:
+                _suspended_streams.pop(name, None)
+            else:
+                entry['waking'] = False
+    if ok:
+        _idle_since.pop(name, None)
+        entry['wakes'] += 1
+        app.logger.info(f"Woke {name} after {wake_t - entry['suspended_at']:.0f}s suspended (launch took {time.time() - wake_t:.2f}s)")
+    else:
+        app.logger.error(f"Failed to wake {name}: {msg}")
+    return ok, msg
+
+def _forget_suspended_stream(name):
+    """Drop a suspended stream for good (user stop). Returns True if it was suspended."""
+    with _suspend_lock:
+        entry = _suspended_streams.pop(name, None)
+    if not entry: return False
+    _idle_since.pop(name, None)
+    _configure_on_demand_path(name, False)
+    return True
+
+def _idle_check():
+    """Suspend on-demand streams whose MediaMTX path has had no readers for the grace period."""
+    interval = getattr(config, 'IDLE_CHECK_INTERVAL', 5)
+    if _shutdown_in_progress: return
+    try:
+        status, listing = _mediamtx_api("/v3/paths/list?itemsPerPage=10000")
+        if status != 200 or not listing: return # API unreachable: never suspend blind
+        readers = {item.get('name'): len(item.get('readers') or []) for item in listing.get('items', [])}
+        now = time.time()
+        grace = getattr(config, 'IDLE_SUSPEND_GRACE', 60)
+        hls_window = max(3 * config.HLS_SEGMENT_DURATION, 2 * interval)
+        for name, details in list(active_streams.items()):
+            if (not _on_demand_enabled_for(details['config']) or details['stop_event'].is_set()
+                    or name not in readers # Not published yet
+                    or readers[name] + sum(readers.get(_abr_rendition_path(name, r), 0) for r in details['config'].get('abr_ladder') or []) > 0
+                    or now - _hls_last_access.get(name, 0) < hls_window
+                    or now - details.get('start_time', now) < grace):
+                _idle_since.pop(name, None)
+                continue
+            if now - _idle_since.setdefault(name, now) >= grace:
+                _idle_since.pop(name, None)
+                _suspend_stream(name)
+    except Exception as e:
+        app.logger.error(f"Error in idle check: {e}")
+
+@app.route('/streams/<name>/wake', methods=['POST'])
+def wake_stream_route(name):
+    """Called by MediaMTX runOnDemand when a reader asks for a suspended stream"""
+    ok, msg = _wake_stream(name)
+    return jsonify(success=ok, message=msg), (200 if ok else 404)
+
+@app.route('/on_demand', methods=['GET'])
+def on_demand_status_route():
+    """Suspended streams and streams currently counting down to suspension"""
+    now = time.time()
+    with _suspend_lock:
+        suspended = [{'name': n, 'suspended_for': round(now - e['suspended_at'], 1), 'wakes': e['wakes'], 'waking': e['waking']}
+                     for n, e in _suspended_streams.items()]
+    idle = [{'name': n, 'idle_for': round(now - t, 1)} for n, t in list(_idle_since.items())]
+    return jsonify(success=True, enabled=getattr(config, 'ENABLE_IDLE_SUSPEND', False),
+                   grace_seconds=getattr(config, 'IDLE_SUSPEND_GRACE', 60), suspended=suspended, idle=idle)
+
+if _OWNS_STREAMS and getattr(config, 'ENABLE_IDLE_SUSPEND', False):
+    _scheduler.every(getattr(config, 'IDLE_CHECK_INTERVAL', 5), _idle_check, name='idle-check', lane='maintenance')
+    app.logger.info("Idle suspend enabled")
+
+# --- End On-demand Encoding ---
+
+# --- Crash Restart ---
+# A stream whose ffmpeg exits unexpectedly is relaunched with the command it was started with, after an
+# exponential backoff with jitter (restart_policy.py). A stream that keeps crashing (CRASH_LOOP_THRESHOLD
+# crashes within CRASH_LOOP_WINDOW, or more restarts than its retries allow) is parked in the error state
+# until POST /streams/<name>/restart. All restarts share one token bucket, so a flapping upstream that
+# takes down many streams at once can't relaunch them all at the same moment.
+_restart_policy = RestartPolicy(
+    max_retries=getattr(config, 'RESTART_MAX_RETRIES', 5), base_delay=getattr(config, 'RESTART_BASE_DELAY', 2.0),
+    max_delay=getattr(config, 'RESTART_MAX_DELAY', 60.0), jitter=getattr(config, 'RESTART_JITTER', 0.3),
+    crash_loop_threshold=getattr(config, 'CRASH_LOOP_THRESHOLD', 5), crash_loop_window=getattr(config, 'CRASH_LOOP_WINDOW', 300.0),
+    stable_after=getattr(config, 'RESTART_STABLE_AFTER', 60.0))
+_restart_bucket = TokenBucket(getattr(config, 'FLEET_RESTART_RATE', 2.0), getattr(config, 'FLEET_RESTART_BURST', 10))
+_restart_trackers = {} # name -> RestartTracker
+_pending_restarts = {} # name -> {'cmd', 'config', 'start_time', 'duration_s', 'attempt', 'due_at', 'timer', 'reason'}
+_parked_streams = {} # name -> {'config', 'parked_at', 'reason', 'crashes'}
+_restart_lock = threading.Lock()
+_restart_counts = {'restarted': 0, 'failed': 0, 'parked': 0, 'throttled': 0}
+
+def _auto_restart_enabled_for(stream_config):
+    return getattr(config, 'ENABLE_AUTO_RESTART', False) and stream_config.get('restart_policy', 'on-failure') != 'never'
+
+def _record_crash(name, stream_config, uptime):
+    """Count a crash. Returns ('restart', delay), ('park', reason), or None if the stream isn't restarted.
+    A restart decision reserves the name, so nothing else can start the stream during the backoff."""
+    if not _auto_restart_enabled_for(stream_config): return None
+    with _restart_lock:
+        tracker = _restart_trackers.get(name)
+        if tracker is None:
+            tracker = _restart_trackers[name] = RestartTracker(_restart_policy, max_retries=stream_config.get('max_restarts'))
+        decision = tracker.record_crash(uptime)
+    if decision[0] == 'restart':
+        with _launching_lock: _launching_names.add(name)
+    return decision
+
+def _archive_crash_report(paths):
+    """Keep the crash report under a timestamped name; the relaunch starts the stream's files afresh."""
+    src = paths['crash_report_file']
+    if os.path.exists(src):
+        try: os.replace(src, src.replace("_crash.log", f"_{time.strftime('%Y%m%d-%H%M%S')}_crash.log"))
+        except OSError as e: _log(paths, f"Could not archive crash report: {e}")
+
+def _schedule_restart(name, entry, delay):
+    """Arm the backoff timer for a crashed stream whose name is already reserved."""
+    paths = _get_stream_paths(name)
+    _archive_crash_report(paths)
+    with _restart_lock:
+        timer = _scheduler.call_later(delay, _run_restart, name, name=f"restart:{name}", lane='launch')
+        entry.update(timer=timer, due_at=time.time() + delay, attempt=getattr(_restart_trackers.get(name), 'attempts', 1), launching=False)
+        _pending_restarts[name] = entry
+    _update_status(paths, "restarting", f"Restart {entry['attempt']} in {delay:.1f}s")
+    _log(paths, f"{name} will be restarted in {delay:.1f}s (attempt {entry['attempt']}).")
+
+def _park_stream(name, stream_config, reason):
+    """Give up on a crash-looping stream: keep it listed in the error state, drop it from persistence."""
+    paths = _get_stream_paths(name)
+    with _restart_lock:
+        tracker = _restart_trackers.get(name)
+        _parked_streams[name] = {'config': dict(stream_config), 'parked_at': time.time(), 'reason': reason,
+                                 'crashes': tracker.total_crashes if tracker else 0}
+        _restart_counts['parked'] += 1
+    _update_status(paths, "error", f"{reason}. Parked until POST /streams/{name}/restart")
+    _log(paths, f"{name} parked: {reason}")
+    app.logger.warning(f"Stream {name} parked: {reason}")
+    remove_stream_state(name)
+
+def _release_restart_name(name):
+    with _launching_lock: _launching_names.discard(name)
+
+def _run_restart(name):
+    """Backoff timer callback: relaunch a crashed stream with its original command and encoder."""
+    with _restart_lock:
+        entry = _pending_restarts.get(name)
+        if entry is None or entry.get('cancelled'): return
+        wait = 0 if _shutdown_in_progress else _restart_bucket.try_acquire()
+        if wait:
+            # Fleet-wide limit reached; try again when the next token is due
+            _restart_counts['throttled'] += 1
+            timer = _scheduler.call_later(min(wait, 60), _run_restart, name, name=f"restart:{name}", lane='launch')
+            entry.update(timer=timer, due_at=time.time() + min(wait, 60))
+            return
+        entry.update(timer=None, launching=True)
+    if _shutdown_in_progress:
+        with _restart_lock: _pending_restarts.pop(name, None)
+        _release_restart_name(name) # Still persisted, so the next startup restores it
+        return
     
-    initial_config = {
-        'video_codec': data.get('video_codec', 'h264'),
-        'resolution': data.get('resolution', '1080'),
-        'target_fps': data.get('target_fps', '15'),
-        'audio_enabled': data.get('audio_enabled', 'no'),
-        'audio_codec': data.get('audio_codec', 'aac'),
-        'hardware_accel': data.get('hardware_accel', 'no'),
-        'duration_hours': data.get('duration_hours', '0'),
-        'encoder_details': encoder_info,
-        'stream_type': data.get('stream_type'),
-        'source_url': data.get('source_url') if data.get('stream_type') == 'rtsp' else None,
-        'video_file': data.get('video_file') if data.get('stream_type') == 'file' and data.get('file_source_type') != 'custom' else None,
-        'file_source_type': data.get('file_source_type') if data.get('stream_type') == 'file' else None,
-        'video_file_path': data.get('video_file_path') if data.get('stream_type') == 'file' else None,
-    }
-    app.logger.info(f"[{name}] Storing stream details in active_streams.")
-    active_streams[name] = {
-        'process': proc, 
-        'thread': mon_thread, 
-        'stop_event': stop_ev, 
-        'paths': paths,
-        'config': initial_config,
-        'start_time': time.time()
-    }
+    stream_config = entry['config']
+    duration_hrs = '0'
+    if entry['duration_s']:
+        remaining = entry['start_time'] + entry['duration_s'] - time.time()
+        if remaining <= 0:
+            with _restart_lock: _pending_restarts.pop(name, None)
+            _release_restart_name(name)
+            _update_status(_get_stream_paths(name), "stopped", "Duration ended while waiting to restart.")
+            remove_stream_state(name)
+            return
+        duration_hrs = str(remaining / 3600)
     
-    # Save stream state for persistence
-    save_stream_state(name, initial_config)
+    ok, msg = False, ""
+    try:
+        if stream_config.get('shared_encoder'):
+            # The relay's shared encoder was released when it exited; subscribe again like a fresh launch
+            ok, msg, _ = _launch_reserved_stream(name, dict(stream_config, stream_name=name), stream_config.get('encoder_details'), duration_hrs)
+        else:
+            ok, msg = exec_and_monitor_ffmpeg(name, entry['cmd'], duration_hrs, stream_config, stream_config.get('encoder_details'))
+            if ok and not _hls_tee_enabled() and not _abr_ladder(stream_config):
+                _start_hls_converter(name)
+    except Exception as e:
+        msg = str(e)
     
-    app.logger.info(f"[{name}] Returning True: Stream started.")
-    return True, "Stream started."
+    with _restart_lock:
+        if _pending_restarts.get(name) is entry: _pending_restarts.pop(name)
+        cancelled = entry.get('cancelled')
+        _restart_counts['restarted' if ok else 'failed'] += 1
+    if ok or cancelled:
+        _release_restart_name(name)
+        if ok: app.logger.info(f"Restarted {name} (attempt {entry['attempt']})")
+        if ok and cancelled: _stop_stream(name) # Stopped by the user while relaunching
+        return
+    app.logger.warning(f"Restart {entry['attempt']} of {name} failed: {msg}")
+    decision = _record_crash(name, stream_config, 0)
+    if decision and decision[0] == 'restart':
+        _schedule_restart(name, entry, decision[1])
+    else:
+        _release_restart_name(name)
+        _park_stream(name, stream_config, decision[1] if decision else f"Restart failed: {msg}")
+
+def _forget_restart_state(name):
+    """Cancel a pending restart and drop the crash history of a stream the user stopped.
+    Returns True if the stream was waiting to restart or parked."""
+    with _restart_lock:
+        _restart_trackers.pop(name, None)
+        entry = _pending_restarts.pop(name, None)
+        parked = _parked_streams.pop(name, None)
+        if entry:
+            entry['cancelled'] = True
+            if entry['timer']: entry['timer'].cancel()
+    if entry and not entry.get('launching'):
+        _release_restart_name(name) # A relaunch already in progress releases the name itself
+    return bool(entry or parked)
+
+def _cancel_pending_restarts():
+    """Shutdown: stop all backoff timers. The streams stay persisted and are restored on the next start."""
+    with _restart_lock:
+        entries = list(_pending_restarts.items())
+        _pending_restarts.clear()
+    for name, entry in entries:
+        entry['cancelled'] = True
+        if entry['timer']: entry['timer'].cancel()
+        if not entry.get('launching'): _release_restart_name(name)
+
+def _restart_managed_names():
+    with _restart_lock:
+        return set(_pending_restarts) | set(_parked_streams)
+
+@app.route('/streams/<name>/restart', methods=['POST'])
+def restart_stream_route(name):
+    """Relaunch a parked stream (or skip the backoff of one waiting to restart) with a fresh crash history"""
+    with _restart_lock:
+        parked = _parked_streams.pop(name, None)
+        entry = _pending_restarts.get(name)
+        if entry and entry.get('launching'):
+            return jsonify(success=True, message=f"{name} is already restarting.")
+        _restart_trackers.pop(name, None)
+        if entry and entry['timer']:
+            entry['timer'].cancel()
+            entry['timer'] = None
+    if entry:
+        entry['timer'] = _scheduler.call_later(0, _run_restart, name, name=f"restart:{name}", lane='launch')
+        return jsonify(success=True, message=f"Restarting {name} now.")
+    if not parked:
+        return jsonify(success=False, message=f"{name} is not parked or waiting to restart."), 404
+    stream_config = dict(parked['config'], stream_name=name)
+    try:
+        enc_info = stream_config.get('encoder_details') or resolve_encoder(stream_config.get('video_codec', 'h264'), stream_config.get('hardware_accel') == 'yes')
+        ok, msg, _ = _launch_stream(name, stream_config, enc_info, '0')
+    except ValueError as e:
+        ok, msg = False, str(e)
+    if not ok:
+        with _restart_lock: _parked_streams.setdefault(name, parked)
+        return jsonify(success=False, message=msg), 400
+    return jsonify(success=True, message=f"{name} restarted.")
+
+@app.route('/restarts', methods=['GET'])
+def restarts_route():
+    """Crash restart state: streams waiting to restart, parked streams and fleet counters"""
+    now = time.time()
+    with _restart_lock:
+        pending = [{'name': n, 'attempt': e['attempt'], 'restart_in': round(max(0, e['due_at'] - now), 1), 'reason': e['reason']}
+                   for n, e in _pending_restarts.items()]
+        parked = [{'name': n, 'reason': e['reason'], 'crashes': e['crashes'], 'parked_for': round(now - e['parked_at'], 1)}
+                  for n, e in _parked_streams.items()]
+        crashes = {n: {'attempts': t.attempts, 'total_crashes': t.total_crashes, 'recent_crashes': t.recent_crashes()}
+                   for n, t in _restart_trackers.items()}
+        counts = dict(_restart_counts)
+    return jsonify(success=True, enabled=getattr(config, 'ENABLE_AUTO_RESTART', False), pending=pending, parked=parked,
+                   crashes=crashes, fleet_tokens=round(_restart_bucket.available(), 2), counts=counts)
+
+# --- End Crash Restart ---
 
 def allowed_file(filename):
     app.logger.info(f"Checking file: {filename} (repr: {repr(filename)})")
@@ -1056,63 +2587,164 @@ def list_videos_route():
                 vids.append({'name': f, 'path': f})
     return jsonify(success=True, videos=vids, browse_directory=browse_dir)
 
+def _validate_stream_request(data):
+    """Check and normalise a start request in place. Raises ValueError with a user-facing message."""
+    if not data:
+        raise ValueError('No JSON data')
+    name = data.get('stream_name')
+    if not name or not re.match(r'^[a-zA-Z0-9_-]+$', name): raise ValueError('Bad stream name')
+    s_type = data.get('stream_type')
+    if s_type not in ['rtsp', 'file']: raise ValueError('Bad stream type')
+    if data.get('priority') is not None:
+        try: data['priority'] = int(data['priority'])
+        except (TypeError, ValueError): raise ValueError('priority must be an integer')
+    if data.get('restart_policy', 'on-failure') not in ('on-failure', 'never'): raise ValueError("restart_policy must be 'on-failure' or 'never'")
+    if data.get('max_restarts') is not None:
+        try: data['max_restarts'] = int(data['max_restarts'])
+        except (TypeError, ValueError): raise ValueError('max_restarts must be an integer')
+        if data['max_restarts'] < 0: raise ValueError('max_restarts must not be negative')
+    
+    source_url = data.get('source_url') # Define source_url before using it in conditions
+    if s_type == 'rtsp' and not source_url:
+        raise ValueError('No RTSP URL')
+    elif s_type == 'file':
+        file_source_type = data.get('file_source_type', 'custom') # Default to custom if not specified
+        data['file_source_type'] = file_source_type # Ensure it's in data for later use by ffmpeg command construction
+        
+        if file_source_type == 'custom':
+            custom_path = data.get('video_file_path')
+            if not custom_path: raise ValueError('No file path provided for custom source')
+            if not os.path.exists(custom_path): raise ValueError(f'Custom file not found: {custom_path}')
+            if not os.path.isfile(custom_path): raise ValueError(f'Custom path is not a file: {custom_path}')
+            
+            # Corrected extension checking logic:
+            # os.path.splitext(...)[1] gives '.ext'
+            # config.ALLOWED_VIDEO_EXTENSIONS stores extensions without a leading dot (e.g., 'mp4')
+            file_ext_with_dot = os.path.splitext(custom_path)[1].lower()
+            if not file_ext_with_dot or file_ext_with_dot.lstrip('.') not in config.ALLOWED_VIDEO_EXTENSIONS:
+                raise ValueError(f'Invalid file type for custom path. Allowed: {config.ALLOWED_VIDEO_EXTENSIONS}')
+            
+            data['video_file_path'] = custom_path # This is already the absolute path
+        elif file_source_type == 'folder':
+            vid_f = data.get('video_file') # This will be the filename from dropdown
+            if not vid_f: raise ValueError('No video file selected from folder')
+            
+            browse_dir = getattr(config, 'BROWSEABLE_VIDEO_DIR', DEFAULT_BROWSEABLE_DIR)
+            vid_p = os.path.join(browse_dir, os.path.basename(vid_f)) # Construct path
+            
+            if not os.path.exists(vid_p): raise ValueError(f'File from folder not found: {vid_p}')
+            if not os.path.isfile(vid_p): raise ValueError(f'Path from folder is not a file: {vid_p}')
+            data['video_file_path'] = vid_p # Set the absolute path for ffmpeg
+        else:
+            raise ValueError('Invalid file_source_type')
+        
+    if data.get('resolution', '1080') not in ['480', '720', '1080', '1440', '2160']: raise ValueError('Bad resolution')
+    if data.get('abr_ladder'): data['abr_ladder'] = _validate_abr_ladder(data['abr_ladder'])
+    classes = getattr(config, 'STREAM_RESOURCE_CLASSES', {})
+    if data.get('resource_class') and data['resource_class'] not in classes:
+        raise ValueError(f"resource_class must be one of: {', '.join(classes)}")
+    for key, cast, low, high in (('cpu_limit', float, 0.01, None), ('memory_limit_mb', int, 16, None), ('io_weight', int, 1, 10000)):
+        if data.get(key) is None: continue
+        try: data[key] = cast(data[key])
+        except (TypeError, ValueError): raise ValueError(f"{key} must be a number")
+        if data[key] < low or (high is not None and data[key] > high):
+            raise ValueError(f"{key} must be at least {low}" + (f" and at most {high}" if high is not None else ""))
+    return data
+
+def _start_stream_request(data, enc_info=None):
+    """Validate and launch one start request. Returns (ok, msg, cmd); raises ValueError on bad input."""
+    _validate_stream_request(data)
+    if enc_info is None:
+        enc_info = resolve_encoder(data.get('video_codec', 'h264'), data.get('hardware_accel') == 'yes')
+    return _launch_stream(data['stream_name'], data, enc_info, data.get('duration_hours', '0'))
+
+# --- Async Start Jobs ---
+# POST /start_stream with "async": true returns a job id at once; validation and launch run on a
+# bounded pool and GET /jobs/<id> reports the outcome. "wait": <seconds> blocks until the job ends.
+_start_jobs = {} # job id -> job dict
+_start_jobs_lock = threading.Lock()
+_start_job_pool = ThreadPoolExecutor(max_workers=getattr(config, 'START_JOB_WORKERS', 16), thread_name_prefix='start-job')
+
+def _prune_start_jobs():
+    """Forget finished jobs past START_JOB_TTL. Caller holds the lock."""
+    cutoff = time.time() - getattr(config, 'START_JOB_TTL', 600)
+    for job_id in [j for j, job in _start_jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+        _start_jobs.pop(job_id, None)
+
+def _run_start_job(job, data):
+    job['state'], job['started_at'] = 'running', time.time()
+    try:
+        ok, msg, cmd = _start_stream_request(data)
+        job.update(state='succeeded' if ok else 'failed', message=msg, ffmpeg_command=_cmd_str(cmd) if cmd else None)
+    except ValueError as e:
+        job.update(state='failed', message=str(e))
+    except Exception as e:
+        app.logger.error(f"Start job {job['id']} error: {e}", exc_info=True)
+        job.update(state='failed', message=f"Server error: {str(e)}")
+    finally:
+        job['finished_at'] = time.time()
+        job['done'].set()
+
+def _submit_start_job(data):
+    job = {'id': uuid.uuid4().hex[:12], 'stream_name': (data or {}).get('stream_name'), 'state': 'queued', 'message': '',
+           'ffmpeg_command': None, 'created_at': time.time(), 'started_at': None, 'finished_at': None, 'done': threading.Event()}
+    with _start_jobs_lock:
+        _prune_start_jobs()
+        _start_jobs[job['id']] = job
+    _start_job_pool.submit(_run_start_job, job, data)
+    return job
+
+def _job_view(job):
+    view = {k: v for k, v in job.items() if k != 'done'}
+    view['status_url'] = f"/jobs/{job['id']}"
+    return view
+
+def _parse_job_wait(raw):
+    """Seconds to block for a job, capped at START_JOB_MAX_WAIT. Raises ValueError on anything but a number."""
+    if not raw:
+        return 0
+    wait_s = float(raw)
+    if not 0 <= wait_s < float('inf'):
+        raise ValueError(raw)
+    return min(wait_s, getattr(config, 'START_JOB_MAX_WAIT', 60))
+
+def _job_response(job, wait_s):
+    if wait_s:
+        job['done'].wait(timeout=wait_s)
+    if job['state'] == 'succeeded': return jsonify(success=True, job=_job_view(job)), 200
+    if job['state'] == 'failed': return jsonify(success=False, message=job['message'], job=_job_view(job)), 400
+    return jsonify(success=True, job_id=job['id'], job=_job_view(job)), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_route(job_id):
+    """Status of an async start job. ?wait=<seconds> blocks until it finishes or the wait runs out"""
+    with _start_jobs_lock:
+        job = _start_jobs.get(job_id)
+    if not job:
+        return jsonify(success=False, message=f"Unknown job {job_id}"), 404
+    try:
+        wait_s = _parse_job_wait(request.args.get('wait'))
+    except (TypeError, ValueError):
+        return jsonify(success=False, message='wait must be a number of seconds'), 400
+    return _job_response(job, wait_s)
+
+# --- End Async Start Jobs ---
+
 @app.route('/start_stream', methods=['POST'])
 def start_stream_route():
     try:
         data = request.get_json()
-        if not data:
-            return jsonify(success=False, message='No JSON data'), 400
-        
-        name = data.get('stream_name')
-        if not name or not re.match(r'^[a-zA-Z0-9_-]+$', name): return jsonify(success=False, message='Bad stream name'), 400
-        s_type = data.get('stream_type')
-        if s_type not in ['rtsp', 'file']: return jsonify(success=False, message='Bad stream type'), 400
-        
-        source_url = data.get('source_url') # Define source_url before using it in conditions
-        if s_type == 'rtsp' and not source_url:
-             return jsonify(success=False, message='No RTSP URL'), 400
-        elif s_type == 'file':
-            file_source_type = data.get('file_source_type', 'custom') # Default to custom if not specified
-            data['file_source_type'] = file_source_type # Ensure it's in data for later use by ffmpeg command construction
-            
-            if file_source_type == 'custom':
-                custom_path = data.get('video_file_path')
-                if not custom_path: return jsonify(success=False, message='No file path provided for custom source'), 400
-                if not os.path.exists(custom_path): return jsonify(success=False, message=f'Custom file not found: {custom_path}'), 400
-                if not os.path.isfile(custom_path): return jsonify(success=False, message=f'Custom path is not a file: {custom_path}'), 400
-                
-                # Corrected extension checking logic:
-                # os.path.splitext(...)[1] gives '.ext'
-                # config.ALLOWED_VIDEO_EXTENSIONS stores extensions without a leading dot (e.g., 'mp4')
-                file_ext_with_dot = os.path.splitext(custom_path)[1].lower()
-                if not file_ext_with_dot or file_ext_with_dot.lstrip('.') not in config.ALLOWED_VIDEO_EXTENSIONS:
-                    return jsonify(success=False, message=f'Invalid file type for custom path. Allowed: {config.ALLOWED_VIDEO_EXTENSIONS}'), 400
-                
-                data['video_file_path'] = custom_path # This is already the absolute path
-            elif file_source_type == 'folder':
-                vid_f = data.get('video_file') # This will be the filename from dropdown
-                if not vid_f: return jsonify(success=False, message='No video file selected from folder'), 400
-                
-                browse_dir = getattr(config, 'BROWSEABLE_VIDEO_DIR', DEFAULT_BROWSEABLE_DIR)
-                vid_p = os.path.join(browse_dir, os.path.basename(vid_f)) # Construct path
-                
-                if not os.path.exists(vid_p): return jsonify(success=False, message=f'File from folder not found: {vid_p}'), 400
-                if not os.path.isfile(vid_p): return jsonify(success=False, message=f'Path from folder is not a file: {vid_p}'), 400
-                data['video_file_path'] = vid_p # Set the absolute path for ffmpeg
-            else:
-                return jsonify(success=False, message='Invalid file_source_type'), 400
-            
-        if data.get('resolution', '1080') not in ['480', '720', '1080', '1440', '2160']: return jsonify(success=False, message='Bad resolution'), 400
-        vid_codec = data.get('video_codec', 'h264')
-        hw_accel = data.get('hardware_accel') == 'yes'
-        avail_encs = get_available_encoders()
-        if not avail_encs or not avail_encs.get(vid_codec): return jsonify(success=False, message=f"No encoders for {vid_codec}. Avail: {list(avail_encs.keys()) if avail_encs else 'None'}"), 400
-        enc_info = get_best_encoder(vid_codec, avail_encs, hw_accel)
-        ff_cmd = construct_ffmpeg_command(data, enc_info)
-        ok, msg = exec_and_monitor_ffmpeg(name, ff_cmd, data.get('duration_hours', '0'), data, enc_info)
-        if ok: return jsonify(success=True, message=msg, stream_url=f"rtsp://localhost:8554/{name}", ffmpeg_command=ff_cmd)
+        if data and (data.get('async') or request.args.get('async') in ('1', 'true', 'yes')):
+            try: # Before submitting, so a bad wait never leaves a queued launch without a job id
+                wait_s = _parse_job_wait(data.get('wait') or request.args.get('wait'))
+            except (TypeError, ValueError):
+                return jsonify(success=False, message='wait must be a number of seconds'), 400
+            return _job_response(_submit_start_job(data), wait_s)
+        ok, msg, ff_cmd = _start_stream_request(data)
+        name = data['stream_name']
+        if ok: return jsonify(success=True, message=msg, stream_url=f"rtsp://localhost:8554/{name}", ffmpeg_command=_cmd_str(ff_cmd))
         else: 
-            return jsonify(success=False, message=msg, ffmpeg_command=ff_cmd), 400
+            return jsonify(success=False, message=msg, ffmpeg_command=_cmd_str(ff_cmd)), 400
     except ValueError as e: return jsonify(success=False, message=str(e)), 400
     except Exception as e:
         app.logger.error(f"/start_stream error: {e}", exc_info=True)
@@ -1137,18 +2769,17 @@ def _get_server_ip():
 
 @app.route('/get_active_streams', methods=['GET'])
 def get_active_streams_route():
+    """Managed, suspended, restarting and orphaned streams. Optional filters: ?status=, ?encoder_type=, ?source="""
     output = []
-    current_managed_streams = set(active_streams.keys())
+    streams = active_streams.snapshot() # One consistent view, even while streams start and stop
+    current_managed_streams = set(streams)
     server_ip = _get_server_ip()
+    filters = {f: request.args[f] for f in ('status', 'encoder_type', 'source') if request.args.get(f)}
+    selected = set(active_streams.names(**filters)) if filters else current_managed_streams
     
-    for name, details in list(active_streams.items()): 
-        status, error_msg = "unknown", ""
-        try:
-            if os.path.exists(details['paths']['status_file']):
-                with open(details['paths']['status_file'], 'r') as f: status = f.read().strip()
-            if os.path.exists(details['paths']['error_file']):
-                with open(details['paths']['error_file'], 'r') as f: error_msg = f.read().strip()
-        except Exception: pass
+    for name, details in streams.items():
+        if name not in selected: continue
+        status, error_msg = details['status'], details['error']
         
         # Calculate elapsed time
         elapsed_str = ""
@@ -1216,7 +2847,54 @@ def get_active_streams_route():
             'accel_type': accel_type,
             'has_error': bool(error_msg),
             'crash_log_path': details['paths']['crash_report_file'] if error_msg and os.path.exists(details['paths']['crash_report_file']) else None,
-            'file_info': file_info
+            'file_info': file_info,
+            'track_plan': config.get('track_plan'),
+            'renditions': [{'resolution': res, 'url': f"rtsp://{server_ip}:8554/{_abr_rendition_path(name, res)}"}
+                           for res in (config.get('abr_ladder') or [])],
+            'hls_master': f"/hls/{name}/master.m3u8" if config.get('abr_ladder') else None,
+            'hls_converter': {
+                'pid': details['hls_converter']['process'].pid if details['hls_converter']['process'] else None,
+                'running': bool(details['hls_converter']['process'] and details['hls_converter']['process'].poll() is None),
+                'restarts': details['hls_converter']['restarts'],
+                'log': details['hls_converter']['paths']['err_file'],
+            } if details.get('hls_converter') else None,
+            'resources': _stream_usage.get(name), # ffmpeg + children + HLS converter, from the last sampling pass
+        })
+    
+    with _suspend_lock:
+        suspended_snapshot = {n: dict(e) for n, e in _suspended_streams.items()}
+    for name, entry in suspended_snapshot.items():
+        if name in current_managed_streams: continue # Already relaunched
+        current_managed_streams.add(name)
+        stream_config = entry['config']
+        output.append({
+            'name': name, 'pid': None, 'status': 'suspended', 'error': '', 'managed': True,
+            'config': stream_config, 'url': f"rtsp://{server_ip}:8554/{name}",
+            'elapsed_time': '', 'remaining_time': 'Unlimited', 'start_timestamp': entry['suspended_at'],
+            'codec': stream_config.get('video_codec', 'unknown'), 'resolution': stream_config.get('resolution', 'unknown'),
+            'fps': stream_config.get('target_fps', 'unknown'),
+            'audio': 'none' if stream_config.get('audio_enabled') == 'no' else stream_config.get('audio_codec', 'unknown'),
+            'accel_type': 'unknown', 'has_error': False, 'crash_log_path': None,
+        })
+    
+    with _restart_lock:
+        restart_snapshot = [(n, 'restarting', dict(e), e['due_at']) for n, e in _pending_restarts.items()]
+        restart_snapshot += [(n, 'error', dict(e), e['parked_at']) for n, e in _parked_streams.items()]
+    for name, status, entry, since in restart_snapshot:
+        if name in current_managed_streams: continue
+        current_managed_streams.add(name)
+        stream_config = entry['config']
+        crash_path = _get_stream_paths(name)['crash_report_file']
+        error = f"Parked: {entry['reason']}" if status == 'error' else f"Crashed ({entry['reason']}), restart {entry['attempt']} in {max(0, since - time.time()):.0f}s"
+        output.append({
+            'name': name, 'pid': None, 'status': status, 'error': error, 'managed': True,
+            'config': stream_config, 'url': f"rtsp://{server_ip}:8554/{name}",
+            'elapsed_time': '', 'remaining_time': '', 'start_timestamp': entry.get('start_time', since),
+            'codec': stream_config.get('video_codec', 'unknown'), 'resolution': stream_config.get('resolution', 'unknown'),
+            'fps': stream_config.get('target_fps', 'unknown'),
+            'audio': 'none' if stream_config.get('audio_enabled') == 'no' else stream_config.get('audio_codec', 'unknown'),
+            'accel_type': 'unknown', 'has_error': True,
+            'crash_log_path': crash_path if status == 'error' and os.path.exists(crash_path) else None,
         })
     
     # Handle orphaned streams
@@ -1266,26 +2944,39 @@ def get_active_streams_route():
     except Exception as e:
         app.logger.error(f"Error listing orphaned streams: {e}")
 
+    if filters:
+        # Streams outside the registry have no encoder/source index; they only match on status
+        output = [o for o in output if o['name'] in selected or (set(filters) == {'status'} and o['status'] == filters['status'])]
+    
     # Sort by start timestamp (newest first)
     output.sort(key=lambda x: x.get('start_timestamp', 0), reverse=True)
     
-    return jsonify(success=True, streams=output)
+    return jsonify(success=True, streams=output, counts={f: active_streams.counts(f) for f in ('status', 'encoder_type')})
 
-@app.route('/stop_stream', methods=['POST'])
-def stop_stream_route():
-    data = request.get_json(); name = data.get('stream_name')
-    if not name: return jsonify(success=False, message="No stream_name"), 400
+def _stop_stream(name):
+    """Stop a managed, suspended, restarting or orphaned stream. Returns (ok, msg, http_status)."""
     paths = _get_stream_paths(name)
-    if name in active_streams:
-        details = active_streams[name]
+    if _forget_restart_state(name) and name not in active_streams:
+        _update_status(paths, "stopped", "Stream stopped by user.")
+        remove_stream_state(name)
+        return True, f"Stopped {name} (no longer restarting).", 200
+    if _forget_suspended_stream(name):
+        _update_status(paths, "stopped", "Stream stopped by user.")
+        remove_stream_state(name)
+        if name not in active_streams:
+            return True, f"Suspended stream {name} removed.", 200
+    details = active_streams.get(name)
+    if details:
         _log(paths, f"Stop request for {name} (PID {details['process'].pid if details.get('process') and details['process'].pid else 'N/A'}).")
         details['stop_event'].set()
         proc = details.get('process')
         if proc and proc.pid:
-            _terminate_process_group(proc.pid, paths, name)
-        if details.get('thread') : details['thread'].join(timeout=7)
+            _terminate_process_group(proc.pid, paths, name, proc)
+        if details.get('exit_event'): details['exit_event'].wait(timeout=7)
         _update_status(paths, "stopped", "Stream stopped by user.")
-        active_streams.pop(name, None) # Ensure removal
+        active_streams.discard(name, details) # Ensure removal (but not of a newer stream with the same name)
+        if _on_demand_enabled_for(details['config']):
+            _configure_on_demand_path(name, False)
         
         # Remove stream state from persistence
         remove_stream_state(name)
@@ -1293,7 +2984,7 @@ def stop_stream_route():
         if os.path.exists(paths['pid_file']): 
             try: os.remove(paths['pid_file'])
             except OSError: pass
-        return jsonify(success=True, message=f"Stop sent to {name}.")
+        return True, f"Stop sent to {name}.", 200
     else: 
         pid_to_kill = None
         if os.path.exists(paths['pid_file']):
@@ -1311,10 +3002,125 @@ def stop_stream_route():
             # Remove stream state from persistence
             remove_stream_state(name)
             
-            return jsonify(success=True, message=f"Stopped orphan {name} (PID {pid_to_kill}).")
+            return True, f"Stopped orphan {name} (PID {pid_to_kill}).", 200
         else: # No PID file, or couldn't read it.
             _update_status(paths, "stopped", "Orphaned stream (no PID) marked as stopped.") # Update status even if no PID
-            return jsonify(success=False, message=f"{name} not actively managed and no PID file found. Marked as stopped."), 404
+            return False, f"{name} not actively managed and no PID file found. Marked as stopped.", 404
+
+@app.route('/stop_stream', methods=['POST'])
+def stop_stream_route():
+    data = request.get_json(); name = data.get('stream_name')
+    if not name: return jsonify(success=False, message="No stream_name"), 400
+    ok, msg, code = _stop_stream(name)
+    return jsonify(success=ok, message=msg), code
+
+# --- Batch Start/Stop ---
+def _ramped_map(fn, items, parallelism, ramp_per_sec):
+    """Run fn(item) on up to `parallelism` threads, submitting at most ramp_per_sec items per second
+    (0 = no ramp). Returns results in item order."""
+    results = [None] * len(items)
+    if not items: return results
+    interval = 1.0 / ramp_per_sec if ramp_per_sec and ramp_per_sec > 0 else 0
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(items))), thread_name_prefix='batch') as pool:
+        t0, futures = time.monotonic(), {}
+        for i, item in enumerate(items):
+            if interval:
+                delay = t0 + i * interval - time.monotonic()
+                if delay > 0: time.sleep(delay)
+            futures[pool.submit(fn, item)] = i
+        for fut, i in futures.items():
+            results[i] = fut.result()
+    return results
+
+def _batch_options(body):
+    parallelism = int(body.get('parallelism', getattr(config, 'BATCH_PARALLELISM', 16)))
+    parallelism = max(1, min(parallelism, getattr(config, 'BATCH_MAX_PARALLELISM', 64)))
+    ramp = float(body.get('ramp_per_sec', getattr(config, 'BATCH_RAMP_PER_SEC', 0)))
+    return parallelism, ramp
+
+@app.route('/streams/batch_start', methods=['POST'])
+def batch_start_route():
+    """Start many streams in one request.
+    Body: {"streams": [spec, ...], "defaults": {...}, "parallelism": N, "ramp_per_sec": R, "all_or_nothing": bool}"""
+    body = request.get_json(silent=True) or {}
+    specs = body.get('streams')
+    if not isinstance(specs, list) or not specs:
+        return jsonify(success=False, message="'streams' must be a non-empty list"), 400
+    if len(specs) > getattr(config, 'BATCH_MAX_ITEMS', 2000):
+        return jsonify(success=False, message=f"At most {getattr(config, 'BATCH_MAX_ITEMS', 2000)} streams per batch"), 400
+    try:
+        parallelism, ramp = _batch_options(body)
+    except (TypeError, ValueError):
+        return jsonify(success=False, message="parallelism and ramp_per_sec must be numbers"), 400
+    defaults = body.get('defaults') or {}
+    t0 = time.time()
+    
+    # Validate every item before launching anything
+    results, launchable, seen, encoders = [], [], set(), {}
+    for spec in specs:
+        data = dict(defaults, **spec) if isinstance(spec, dict) else None
+        name = (data or {}).get('stream_name')
+        result = {'stream_name': name, 'success': False, 'message': ''}
+        results.append(result)
+        try:
+            _validate_stream_request(data)
+            if name in seen: raise ValueError('Duplicate stream name in batch')
+            if name in active_streams: raise ValueError('Stream name active.')
+            seen.add(name)
+            # Encoders are resolved once per (codec, hardware) combination for the whole batch
+            enc_key = (data.get('video_codec', 'h264'), data.get('hardware_accel') == 'yes')
+            if enc_key not in encoders:
+                encoders[enc_key] = resolve_encoder(*enc_key)
+            launchable.append((result, data, encoders[enc_key]))
+        except ValueError as e:
+            result.update(message=str(e), status='invalid')
+    invalid = len(specs) - len(launchable)
+    if invalid and body.get('all_or_nothing'):
+        return jsonify(success=False, message=f"{invalid} invalid stream specs; nothing started", results=results), 400
+    
+    def launch(item):
+        result, data, enc_info = item
+        try:
+            ok, msg, _ = _launch_stream(data['stream_name'], data, enc_info, data.get('duration_hours', '0'))
+        except Exception as e:
+            ok, msg = False, f"Launch error: {e}"
+        result.update(success=ok, message=msg, status='started' if ok else 'failed')
+        if ok: result['stream_url'] = f"rtsp://localhost:8554/{data['stream_name']}"
+    _ramped_map(launch, launchable, parallelism, ramp)
+    
+    started = sum(1 for r in results if r['success'])
+    app.logger.info(f"Batch start: {started}/{len(specs)} started in {time.time() - t0:.1f}s")
+    return jsonify(success=started == len(specs), started=started, failed=len(specs) - started, invalid=invalid,
+                   elapsed_seconds=round(time.time() - t0, 2), results=results)
+
+@app.route('/streams/batch_stop', methods=['POST'])
+def batch_stop_route():
+    """Stop many streams in one request. Body: {"stream_names": [...]} or {"all": true}, plus "parallelism"."""
+    body = request.get_json(silent=True) or {}
+    if body.get('all'):
+        names = list(active_streams.keys()) + [n for n in set(_suspended_streams) | _restart_managed_names() if n not in active_streams]
+    else:
+        names = body.get('stream_names')
+        if not isinstance(names, list) or not names:
+            return jsonify(success=False, message="'stream_names' must be a non-empty list (or pass \"all\": true)"), 400
+        names = list(dict.fromkeys(str(n) for n in names))
+    try:
+        parallelism, ramp = _batch_options(body)
+    except (TypeError, ValueError):
+        return jsonify(success=False, message="parallelism and ramp_per_sec must be numbers"), 400
+    t0 = time.time()
+    def stop(name):
+        try:
+            ok, msg, _ = _stop_stream(name)
+        except Exception as e:
+            ok, msg = False, f"Stop error: {e}"
+        return {'stream_name': name, 'success': ok, 'message': msg}
+    results = _ramped_map(stop, names, parallelism, ramp)
+    stopped = sum(1 for r in results if r['success'])
+    return jsonify(success=stopped == len(names), stopped=stopped, failed=len(names) - stopped,
+                   elapsed_seconds=round(time.time() - t0, 2), results=results)
+
+# --- End Batch Start/Stop ---
 
 @app.route('/view_log/<log_type>/<stream_name>')
 def view_log_route(log_type, stream_name):
@@ -1763,21 +3569,15 @@ def get_video_info_route():
 
     # Proceed with cv2.VideoCapture(resolved_file_path)
     try:
-        cap = cv2.VideoCapture(resolved_file_path)
-        if not cap.isOpened():
+        info = _probe_video_with_cv2(resolved_file_path)
+        if not info:
             app.logger.error(f"Could not open video file with OpenCV: {resolved_file_path}")
             return jsonify(success=False, error=f"Could not open video file: {os.path.basename(original_file_path_req)}."), 500
 
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fourcc = int(cap.get(cv2.CAP_PROP_FOURCC))
-        
-        codec_tag_string = "".join([chr((fourcc >> 8 * i) & 0xFF) for i in range(4)])
+        fps, width, height = info['fps'], info['width'], info['height']
+        codec_tag_string = info['codec_tag_string']
         codec_long_name = codec_tag_string # Placeholder, as discussed.
 
-        cap.release()
-
         details = {
             'fps': round(fps, 2) if fps and fps > 0 else 'N/A',
             'width': width,
@@ -1796,49 +3596,177 @@ def handle_unhandled_exception(e):
     app.logger.error(f"Unhandled exception: {e}", exc_info=True)
     return jsonify(success=False, message="An unhandled server error occurred."), 500
 
-def cleanup_all_streams():
-    global _shutdown_in_progress
-    _shutdown_in_progress = True
-    app.logger.info("Attempting to clean up all active streams on shutdown...")
-    for stream_name in list(active_streams.keys()):
-        details = active_streams.get(stream_name)
-        if details:
-            paths = details['paths']
-            _log(paths, f"Shutdown: Stopping stream {stream_name}.")
+def _shutdown_targets(keep=()):
+    """Every process we own at shutdown: (pgid, proc, log paths, label). Streams in `keep` stay running."""
+    targets = []
+    for stream_name, details in list(active_streams.items()):
+        proc = details.get('process')
+        if stream_name not in keep:
             details['stop_event'].set()
-            proc = details.get('process')
             if proc and proc.pid:
-                _terminate_process_group(proc.pid, paths, stream_name)
-            if details.get('thread'): 
-                details['thread'].join(timeout=5)
-            _update_status(paths, "stopped", "Stream stopped due to server shutdown.")
-            
-            # Don't remove stream state from persistence during shutdown
-            # This allows streams to be restored on restart
+                targets.append((proc.pid, proc, details['paths'], stream_name))
+        hls = details.get('hls_converter')
+        if hls and hls.get('process') and hls['process'].poll() is None:
+            targets.append((hls['process'].pid, hls['process'], hls['paths'], f"{stream_name} HLS"))
+    with _shared_encoders_lock:
+        shared = list(_shared_encoders.values())
+        _shared_encoders.clear()
+    for entry in shared:
+        entry['stop_event'].set()
+        if entry['process'].poll() is None:
+            targets.append((entry['process'].pid, entry['process'], entry['paths'], entry['path_name']))
+    return targets
+
+def cleanup_all_streams(keep=(), stop_mediamtx=True):
+    """Stop everything in parallel: SIGTERM every process group at once, wait for real exits against
+    a single SHUTDOWN_GRACE_PERIOD deadline, then SIGKILL whatever is still alive."""
+    global _shutdown_in_progress, _shutdown_complete
+    if _shutdown_complete: return
+    _shutdown_in_progress = True
+    t0 = time.monotonic()
+    deadline = t0 + getattr(config, 'SHUTDOWN_GRACE_PERIOD', 3.0)
+    _cancel_pending_restarts()
+    targets = _shutdown_targets(keep)
+    app.logger.info(f"Shutting down {len(active_streams)} streams ({len(targets)} processes)...")
+    
+    for pgid, proc, paths, label in targets:
+        _log(paths, f"Shutdown: Stopping {label}.")
+        _signal_group(pgid, signal.SIGTERM, paths, label)
+    
+    remaining = list(targets)
+    while remaining and time.monotonic() < deadline:
+        remaining = [t for t in remaining if _group_alive(t[0], t[1])]
+        if remaining: time.sleep(0.05)
+    for pgid, proc, paths, label in remaining:
+        _signal_group(pgid, signal.SIGKILL, paths, label)
     
-    app.logger.info("Cleanup complete.")
+    # Exit callbacks run on the reaper pool; give them a moment to record the stop
+    exit_deadline = time.monotonic() + 1.0
+    for stream_name, details in list(active_streams.items()):
+        if stream_name in keep: continue
+        if details.get('exit_event'):
+            details['exit_event'].wait(timeout=max(0, exit_deadline - time.monotonic()))
+        # Don't remove stream state from persistence during shutdown
+        # This allows streams to be restored on restart
+        _update_status(details['paths'], "stopped", "Stream stopped due to server shutdown.")
+    
+    app.logger.info(f"Cleanup complete in {time.monotonic() - t0:.1f}s ({len(remaining)} processes needed SIGKILL).")
     
     # Stop MediaMTX
-    app.logger.info("Stopping MediaMTX server...")
-    _stop_mediamtx()
+    if stop_mediamtx:
+        app.logger.info("Stopping MediaMTX server...")
+        _stop_mediamtx()
+    _shutdown_complete = True
+
+# --- Upgrade Restart (Process Adoption) ---
+# An upgrade restart (SIGUSR2, or SIGTERM with ADOPT_ON_SHUTDOWN) leaves encoders and MediaMTX running and
+# writes ADOPTION_MANIFEST_FILE. The next instance re-adopts each stream whose PID file still points at the
+# same process (start time and argv from /proc) instead of respawning it.
+def _adoption_manifest_file():
+    return getattr(config, 'ADOPTION_MANIFEST_FILE', os.path.join(config.STREAM_PERSISTENCE_DIR, 'adoptable_streams.json'))
+
+def detach_streams_for_upgrade():
+    """Shut down without touching adoptable streams. Shared-encoder streams and HLS converters stop as usual
+    and are restored by the next instance."""
+    if _shutdown_complete: return
+    manifest = {}
+    for name, details in list(active_streams.items()):
+        proc = details.get('process')
+        if not proc or proc.poll() is not None or details['config'].get('shared_encoder'): continue
+        ident = process_identity(proc.pid)
+        if not ident or not ident['cmdline']: continue
+        manifest[name] = {'pid': proc.pid, 'starttime': ident['starttime'], 'cmdline': ident['cmdline'],
+                          'start_time': details['start_time'], 'duration_s': details.get('duration_s', 0)}
+        _log(details['paths'], f"Upgrade restart: leaving {name} (PID {proc.pid}) running for adoption.")
+    try:
+        manifest_file = _adoption_manifest_file()
+        os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+        with open(f"{manifest_file}.tmp", 'w') as f:
+            json.dump({'written_at': time.time(), 'streams': manifest}, f, indent=2)
+        os.replace(f"{manifest_file}.tmp", manifest_file)
+    except Exception as e:
+        # Without a manifest the next instance can't verify anything, so fall back to a normal shutdown
+        app.logger.error(f"Could not write adoption manifest, stopping all streams: {e}")
+        cleanup_all_streams()
+        return
+    app.logger.info(f"Upgrade restart: {len(manifest)} streams left running for adoption.")
+    cleanup_all_streams(keep=set(manifest), stop_mediamtx=False)
+
+def _load_adoption_manifest():
+    """Read and remove the adoption manifest; it is only valid for the restart right after it was written."""
+    manifest_file = _adoption_manifest_file()
+    if not os.path.exists(manifest_file): return {}
+    try:
+        with open(manifest_file) as f: manifest = json.load(f)
+    except Exception as e:
+        app.logger.error(f"Could not read adoption manifest: {e}")
+        manifest = {}
+    try: os.remove(manifest_file)
+    except OSError: pass
+    return manifest.get('streams', {})
+
+def _read_pid_file(paths):
+    try:
+        with open(paths['pid_file']) as f: return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def _adopt_running_streams(persistent_streams):
+    """Take over encoders left running by an upgrade restart. Returns {name: 'adopted' or reason not adopted}."""
+    results = {}
+    for name, entry in _load_adoption_manifest().items():
+        paths = _get_stream_paths(name)
+        pid = _read_pid_file(paths)
+        proc = adopt(pid, entry['starttime'], entry['cmdline']) if pid == entry.get('pid') else None
+        if proc is None:
+            results[name] = 'not adopted: PID file missing, process gone or PID reused'
+            app.logger.warning(f"Not adopting {name} (PID file {pid}, manifest PID {entry.get('pid')}); it will be restored")
+            continue
+        stream = persistent_streams.get(name)
+        if not stream or name in active_streams:
+            # Nothing to manage it with; don't leave an unmanaged publisher on the path
+            _terminate_process_group(proc.pid, paths, name, proc)
+            results[name] = 'not adopted: no persisted config'
+            continue
+        _register_stream(name, proc, entry['cmdline'], paths, dict(stream.get('config', {})),
+                         entry.get('start_time') or time.time(), int(entry.get('duration_s') or 0), persist=False)
+        _update_status(paths, "running")
+        cpus = _claim_cpu(name, entry['cmdline'])
+        if cpus: apply_affinity(proc.pid, cpus) # Already running, so it is moved rather than started there
+        _log(paths, f"Adopted running {name} (PID {proc.pid}) after upgrade restart.")
+        if not _hls_tee_enabled() and not stream.get('config', {}).get('abr_ladder'):
+            _start_hls_converter(name)
+        results[name] = 'adopted'
+    if results:
+        app.logger.info(f"Adopted {sum(1 for r in results.values() if r == 'adopted')} of {len(results)} running streams")
+    return results
+
+# --- End Upgrade Restart (Process Adoption) ---
 
 import atexit
 import signal
 
 def signal_handler(signum, frame):
-    """Handle SIGINT (Ctrl+C) and SIGTERM signals"""
+    """Handle SIGINT (Ctrl+C), SIGTERM and SIGUSR2 (upgrade restart) signals"""
     global _shutdown_in_progress
-    app.logger.info(f"Received signal {signum}, initiating graceful shutdown...")
+    upgrade = signum == getattr(signal, 'SIGUSR2', None) or (signum == signal.SIGTERM and getattr(config, 'ADOPT_ON_SHUTDOWN', False))
+    app.logger.info(f"Received signal {signum}, initiating {'upgrade restart' if upgrade else 'graceful shutdown'}...")
     _shutdown_in_progress = True
-    cleanup_all_streams()
+    if upgrade:
+        detach_streams_for_upgrade()
+    else:
+        cleanup_all_streams()
     sys.exit(0)
 
-# Register signal handlers
-signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
-signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
-
-# Also register atexit as a fallback
-atexit.register(cleanup_all_streams)
+# Register signal handlers (web-only client workers own no processes and keep the default handlers)
+if _OWNS_STREAMS:
+    signal.signal(signal.SIGINT, signal_handler)   # Ctrl+C
+    signal.signal(signal.SIGTERM, signal_handler)  # Termination signal
+    if hasattr(signal, 'SIGUSR2'):
+        signal.signal(signal.SIGUSR2, signal_handler)  # Upgrade restart: leave encoders running for the next instance
+    
+    # Also register atexit as a fallback
+    atexit.register(cleanup_all_streams)
 
 # --- Periodic Cleanup Task ---
 def _delete_old_files(directory, retention_days, pattern="*"):
@@ -1921,8 +3849,9 @@ def _enforce_max_dir_size(directory, max_size_mb, pattern="*"):
 def _is_unlimited_stream(stream_name):
     """Check if a stream is set to unlimited duration by checking persistent state or active streams"""
     # First check active streams
-    if stream_name in active_streams:
-        config = active_streams[stream_name].get('config', {})
+    details = active_streams.get(stream_name)
+    if details:
+        config = details.get('config', {})
         return config.get('duration_hours', '0') == '0'
     
     # Check persistent streams
@@ -1937,120 +3866,167 @@ def _is_unlimited_stream(stream_name):
     return False
 
 def periodic_cleanup_task():
-    app.logger.info("Periodic cleanup task starting its loop.")
-    while True:
-        interval_hours = getattr(config, 'CLEANUP_INTERVAL_HOURS', 24)
-        try:
-            app.logger.info(f"Periodic cleanup cycle started.")
-            # Cleanup based on age
-            log_ret_days = getattr(config, 'LOG_RETENTION_DAYS', 7)
-            _delete_old_files(config.LOG_DIR, log_ret_days, pattern="ffmpeg_*.out")
-            _delete_old_files(config.LOG_DIR, log_ret_days, pattern="ffmpeg_*.err")
-            # ffmpeg_*.log are handled by RotatingFileHandler now, but mediamtx.log is not.
-            _delete_old_files(config.LOG_DIR, log_ret_days, pattern="mediamtx.log*") # For mediamtx.log and its potential manual rotations/backups
-            
-            crash_log_ret_days = getattr(config, 'CRASH_LOG_RETENTION_DAYS', 30)
-            _delete_old_files(config.CRASH_LOG_DIR, crash_log_ret_days, pattern="*.log")
-            
-            # SMART CLEANUP: Preserve PID and status files for unlimited streams
-            pid_status_ret_days = getattr(config, 'PID_STATUS_RETENTION_DAYS', 2)
-            
-            # Clean up PID files - but preserve unlimited streams
-            if os.path.exists(config.PID_DIR):
-                for filename in os.listdir(config.PID_DIR):
-                    if filename.endswith('.pid'):
-                        stream_name = filename.replace('ffmpeg_', '').replace('.pid', '')
-                        if not _is_unlimited_stream(stream_name):
-                            file_path = os.path.join(config.PID_DIR, filename)
-                            file_age_days = (time.time() - os.path.getmtime(file_path)) / 86400
-                            if file_age_days > pid_status_ret_days:
-                                try:
-                                    os.remove(file_path)
-                                    app.logger.info(f"Cleaned up old PID file: {filename}")
-                                except Exception as e:
-                                    app.logger.error(f"Error deleting {file_path}: {e}")
-                        else:
-                            app.logger.debug(f"Preserving PID file for unlimited stream: {filename}")
-            
-            # Clean up status files - but preserve unlimited streams
-            if os.path.exists(config.STATUS_DIR):
-                for filename in os.listdir(config.STATUS_DIR):
-                    if filename.startswith('ffmpeg_'):
-                        stream_name = filename.replace('ffmpeg_', '').replace('.status', '').replace('.error', '')
-                        if not _is_unlimited_stream(stream_name):
-                            file_path = os.path.join(config.STATUS_DIR, filename)
-                            file_age_days = (time.time() - os.path.getmtime(file_path)) / 86400
-                            if file_age_days > pid_status_ret_days:
-                                try:
-                                    os.remove(file_path)
-                                    app.logger.info(f"Cleaned up old status file: {filename}")
-                                except Exception as e:
-                                    app.logger.error(f"Error deleting {file_path}: {e}")
-                        else:
-                            app.logger.debug(f"Preserving status file for unlimited stream: {filename}")
-
-            # Cleanup based on total directory size (applied after age-based deletion)
-            max_log_dir_mb = getattr(config, 'MAX_LOG_DIR_SIZE_MB', 512)
-            if max_log_dir_mb > 0:
-                # This will apply to remaining .out, .err, and mediamtx.log files. 
-                # ffmpeg_*.log files are managed by RotatingFileHandler, but their sum might still be part of this check implicitly if not excluded by pattern.
-                # Let's make the pattern more specific for .out and .err files if we want to primarily target them for size cap after age. Or apply to all *.* if that is the intent.
-                _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="ffmpeg_*.out")
-                _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="ffmpeg_*.err")
-                _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="mediamtx.log*")
-                # Consider a global cap for LOG_DIR as well if individual caps above aren't enough: _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="*.*")
-
-            max_crash_dir_mb = getattr(config, 'MAX_CRASH_LOG_DIR_SIZE_MB', 256)
-            if max_crash_dir_mb > 0:
-                _enforce_max_dir_size(config.CRASH_LOG_DIR, max_crash_dir_mb, pattern="*.log")
-
-            app.logger.info(f"Periodic cleanup cycle finished. Next run in {interval_hours} hours.")
-        except Exception as e:
-            app.logger.error(f"Error in periodic_cleanup_task: {e}", exc_info=True)
+    """One cleanup cycle; the scheduler runs it every CLEANUP_INTERVAL_HOURS."""
+    interval_hours = getattr(config, 'CLEANUP_INTERVAL_HOURS', 24)
+    try:
+        app.logger.info(f"Periodic cleanup cycle started.")
+        # Cleanup based on age
+        log_ret_days = getattr(config, 'LOG_RETENTION_DAYS', 7)
+        _delete_old_files(config.LOG_DIR, log_ret_days, pattern="ffmpeg_*.out")
+        _delete_old_files(config.LOG_DIR, log_ret_days, pattern="ffmpeg_*.err")
+        # ffmpeg_*.log are handled by RotatingFileHandler now, but mediamtx.log is not.
+        _delete_old_files(config.LOG_DIR, log_ret_days, pattern="mediamtx.log*") # For mediamtx.log and its potential manual rotations/backups
+        
+        crash_log_ret_days = getattr(config, 'CRASH_LOG_RETENTION_DAYS', 30)
+        _delete_old_files(config.CRASH_LOG_DIR, crash_log_ret_days, pattern="*.log")
+        
+        # SMART CLEANUP: Preserve PID and status files for unlimited streams
+        pid_status_ret_days = getattr(config, 'PID_STATUS_RETENTION_DAYS', 2)
         
-        time.sleep(interval_hours * 3600)
+        # Clean up PID files - but preserve unlimited streams
+        if os.path.exists(config.PID_DIR):
+            for filename in os.listdir(config.PID_DIR):
+                if filename.endswith('.pid'):
+                    stream_name = filename.replace('ffmpeg_', '').replace('.pid', '')
+                    if not _is_unlimited_stream(stream_name):
+                        file_path = os.path.join(config.PID_DIR, filename)
+                        file_age_days = (time.time() - os.path.getmtime(file_path)) / 86400
+                        if file_age_days > pid_status_ret_days:
+                            try:
+                                os.remove(file_path)
+                                app.logger.info(f"Cleaned up old PID file: {filename}")
+                            except Exception as e:
+                                app.logger.error(f"Error deleting {file_path}: {e}")
+                    else:
+                        app.logger.debug(f"Preserving PID file for unlimited stream: {filename}")
+        
+        # Clean up status files - but preserve unlimited streams
+        if os.path.exists(config.STATUS_DIR):
+            for filename in os.listdir(config.STATUS_DIR):
+                if filename.startswith('ffmpeg_'):
+                    stream_name = filename.replace('ffmpeg_', '').replace('.status', '').replace('.error', '')
+                    if not _is_unlimited_stream(stream_name):
+                        file_path = os.path.join(config.STATUS_DIR, filename)
+                        file_age_days = (time.time() - os.path.getmtime(file_path)) / 86400
+                        if file_age_days > pid_status_ret_days:
+                            try:
+                                os.remove(file_path)
+                                app.logger.info(f"Cleaned up old status file: {filename}")
+                            except Exception as e:
+                                app.logger.error(f"Error deleting {file_path}: {e}")
+                    else:
+                        app.logger.debug(f"Preserving status file for unlimited stream: {filename}")
+
+        # Cleanup based on total directory size (applied after age-based deletion)
+        max_log_dir_mb = getattr(config, 'MAX_LOG_DIR_SIZE_MB', 512)
+        if max_log_dir_mb > 0:
+            # This will apply to remaining .out, .err, and mediamtx.log files. 
+            # ffmpeg_*.log files are managed by RotatingFileHandler, but their sum might still be part of this check implicitly if not excluded by pattern.
+            # Let's make the pattern more specific for .out and .err files if we want to primarily target them for size cap after age. Or apply to all *.* if that is the intent.
+            _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="ffmpeg_*.out")
+            _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="ffmpeg_*.err")
+            _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="mediamtx.log*")
+            # Consider a global cap for LOG_DIR as well if individual caps above aren't enough: _enforce_max_dir_size(config.LOG_DIR, max_log_dir_mb, pattern="*.*")
+
+        max_crash_dir_mb = getattr(config, 'MAX_CRASH_LOG_DIR_SIZE_MB', 256)
+        if max_crash_dir_mb > 0:
+            _enforce_max_dir_size(config.CRASH_LOG_DIR, max_crash_dir_mb, pattern="*.log")
+
+        app.logger.info(f"Periodic cleanup cycle finished. Next run in {interval_hours} hours.")
+    except Exception as e:
+        app.logger.error(f"Error in periodic_cleanup_task: {e}", exc_info=True)
 
-if getattr(config, 'ENABLE_PERIODIC_CLEANUP', False) and config.CLEANUP_INTERVAL_HOURS > 0: # Check if cleanup is enabled and interval is positive
-    app.logger.info("Periodic cleanup is ENABLED. Starting cleanup thread.")
-    cleanup_thread = threading.Thread(target=periodic_cleanup_task, daemon=True)
-    cleanup_thread.start()
+if not _OWNS_STREAMS:
+    pass # The supervisor runs periodic cleanup
+elif getattr(config, 'ENABLE_PERIODIC_CLEANUP', False) and config.CLEANUP_INTERVAL_HOURS > 0: # Check if cleanup is enabled and interval is positive
+    app.logger.info("Periodic cleanup is ENABLED.")
+    _scheduler.every(config.CLEANUP_INTERVAL_HOURS * 3600, periodic_cleanup_task, name='periodic-cleanup', first_delay=0, lane='maintenance')
 else:
     app.logger.info("Periodic cleanup is DISABLED either by ENABLE_PERIODIC_CLEANUP or CLEANUP_INTERVAL_HOURS <= 0.")
 
 # --- End Periodic Cleanup Task ---
 
 
-def _get_process_stats(pid):
-    """Get CPU and memory usage for a process"""
+# One pass over /proc every PROCESS_SAMPLE_INTERVAL samples CPU and memory for every stream at once;
+# health checks read the latest sample instead of blocking a second per stream on psutil.
+# A stream's usage is everything in its ffmpeg's session plus its HLS converter's session.
+_process_sampler = ProcessSampler()
+_stream_usage = {} # name -> totals from the last pass; replaced wholesale each pass
+
+def _stream_session_leaders(details):
+    """Session leader PIDs owned by a stream: its ffmpeg and, if running, its HLS converter."""
+    proc = details.get('process')
+    hls = details.get('hls_converter')
+    hls_proc = hls['process'] if hls else None
+    return {'ffmpeg': proc.pid if proc else None,
+            'hls': hls_proc.pid if hls_proc and hls_proc.poll() is None else None}
+
+def _combine_stream_usage(leaders, sessions):
+    """Per-stream totals from per-session samples, with the ffmpeg and HLS converter parts kept for display."""
+    parts = {role: sessions.get(pid) for role, pid in leaders.items() if pid}
+    if not parts.get('ffmpeg'): return None
+    live = [p for p in parts.values() if p]
+    return {'pid': leaders['ffmpeg'], 'status': parts['ffmpeg']['status'],
+            'cpu_percent': round(sum(p['cpu_percent'] for p in live), 1),
+            'memory_mb': round(sum(p['memory_mb'] for p in live), 1),
+            'processes': sum(p['processes'] for p in live),
+            'ffmpeg': parts['ffmpeg'], 'hls_converter': parts.get('hls')}
+
+def _cgroup_stream_usage(details):
+    """A cgroup-limited stream's usage from cpu.stat/memory.current; the cgroup holds ffmpeg, its children and the HLS converter."""
+    usage = _cgroups.usage(details['cgroup'])
+    if usage is None: return None
+    usage.update(pid=details['process'].pid, status=None, cgroup=os.path.basename(details['cgroup']), limits=_stream_limits(details['config']))
+    return usage
+
+def _usage_over_limits(usage):
+    """Why a stream's usage breaks the polling health limits, or None.
+    A limit the kernel already enforces through the stream's cgroup is not polled."""
+    limits = usage.get('limits') or {}
+    if not limits.get('cpu_cores') and usage['cpu_percent'] > MAX_CPU_USAGE:
+        return f"exceeded CPU limit ({usage['cpu_percent']:.1f}% > {MAX_CPU_USAGE}% across {usage['processes']} processes)"
+    if not limits.get('memory_mb') and usage['memory_mb'] > MAX_MEMORY_USAGE:
+        return f"exceeded memory limit ({usage['memory_mb']:.1f}MB > {MAX_MEMORY_USAGE}MB across {usage['processes']} processes)"
+    return None
+
+def _sample_stream_processes():
+    """Scheduled sampling pass. Streams over a limit get their health check right away."""
+    global _stream_usage
+    streams = active_streams.snapshot()
+    leaders = {name: _stream_session_leaders(d) for name, d in streams.items() if not d.get('cgroup')}
+    sessions = _process_sampler.sample_sessions([pid for roles in leaders.values() for pid in roles.values() if pid])
+    usage = {}
+    for name, details in streams.items():
+        totals = _cgroup_stream_usage(details) if details.get('cgroup') else _combine_stream_usage(leaders[name], sessions)
+        if not totals: continue
+        usage[name] = totals
+        if _usage_over_limits(totals):
+            _scheduler.call_later(0, _run_health_check, name, details['process'], name=f"health-now:{name}", lane='health')
+    _stream_usage = usage
+
+def _get_stream_usage(name, details):
+    """CPU and memory of a stream's whole process tree (its cgroup, or its ffmpeg session + HLS converter session)"""
+    leaders = _stream_session_leaders(details)
+    if not leaders['ffmpeg']: return None
+    usage = _stream_usage.get(name)
+    if usage and usage['pid'] == leaders['ffmpeg']: return usage
+    if details.get('cgroup'):
+        return _cgroup_stream_usage(details)
+    if _process_sampler.available:
+        # Not in the last pass (e.g. a brand new stream): sample its sessions on their own
+        sessions = _process_sampler.sample_sessions([pid for pid in leaders.values() if pid], prune=False)
+        return _combine_stream_usage(leaders, sessions)
     try:
-        import psutil
-        process = psutil.Process(pid)
-        cpu_percent = process.cpu_percent(interval=1)  # Get CPU usage over 1 second
-        memory_info = process.memory_info()
-        memory_mb = memory_info.rss / (1024 * 1024)  # Convert to MB
-        return {
-            'cpu_percent': cpu_percent,
-            'memory_mb': memory_mb,
-            'status': process.status()
-        }
-    except:
-        # If psutil is not available or process doesn't exist
-        try:
-            # Fallback to ps command
-            result = _run_command(f"ps -p {pid} -o %cpu,rss,stat --no-headers")
-            if result.returncode == 0 and result.stdout.strip():
-                parts = result.stdout.strip().split()
-                if len(parts) >= 2:
-                    cpu_percent = float(parts[0])
-                    memory_kb = float(parts[1])
-                    memory_mb = memory_kb / 1024
-                    return {
-                        'cpu_percent': cpu_percent,
-                        'memory_mb': memory_mb,
-                        'status': parts[2] if len(parts) > 2 else 'unknown'
-                    }
-        except:
-            pass
+        # Fallback to ps, summing every process in the stream's sessions
+        sids = ','.join(str(pid) for pid in leaders.values() if pid)
+        result = _run_command(f"ps -s {sids} -o %cpu=,rss=")
+        rows = [line.split() for line in result.stdout.splitlines() if len(line.split()) >= 2] if result.returncode == 0 else []
+        if rows:
+            return {'pid': leaders['ffmpeg'], 'status': 'unknown', 'processes': len(rows),
+                    'cpu_percent': round(sum(float(r[0]) for r in rows), 1),
+                    'memory_mb': round(sum(float(r[1]) for r in rows) / 1024, 1)}
+    except Exception:
+        pass
     return None
 
 def _check_stream_health(name, details):
@@ -2079,21 +4055,18 @@ def _check_stream_health(name, details):
             if elapsed % 3600 < 60:  # Log once per hour (approximately)
                 _log(paths, f"Stream {name} is unlimited, running for {elapsed/3600:.1f} hours")
     
-    # Check process stats
-    stats = _get_process_stats(proc.pid)
+    # Check process stats, summed over ffmpeg, its children and the HLS converter
+    stats = _get_stream_usage(name, details)
     if stats:
-        # Check CPU usage
-        if stats['cpu_percent'] > MAX_CPU_USAGE:
-            _log(paths, f"Stream {name} exceeded CPU limit ({stats['cpu_percent']:.1f}% > {MAX_CPU_USAGE}%)")
-            return False
-        
-        # Check memory usage
-        if stats['memory_mb'] > MAX_MEMORY_USAGE:
-            _log(paths, f"Stream {name} exceeded memory limit ({stats['memory_mb']:.1f}MB > {MAX_MEMORY_USAGE}MB)")
+        # Check CPU and memory usage (limits enforced by the stream's cgroup are left to the kernel)
+        over = _usage_over_limits(stats)
+        if over:
+            _log(paths, f"Stream {name} {over}")
             return False
         
         # Log current stats for monitoring
-        _log(paths, f"Health check: CPU={stats['cpu_percent']:.1f}%, Memory={stats['memory_mb']:.1f}MB")
+        throttled = f", Throttled={stats['throttled_ms']}ms" if 'throttled_ms' in stats else ""
+        _log(paths, f"Health check: CPU={stats['cpu_percent']:.1f}%, Memory={stats['memory_mb']:.1f}MB, Processes={stats['processes']}{throttled}")
     
     # Check for errors in log files
     try:
@@ -2118,44 +4091,60 @@ def _check_stream_health(name, details):
     
     return True
 
-def _health_monitor_thread():
-    """Background thread to monitor health of all active streams"""
-    while True:
-        try:
-            # Create a copy of active streams to avoid modification during iteration
-            streams_to_check = list(active_streams.items())
-            
-            for name, details in streams_to_check:
-                if name not in active_streams:
-                    continue  # Stream was removed while we were checking
-                
-                if not _check_stream_health(name, details):
-                    # Stream is unhealthy, stop it
-                    app.logger.warning(f"Stopping unhealthy stream: {name}")
-                    
-                    # Set stop event
-                    details['stop_event'].set()
-                    
-                    # Log the reason
-                    _update_status(details['paths'], "error", "Stream stopped due to health check failure")
-                    
-                    # Terminate the process
-                    proc = details.get('process')
-                    if proc and proc.pid:
-                        _terminate_process_group(proc.pid, details['paths'], name)
-        
-        except Exception as e:
-            app.logger.error(f"Error in health monitor thread: {e}")
-        
-        # Sleep before next check
-        time.sleep(HEALTH_CHECK_INTERVAL)
+def _run_health_check(name, proc):
+    """Scheduled per stream every HEALTH_CHECK_INTERVAL, staggered so checks don't all land at once."""
+    details = active_streams.get(name)
+    if not details or details.get('process') is not proc:
+        _scheduler.cancel(f"health:{name}") # Stream gone or replaced
+        return
+    if _check_stream_health(name, details): return
+    app.logger.warning(f"Stopping unhealthy stream: {name}")
+    details['stop_event'].set()
+    _update_status(details['paths'], "error", "Stream stopped due to health check failure")
+    if proc.pid:
+        _terminate_process_group(proc.pid, details['paths'], name, proc)
+
+def _schedule_health_check(name, proc):
+    if not config.ENABLE_HEALTH_MONITORING: return
+    _scheduler.every(HEALTH_CHECK_INTERVAL, _run_health_check, name, proc, name=f"health:{name}",
+                     first_delay=random.uniform(0, HEALTH_CHECK_INTERVAL), lane='health')
 
-# Start health monitor thread when app starts
-if config.ENABLE_HEALTH_MONITORING:
-    health_monitor = threading.Thread(target=_health_monitor_thread, daemon=True)
-    health_monitor.start()
+if _OWNS_STREAMS and config.ENABLE_HEALTH_MONITORING:
+    _scheduler.every(getattr(config, 'PROCESS_SAMPLE_INTERVAL', 5), _sample_stream_processes, name='process-sample')
     app.logger.info("Health monitoring enabled")
 
+@app.route('/process_stats', methods=['GET'])
+def process_stats_route():
+    """CPU and memory of every stream's process tree from the latest sampling pass"""
+    streams = {name: usage for name, usage in _stream_usage.items() if name in active_streams}
+    return jsonify(success=True, sampled_at=_process_sampler.last_sample_at,
+                   pass_ms=round(_process_sampler.last_duration * 1000, 2) if _process_sampler.last_duration is not None else None,
+                   interval=getattr(config, 'PROCESS_SAMPLE_INTERVAL', 5), cgroups=_cgroups.status(), streams=streams)
+
+@app.route('/placement', methods=['GET'])
+def placement_route():
+    """Core map of the CPU placement engine: per-node and per-core load and the streams pinned to each core"""
+    if not _placement:
+        return jsonify(success=True, enabled=False, nodes={}, cores=[], streams={},
+                       thread_budget=_thread_budget.stats() if _thread_budget else None)
+    return jsonify(success=True, enabled=True, thread_budget=_thread_budget.stats() if _thread_budget else None, **_placement.snapshot())
+
+@app.route('/encoders', methods=['GET'])
+def get_encoders_route():
+    """Show the cached encoder capabilities and the fingerprint they were probed for"""
+    registry = _get_encoder_registry()
+    return jsonify(success=True, **registry)
+
+@app.route('/encoders/reprobe', methods=['POST'])
+def reprobe_encoders_route():
+    """Force a fresh encoder probe, e.g. after installing drivers or swapping GPUs"""
+    try:
+        registry = refresh_encoder_registry(force=True)
+        return jsonify(success=True, message="Encoder capabilities re-probed", **registry)
+    except Exception as e:
+        app.logger.error(f"Error re-probing encoders: {e}")
+        return jsonify(success=False, message=str(e)), 500
+
 # --- Stream Persistence Management Routes ---
 
 @app.route('/persistent_streams', methods=['GET'])
@@ -2182,14 +4171,29 @@ def clear_persistent_streams_route():
 
 @app.route('/restore_streams', methods=['POST'])
 def restore_streams_route():
-    """Manually trigger stream restoration"""
+    """Manually trigger stream restoration; progress is reported by /restore_status"""
+    if _restore_status['state'] == 'running':
+        return jsonify(success=False, message="Stream restoration already running", **_restore_view()), 409
     try:
-        restore_streams_on_startup()
-        return jsonify(success=True, message="Stream restoration triggered")
+        _start_restore_thread()
+        return jsonify(success=True, message="Stream restoration triggered"), 202
     except Exception as e:
         app.logger.error(f"Error during manual stream restoration: {e}")
         return jsonify(success=False, message=str(e)), 500
 
+def _restore_view():
+    with _restore_lock:
+        status = dict(_restore_status, streams=dict(_restore_status['streams']))
+    done = status['restored'] + status['failed'] + status['skipped'] + status['adopted']
+    status['progress'] = round(done / status['total'], 3) if status['total'] else (1.0 if status['state'] == 'done' else 0.0)
+    status['elapsed_seconds'] = round((status['finished_at'] or time.time()) - status['started_at'], 2) if status['started_at'] else 0
+    return status
+
+@app.route('/restore_status')
+def restore_status_route():
+    """Progress of the current or last stream restoration"""
+    return jsonify(success=True, restore=_restore_view())
+
 # --- End Stream Persistence Management Routes ---
 
 # --- Routes ---
@@ -2199,7 +4203,7 @@ def cleanup_stale_streams_route():
     """Clean up stale error streams that are no longer actively managed"""
     try:
         cleaned_count = 0
-        current_managed_streams = set(active_streams.keys())
+        current_managed_streams = set(active_streams.keys()) | set(_suspended_streams.keys()) | _restart_managed_names()
         
         # Look for status files that represent streams not in active_streams
         for status_f_name in os.listdir(STATUS_DIR):
@@ -2240,6 +4244,8 @@ def hls_playlist(stream_name):
     try:
         hls_dir = os.path.join(config.HLS_DIR, stream_name)
         playlist_path = os.path.join(hls_dir, 'playlist.m3u8')
+        if _note_hls_reader(stream_name): # HLS viewers count as readers for idle suspend
+            return Response("Stream is waking up", status=503, headers={'Retry-After': '2'})
         
         if not os.path.exists(playlist_path):
             return "Playlist not found", 404
@@ -2252,6 +4258,27 @@ def hls_playlist(stream_name):
         app.logger.error(f"Error serving HLS playlist for {stream_name}: {e}")
         return "Error serving playlist", 500
 
+@app.route('/hls/<stream_name>/master.m3u8')
+def hls_master_playlist(stream_name):
+    """Serve the ABR master playlist for a stream"""
+    _note_hls_reader(stream_name, wake=False)
+    master_path = os.path.join(config.HLS_DIR, stream_name, 'master.m3u8')
+    if not os.path.exists(master_path):
+        return "Master playlist not found", 404
+    return send_file(master_path, mimetype='application/vnd.apple.mpegurl')
+
+@app.route('/hls/<stream_name>/<rendition>/<filename>')
+def hls_rendition_file(stream_name, rendition, filename):
+    """Serve an ABR rendition's playlist or segment"""
+    rendition_dir = os.path.join(config.HLS_DIR, stream_name, os.path.basename(rendition))
+    file_path = os.path.join(rendition_dir, os.path.basename(filename))
+    if not os.path.exists(file_path):
+        return "File not found", 404
+    if filename.endswith('.m3u8'):
+        _note_hls_reader(stream_name, wake=False)
+        return send_file(file_path, mimetype='application/vnd.apple.mpegurl')
+    return send_file(file_path, mimetype='video/mp2t')
+
 @app.route('/hls/<stream_name>/<segment>')
 def hls_segment(stream_name, segment):
     """Serve HLS segment files"""
@@ -2272,6 +4299,239 @@ def stream_viewer(stream_name):
     """Stream viewer page"""
     return render_template('stream_viewer.html', stream_name=stream_name)
 
+# --- Cluster Mode ---
+# CLUSTER_ROLE=node instances report their capacity to CLUSTER_COORDINATOR_URL every CLUSTER_HEARTBEAT_INTERVAL.
+# A CLUSTER_ROLE=coordinator instance places /start_stream requests on the best node, forwards /stop_stream
+# to the node running the stream, and re-places the streams of nodes that stop sending heartbeats. With
+# SUPERVISOR_MODE=client, cluster state and timers live in the supervisor and the cluster routes are forwarded.
+_CLUSTER_ROLE = getattr(config, 'CLUSTER_ROLE', 'standalone')
+_cluster = ClusterState(node_timeout=getattr(config, 'CLUSTER_NODE_TIMEOUT', 15)) if _CLUSTER_ROLE == 'coordinator' and _OWNS_STREAMS else None
+_cluster_last_heartbeat = {'at': None, 'status': None}
+
+def _cluster_http(url, method='GET', body=None, timeout=None):
+    """JSON request to another StreamAlchemy instance. Returns (http_status, parsed_json_or_None); status 0 if unreachable."""
+    req = urllib.request.Request(url, method=method,
+                                 data=json.dumps(body).encode() if body is not None else None,
+                                 headers={'Content-Type': 'application/json'} if body is not None else {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout or getattr(config, 'CLUSTER_REQUEST_TIMEOUT', 30)) as resp:
+            raw = resp.read()
+            return resp.status, (json.loads(raw) if raw else None)
+    except urllib.error.HTTPError as e:
+        try: return e.code, json.loads(e.read() or b'null')
+        except ValueError: return e.code, None
+    except Exception:
+        return 0, None
+
+def _cluster_encoder_key(data):
+    return f"{data.get('video_codec', 'h264')}:{'hw' if data.get('hardware_accel') == 'yes' else 'sw'}"
+
+def _node_report():
+    """This node's capacity and load, as sent in each heartbeat."""
+    cores = os.cpu_count() or 1
+    try: best = _get_encoder_registry()['best']
+    except Exception: best = {}
+    try: load = os.getloadavg()[0]
+    except (AttributeError, OSError): load = 0.0
+    return {'node_id': config.CLUSTER_NODE_ID, 'url': config.CLUSTER_NODE_URL, 'cores': cores,
+            'max_streams': getattr(config, 'CLUSTER_NODE_MAX_STREAMS', 0) or cores,
+            'encoders': {key: {'name': enc.get('name'), 'type': enc.get('type')} for key, enc in best.items()},
+            'load': round(load, 2), 'streams': sorted(set(active_streams) | set(_suspended_streams) | _restart_managed_names())}
+
+def _send_node_heartbeat():
+    if _shutdown_in_progress: return
+    url = f"{config.CLUSTER_COORDINATOR_URL.rstrip('/')}/cluster/heartbeat"
+    status, resp = _cluster_http(url, 'POST', _node_report(), timeout=10)
+    if status != _cluster_last_heartbeat['status']:
+        app.logger.info(f"Cluster heartbeat to {url}: HTTP {status or 'unreachable'}")
+    _cluster_last_heartbeat.update(at=time.time(), status=status)
+    # Streams the coordinator moved elsewhere while we were unreachable
+    for name in (resp or {}).get('stop', []):
+        app.logger.warning(f"Coordinator re-placed {name} on another node, stopping local copy")
+        _stop_stream(name)
+
+def _place_stream(data, exclude=()):
+    """Start a stream on the best node that accepts it. Returns (ok, node_id, node_response)."""
+    name = data['stream_name']
+    prev = _cluster.assignment(name)
+    resp, node_id = {'success': False, 'message': "No node with capacity for this stream"}, None
+    for node_id in _cluster.candidates(_cluster_encoder_key(data), exclude)[:getattr(config, 'CLUSTER_PLACEMENT_ATTEMPTS', 3)]:
+        node = _cluster.node(node_id)
+        _cluster.assign(name, node_id, data) # Reserve the slot so concurrent placements see it
+        status, resp = _cluster_http(f"{node['url']}/start_stream", 'POST', data)
+        if status == 200 and resp and resp.get('success'):
+            return True, node_id, resp
+        resp = resp or {'success': False, 'message': f"Node {node_id} unreachable"}
+        app.logger.warning(f"Placing {name} on {node_id} failed: {resp.get('message')}")
+    _cluster.release(name, prev)
+    return False, node_id, resp
+
+def _coordinator_start():
+    data = request.get_json(silent=True) or {}
+    name = data.get('stream_name')
+    if not name or not re.match(r'^[a-zA-Z0-9_-]+$', name): return jsonify(success=False, message='Bad stream name'), 400
+    if _cluster.assignment(name): return jsonify(success=False, message='Stream name active.'), 400
+    data.pop('async', None)
+    ok, node_id, resp = _place_stream(data)
+    node = _cluster.node(node_id) if node_id else None
+    return jsonify(dict(resp, node_id=node_id, node_url=node['url'] if node else None)), 200 if ok else (503 if node_id is None else 400)
+
+def _coordinator_stop():
+    name = (request.get_json(silent=True) or {}).get('stream_name')
+    if not name: return jsonify(success=False, message="No stream_name"), 400
+    assignment = _cluster.assignment(name)
+    if not assignment: return jsonify(success=False, message=f"{name} was not placed by this coordinator."), 404
+    node = _cluster.node(assignment['node_id'])
+    status, resp = _cluster_http(f"{node['url']}/stop_stream", 'POST', {'stream_name': name}) if node and node['alive'] else (0, None)
+    _cluster.unassign(name)
+    if status == 0:
+        return jsonify(success=True, message=f"Node {assignment['node_id']} is down; {name} removed from the cluster.", node_id=assignment['node_id'])
+    return jsonify(dict(resp or {}, node_id=assignment['node_id'])), status
+
+@app.before_request
+def _route_through_coordinator():
+    if _cluster is None: return None
+    if request.endpoint == 'start_stream_route': return _coordinator_start()
+    if request.endpoint == 'stop_stream_route': return _coordinator_stop()
+    return None
+
+def _coordinator_monitor():
+    """Expire silent nodes and re-place their streams on healthy ones."""
+    if _shutdown_in_progress: return
+    for node_id in _cluster.expire_nodes():
+        app.logger.warning(f"Cluster node {node_id} missed its heartbeats, re-placing its streams")
+    for name, data, old_node in _cluster.orphaned_streams():
+        ok, node_id, resp = _place_stream(data, exclude={old_node})
+        if ok: app.logger.info(f"Re-placed {name} from {old_node} on {node_id}")
+        else: app.logger.warning(f"Could not re-place {name} from {old_node} yet: {resp.get('message')}")
+
+@app.route('/cluster/heartbeat', methods=['POST'])
+def cluster_heartbeat_route():
+    if _cluster is None: return jsonify(success=False, message="Not a cluster coordinator"), 404
+    report = request.get_json(silent=True) or {}
+    if not report.get('node_id') or not report.get('url'): return jsonify(success=False, message="node_id and url required"), 400
+    if _cluster.heartbeat(report['node_id'], report['url'], report.get('cores'), report.get('max_streams'),
+                          report.get('encoders'), report.get('load'), report.get('streams') or ()):
+        app.logger.info(f"Cluster node {report['node_id']} joined at {report['url']}")
+    assignments = _cluster.assignments()
+    stop = [n for n in report.get('streams') or () if n in assignments and assignments[n]['node_id'] != report['node_id']]
+    return jsonify(success=True, stop=stop)
+
+@app.route('/cluster/nodes', methods=['GET'])
+def cluster_nodes_route():
+    if _cluster is None:
+        return jsonify(success=True, role=_CLUSTER_ROLE, node=_node_report() if _CLUSTER_ROLE == 'node' else None,
+                       coordinator=getattr(config, 'CLUSTER_COORDINATOR_URL', None), last_heartbeat=_cluster_last_heartbeat)
+    return jsonify(success=True, role=_CLUSTER_ROLE, nodes=_cluster.nodes())
+
+@app.route('/cluster/streams', methods=['GET'])
+def cluster_streams_route():
+    """Every stream in the cluster: placed streams with their node and state, plus streams nodes run on their own."""
+    if _cluster is None: return jsonify(success=False, message="Not a cluster coordinator"), 404
+    nodes = {n['node_id']: n for n in _cluster.nodes()}
+    streams, placed = [], set()
+    for name, a in sorted(_cluster.assignments().items()):
+        node = nodes.get(a['node_id'], {})
+        state = 'node_down' if not node.get('alive') else ('running' if name in node['streams'] else 'starting')
+        streams.append({'name': name, 'node_id': a['node_id'], 'node_url': node.get('url'), 'state': state,
+                        'placements': a['placements'], 'assigned_at': a['assigned_at']})
+        placed.add(name)
+    for node in nodes.values():
+        if not node['alive']: continue
+        streams.extend({'name': n, 'node_id': node['node_id'], 'node_url': node['url'], 'state': 'unmanaged'}
+                       for n in node['streams'] if n not in placed)
+    return jsonify(success=True, total=len(streams), streams=streams)
+
+if _CLUSTER_ROLE == 'coordinator' and _OWNS_STREAMS:
+    _scheduler.every(getattr(config, 'CLUSTER_HEARTBEAT_INTERVAL', 5), _coordinator_monitor, name='cluster-monitor', first_delay=0, lane='cluster')
+    app.logger.info("Cluster coordinator mode: /start_stream places streams on registered nodes")
+elif _CLUSTER_ROLE == 'node' and _OWNS_STREAMS and getattr(config, 'CLUSTER_COORDINATOR_URL', ''):
+    _scheduler.every(getattr(config, 'CLUSTER_HEARTBEAT_INTERVAL', 5), _send_node_heartbeat, name='cluster-heartbeat', first_delay=0, lane='cluster')
+    app.logger.info(f"Cluster node {config.CLUSTER_NODE_ID} reporting to {config.CLUSTER_COORDINATOR_URL}")
+
+# --- End Cluster Mode ---
+
+# --- Stream Supervisor Control API ---
+# With SUPERVISOR_MODE=client, the routes below run in the supervisor process (stream_supervisor.py) and web
+# workers forward them over the SUPERVISOR_SOCKET Unix socket. Routes that only read files (videos, logs,
+# HLS playlists and segments, the UI) are still served by the web worker; HLS playlist requests only report
+# the reader to the supervisor (_note_hls_reader).
+_SUPERVISED_ENDPOINTS = {
+    'start_stream_route', 'stop_stream_route', 'batch_start_route', 'batch_stop_route', 'get_job_route',
+    'get_active_streams_route', 'cleanup_stale_streams_route', 'wake_stream_route', 'on_demand_status_route',
+    'spawn_stats_route', 'get_shared_encoders_route', 'get_transcode_cache_route', 'clear_transcode_cache_route',
+    'mediamtx_status_route', 'mediamtx_restart_route', 'get_encoders_route', 'reprobe_encoders_route',
+    'get_persistent_streams_route', 'clear_persistent_streams_route', 'restore_streams_route', 'restore_status_route',
+    'cluster_heartbeat_route', 'cluster_nodes_route', 'cluster_streams_route', 'restart_stream_route', 'restarts_route',
+    'timers_route', 'process_stats_route', 'placement_route',
+}
+_FORWARDED_HEADERS = ('Retry-After', 'Cache-Control')
+_supervisor_started_at = time.time()
+_supervisor_client_instance = None
+
+def _supervisor_client():
+    global _supervisor_client_instance
+    if _supervisor_client_instance is None:
+        _supervisor_client_instance = SupervisorClient(config.SUPERVISOR_SOCKET, timeout=getattr(config, 'SUPERVISOR_TIMEOUT', 300))
+    return _supervisor_client_instance
+
+@app.before_request
+def _forward_to_supervisor():
+    if _OWNS_STREAMS or request.endpoint not in _SUPERVISED_ENDPOINTS: return None
+    try:
+        result = _supervisor_client().call('dispatch', method=request.method, path=request.path,
+                                           query=request.query_string.decode(), body=request.get_json(silent=True))
+    except SupervisorUnavailable as e:
+        app.logger.error(f"Forwarding {request.method} {request.path} failed: {e}")
+        return jsonify(success=False, message="Stream supervisor is not available."), 503
+    except SupervisorError as e:
+        return jsonify(success=False, message=f"Stream supervisor error: {e}"), 502
+    if 'json' in result:
+        resp = app.response_class(json.dumps(result['json']), mimetype='application/json')
+    else:
+        resp = Response(result.get('text', ''), mimetype=result.get('mimetype'))
+    resp.status_code = result['status']
+    for name, value in (result.get('headers') or {}).items():
+        resp.headers[name] = value
+    return resp
+
+def _supervisor_dispatch(method, path, query='', body=None):
+    """Run one forwarded route in this (supervisor) process and return its response as plain data."""
+    kwargs = {'method': method, 'query_string': query}
+    if body is not None: kwargs['json'] = body
+    with app.test_request_context(path, **kwargs):
+        if request.endpoint not in _SUPERVISED_ENDPOINTS:
+            return {'status': 403, 'json': {'success': False, 'message': f"{path} is not a supervisor route"}}
+        resp = app.full_dispatch_request()
+    resp.direct_passthrough = False # send_file responses are read into memory
+    result = {'status': resp.status_code,
+              'headers': {h: resp.headers[h] for h in _FORWARDED_HEADERS if h in resp.headers}}
+    if resp.is_json:
+        result['json'] = resp.get_json()
+    else:
+        result.update(text=resp.get_data(as_text=True), mimetype=resp.mimetype)
+    return result
+
+def _supervisor_ping():
+    return {'pid': os.getpid(), 'mode': _SUPERVISOR_MODE, 'uptime_seconds': round(time.time() - _supervisor_started_at, 1),
+            'active_streams': len(active_streams), 'suspended_streams': len(_suspended_streams)}
+
+def supervisor_ops():
+    """Ops served on the supervisor socket."""
+    return {'ping': _supervisor_ping, 'dispatch': _supervisor_dispatch, 'hls_reader': _note_hls_reader}
+
+@app.route('/supervisor/status', methods=['GET'])
+def supervisor_status_route():
+    """Which process owns the streams, and whether it is reachable"""
+    if _OWNS_STREAMS:
+        return jsonify(success=True, supervisor=_supervisor_ping())
+    try:
+        return jsonify(success=True, supervisor=_supervisor_client().call('ping', timeout=5), web_pid=os.getpid())
+    except (SupervisorUnavailable, SupervisorError) as e:
+        return jsonify(success=False, message=str(e), web_pid=os.getpid()), 503
+
+# --- End Stream Supervisor Control API ---
+
 if __name__ == '__main__':
     # Validate configuration
     if hasattr(config, 'validate_config'):
@@ -2281,7 +4541,8 @@ if __name__ == '__main__':
                 app.logger.error(f"Configuration error: {error}")
             sys.exit(1)
     
-    # Restore streams from previous session
-    restore_streams_on_startup()
+    # Restore streams from previous session in the background so the API (and /restore_status) is up at once
+    if _OWNS_STREAMS:
+        _start_restore_thread()
     
     app.run(debug=config.DEBUG, host=config.HOST, port=config.PORT) 
\ No newline at end of file
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+StreamAlchemy - Encoder Thread Budget Benchmark
+Runs N concurrent libx264 encodes with and without the host-wide thread budget
+(thread_budget.py) and reports aggregate throughput.
+
+Each stream encodes a synthetic testsrc2 source as fast as it can (no -re) to
+the null muxer, so the numbers measure encoding capacity rather than realtime
+pacing. With the budget, every command passes through the same
+estimate_cost() -> ThreadBudget.threads_for() -> apply_thread_budget() steps
+the server uses, and streams are committed one after another as they start.
+
+Reported per run:
+- Aggregate fps over the measurement window (after a warmup)
+- Average fps per stream, and how many streams could run in realtime at the target fps
+- Total ffmpeg threads and context switches per second
+
+Needs ffmpeg with libx264 in PATH. No server, MediaMTX or network is used.
+
+Example:
+    python benchmark_thread_budget.py                      # 10, 50 and 100 streams, 720p30
+    python benchmark_thread_budget.py --streams 10,20 --resolution 1920x1080 --duration 30
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cpu_placement import estimate_cost
+from thread_budget import ThreadBudget, apply_thread_budget
+
+
+def build_command(resolution, fps, progress_file):
+    """The server's libx264 encode settings on a synthetic source, writing to the null muxer."""
+    return ['ffmpeg', '-hide_banner', '-nostdin', '-loglevel', 'error', '-progress', progress_file, '-stats_period', '0.5',
+            '-f', 'lavfi', '-i', f"testsrc2=size={resolution}:rate={fps}",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'baseline', '-s', resolution,
+            '-b_strategy', '0', '-bf', '0', '-g', str(fps * 2), '-b:v', '2500k', '-pix_fmt', 'yuv420p', '-r', str(fps),
+            '-f', 'null', '-']
+
+
+def read_frames(progress_file):
+    """Last frame count ffmpeg reported in its -progress file."""
+    try:
+        with open(progress_file) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return 0
+    for line in reversed(lines):
+        if line.startswith('frame='):
+            try:
+                return int(line[6:])
+            except ValueError:
+                return 0
+    return 0
+
+
+def read_proc_counters(pids):
+    """(threads, context switches) summed over the processes, from /proc/<pid>/status."""
+    threads = switches = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    key, _, value = line.partition(':')
+                    if key == 'Threads':
+                        threads += int(value)
+                    elif key in ('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches'):
+                        switches += int(value)
+        except (OSError, ValueError):
+            pass
+    return threads, switches
+
+
+def run(streams, budgeted, resolution, fps, warmup, duration, cores, workdir):
+    budget = ThreadBudget(cores) if budgeted else None
+    procs, progress_files, thread_counts = [], [], []
+    try:
+        for i in range(streams):
+            progress = os.path.join(workdir, f"{'budget' if budgeted else 'default'}_{streams}_{i}.progress")
+            cmd = build_command(resolution, fps, progress)
+            if budget:
+                cost = estimate_cost(cmd)
+                threads = budget.threads_for(cost)
+                cmd = apply_thread_budget(cmd, threads)
+                budget.commit(f"s{i}", cost)
+                thread_counts.append(threads)
+            procs.append(subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            progress_files.append(progress)
+        time.sleep(warmup)
+        pids = [p.pid for p in procs]
+        frames0, (_, switches0), t0 = sum(read_frames(f) for f in progress_files), read_proc_counters(pids), time.monotonic()
+        time.sleep(duration)
+        frames1, (threads, switches1), t1 = sum(read_frames(f) for f in progress_files), read_proc_counters(pids), time.monotonic()
+        failed = sum(1 for p in procs if p.poll() is not None)
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+        for p in procs:
+            p.wait()
+    elapsed = t1 - t0
+    aggregate = (frames1 - frames0) / elapsed
+    return {'streams': streams, 'mode': 'budget' if budgeted else 'default', 'aggregate_fps': round(aggregate, 1),
+            'fps_per_stream': round(aggregate / streams, 1), 'realtime_streams': int(aggregate // fps),
+            'threads': threads, 'ctx_switches_per_s': int((switches1 - switches0) / elapsed),
+            'encoder_threads': f"{min(thread_counts)}-{max(thread_counts)}" if thread_counts else 'ffmpeg default',
+            'failed': failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark aggregate libx264 throughput with and without the encoder thread budget")
+    parser.add_argument('--streams', default='10,50,100', help="Comma-separated concurrent stream counts (default: 10,50,100)")
+    parser.add_argument('--resolution', default='1280x720', help="Encode size WxH (default: 1280x720)")
+    parser.add_argument('--fps', type=int, default=30, help="Source and target fps (default: 30)")
+    parser.add_argument('--warmup', type=float, default=5, help="Seconds before measuring (default: 5)")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds measured per run (default: 20)")
+    parser.add_argument('--cores', type=int, default=0, help="Cores for the budget (default: CPUs this process may use)")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON")
+    args = parser.parse_args()
+
+    if not shutil.which('ffmpeg'):
+        print("ffmpeg not found in PATH", file=sys.stderr)
+        return 1
+    encoders = subprocess.run(['ffmpeg', '-hide_banner', '-encoders'], capture_output=True, text=True).stdout
+    if 'libx264' not in encoders:
+        print("ffmpeg was built without libx264", file=sys.stderr)
+        return 1
+    cores = args.cores or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+    counts = [int(n) for n in args.streams.split(',') if n.strip()]
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='thread_budget_bench_') as workdir:
+        for streams in counts:
+            for budgeted in (False, True):
+                if not args.json:
+                    print(f"Running {streams} streams ({'budget' if budgeted else 'default'} threads)...", flush=True)
+                results.append(run(streams, budgeted, args.resolution, args.fps, args.warmup, args.duration, cores, workdir))
+
+    if args.json:
+        print(json.dumps({'cores': cores, 'resolution': args.resolution, 'fps': args.fps, 'results': results}, indent=2))
+        return 0
+    print(f"\n{cores} cores, {args.resolution} @ {args.fps} fps, libx264 veryfast, {args.duration:.0f}s window\n")
+    header = f"{'streams':>7}  {'mode':<8} {'agg fps':>9} {'fps/stream':>10} {'realtime':>8} {'threads':>8} {'ctxsw/s':>9}  encoder threads"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['streams']:>7}  {r['mode']:<8} {r['aggregate_fps']:>9} {r['fps_per_stream']:>10} {r['realtime_streams']:>8} "
+              f"{r['threads']:>8} {r['ctx_switches_per_s']:>9}  {r['encoder_threads']}" + (f"  ({r['failed']} exited early)" if r['failed'] else ''))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
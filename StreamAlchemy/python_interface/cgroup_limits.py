@@ -0,0 +1,284 @@
+"""
+Per-stream cgroup v2 limits for StreamAlchemy.
+
+On a host that delegates a cgroup v2 subtree to the app, each stream runs in
+a cgroup of its own under ``<root>/streams/``. That covers its ffmpeg, the
+HLS converter and anything they fork. The kernel then enforces ``cpu.max``,
+``memory.max`` and ``io.weight``. A runaway stream is throttled at its CPU
+quota, or OOM-killed at its memory limit, instead of slowing every other
+stream down until a health check notices. Usage is read from ``cpu.stat``
+and ``memory.current``, so nothing has to walk /proc.
+
+``CgroupManager.setup()`` checks that the tree is usable and delegated to
+the app. Write access alone proves nothing, since root can write to every
+cgroup, including the ones systemd manages. A cgroup counts as delegated
+when systemd marked it so (``Delegate=yes`` sets the ``trusted.delegate`` or
+``user.delegate`` xattr), or when the directory and its ``cgroup.procs`` and
+``cgroup.subtree_control`` belong to the app's non-root user. Root can also
+name a cgroup it owns with ``CGROUP_ROOT``. If the tree is unusable,
+``enabled`` stays False, ``reason`` says why, and the app keeps its polling
+health limits.
+
+Limits come from a resource class (``STREAM_RESOURCE_CLASSES`` in
+config.py), which ``cpu_limit``, ``memory_limit_mb`` and ``io_weight`` in the
+stream config can override. See ``resolve_limits()``.
+"""
+
+import errno
+import logging
+import os
+import signal
+import threading
+import time
+
+CPU_PERIOD_US = 100000
+CONTROLLERS = ('cpu', 'memory', 'io')  # io is optional; cpu and memory are required
+DELEGATE_XATTRS = ('trusted.delegate', 'user.delegate')  # Set to "1" by systemd on Delegate=yes cgroups
+
+
+class CgroupUnavailable(Exception):
+    """The cgroup tree can't be used; the message says why."""
+
+
+def resolve_limits(stream_config, classes, default_class):
+    """{'class', 'cpu_cores', 'memory_mb', 'io_weight'} for a stream. None means unlimited.
+    Raises ValueError for an unknown class."""
+    cls = stream_config.get('resource_class') or default_class
+    if cls not in classes:
+        raise ValueError(f"unknown resource class {cls!r}")
+    limits = {'class': cls, 'cpu_cores': None, 'memory_mb': None, 'io_weight': None}
+    limits.update({k: v for k, v in classes[cls].items() if k in limits})
+    for key, field in (('cpu_limit', 'cpu_cores'), ('memory_limit_mb', 'memory_mb'), ('io_weight', 'io_weight')):
+        if stream_config.get(key) is not None:
+            limits[field] = stream_config[key]
+    return limits
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def _write(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def _read_keyed(path):
+    """'key value' lines (cpu.stat, memory.events) as a dict of ints."""
+    out = {}
+    for line in _read(path).splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            out[parts[0]] = int(parts[1])
+    return out
+
+
+class CgroupManager:
+    """Creates, fills, reads and removes per-stream cgroups under ``<root>/streams``. Thread-safe."""
+
+    def __init__(self, root='', mount='/sys/fs/cgroup', proc_root='/proc', logger=None, clock=time.monotonic, uid=None):
+        self.root = root
+        self.uid = os.geteuid() if uid is None else uid
+        self.mount = mount
+        self.proc_root = proc_root
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._prev = {}  # cgroup path -> (usage_usec, sampled at)
+        self.base = None
+        self.streams_dir = None
+        self.controllers = []
+        self.enabled = False
+        self.reason = 'not set up'
+
+    # --- setup ---
+
+    def setup(self):
+        """Prepare ``<root>/streams``. Returns ``enabled``; on failure ``reason`` says why."""
+        try:
+            self._setup()
+        except (CgroupUnavailable, OSError) as e:
+            self.enabled, self.reason = False, str(e)
+            return False
+        self.enabled, self.reason = True, ''
+        return True
+
+    def _setup(self):
+        if not os.path.exists(os.path.join(self.mount, 'cgroup.controllers')):
+            raise CgroupUnavailable(f"no cgroup v2 hierarchy at {self.mount} (cgroup v1 or hybrid host)")
+        base = self.root or self._own_cgroup()
+        available = _read(os.path.join(base, 'cgroup.controllers')).split()
+        missing = [c for c in ('cpu', 'memory') if c not in available]
+        if missing:
+            raise CgroupUnavailable(f"{'/'.join(missing)} controller not delegated to {base}")
+        if not self._delegated(base):
+            raise CgroupUnavailable(f"{base} is not delegated to this process (use systemd Delegate=yes, "
+                                    f"or set CGROUP_ROOT to a cgroup owned by this user)")
+        controllers = [c for c in CONTROLLERS if c in available]
+        # cgroup v2 forbids processes in a cgroup that hands controllers to its children (except the root)
+        procs = _read(os.path.join(base, 'cgroup.procs')).split()
+        if procs and os.path.realpath(base) != os.path.realpath(self.mount):
+            if self.root:
+                raise CgroupUnavailable(f"{base} has processes of its own; point CGROUP_ROOT at an empty delegated cgroup")
+            leaf = os.path.join(base, 'app')
+            os.makedirs(leaf, exist_ok=True)
+            for pid in procs:
+                self._attach(leaf, pid)
+        self._enable_controllers(base, controllers)
+        streams_dir = os.path.join(base, 'streams')
+        os.makedirs(streams_dir, exist_ok=True)
+        self._enable_controllers(streams_dir, controllers)
+        self.base, self.streams_dir, self.controllers = base, streams_dir, controllers
+
+    def _delegated(self, base):
+        """True if ``base`` was handed to us: systemd's delegate xattr, or ownership of the cgroup and its
+        control files (by a non-root user, or by root for an explicitly configured CGROUP_ROOT)."""
+        for attr in DELEGATE_XATTRS:
+            try:
+                if os.getxattr(base, attr).strip() == b'1':
+                    return True
+            except (OSError, AttributeError):
+                pass
+        if self.uid == 0 and not self.root:
+            return False  # Root owns every cgroup, so ownership proves nothing about its own
+        try:
+            owners = {os.stat(os.path.join(base, f)).st_uid for f in ('.', 'cgroup.procs', 'cgroup.subtree_control')}
+        except OSError:
+            return False
+        return owners == {self.uid} and os.access(base, os.W_OK)
+
+    def _own_cgroup(self):
+        for line in _read(os.path.join(self.proc_root, 'self', 'cgroup')).splitlines():
+            if line.startswith('0::'):
+                return os.path.join(self.mount, line[3:].strip().lstrip('/'))
+        raise CgroupUnavailable("this process is not in a cgroup v2 hierarchy")
+
+    @staticmethod
+    def _enable_controllers(path, controllers):
+        enabled = _read(os.path.join(path, 'cgroup.subtree_control')).split()
+        wanted = [c for c in controllers if c not in enabled]
+        if wanted:
+            _write(os.path.join(path, 'cgroup.subtree_control'), ' '.join(f"+{c}" for c in wanted))
+
+    # --- per-stream cgroups ---
+
+    def create(self, name, limits):
+        """Make a cgroup for one launch of stream ``name`` and write its limits. Returns its path.
+        Raises OSError if the cgroup or a limit can't be written."""
+        path = os.path.join(self.streams_dir, f"{name}-{time.time_ns() // 1000000}")
+        os.mkdir(path)
+        try:
+            self.apply_limits(path, limits)
+        except OSError:
+            self.remove(path)
+            raise
+        return path
+
+    def apply_limits(self, path, limits):
+        cores = limits.get('cpu_cores')
+        _write(os.path.join(path, 'cpu.max'), f"{int(cores * CPU_PERIOD_US) if cores else 'max'} {CPU_PERIOD_US}")
+        memory_mb = limits.get('memory_mb')
+        _write(os.path.join(path, 'memory.max'), str(int(memory_mb * 1024 * 1024)) if memory_mb else 'max')
+        if limits.get('io_weight') and 'io' in self.controllers:
+            try:
+                _write(os.path.join(path, 'io.weight'), f"default {int(limits['io_weight'])}")
+            except OSError as e:  # io.weight needs an IO scheduler that supports it; not worth failing the stream
+                self.logger.debug(f"Could not set io.weight on {path}: {e}")
+
+    def attach(self, path, pid):
+        """Move ``pid`` into the cgroup. Children it forks afterwards start there too."""
+        self._attach(path, pid)
+
+    @staticmethod
+    def _attach(path, pid):
+        _write(os.path.join(path, 'cgroup.procs'), str(pid))
+
+    def find(self, pid):
+        """The per-stream cgroup ``pid`` is in, or None (e.g. to re-own a stream adopted after an upgrade)."""
+        if not self.enabled:
+            return None
+        try:
+            for line in _read(os.path.join(self.proc_root, str(pid), 'cgroup')).splitlines():
+                if line.startswith('0::'):
+                    path = os.path.join(self.mount, line[3:].strip().lstrip('/'))
+                    return path if os.path.dirname(path) == self.streams_dir else None
+        except OSError:
+            pass
+        return None
+
+    def usage(self, path):
+        """{'cpu_percent', 'memory_mb', 'processes', 'throttled_ms', 'oom_kills'} of a cgroup, or None once it's gone.
+        cpu_percent is the usage since the previous call (100 = one core); the first call reports 0."""
+        try:
+            cpu = _read_keyed(os.path.join(path, 'cpu.stat'))
+            memory = int(_read(os.path.join(path, 'memory.current')).strip() or 0)
+            processes = len(_read(os.path.join(path, 'cgroup.procs')).split())
+            events = _read_keyed(os.path.join(path, 'memory.events')) if os.path.exists(os.path.join(path, 'memory.events')) else {}
+        except (OSError, ValueError):
+            return None
+        now = self._clock()
+        usage_usec = cpu.get('usage_usec', 0)
+        with self._lock:
+            prev = self._prev.get(path)
+            self._prev[path] = (usage_usec, now)
+        cpu_percent = (usage_usec - prev[0]) / ((now - prev[1]) * 1e6) * 100 if prev and now > prev[1] else 0.0
+        return {'cpu_percent': round(max(0.0, cpu_percent), 1), 'memory_mb': round(memory / (1024 * 1024), 1),
+                'processes': processes, 'throttled_ms': cpu.get('throttled_usec', 0) // 1000,
+                'oom_kills': events.get('oom_kill', 0)}
+
+    def kill(self, path):
+        """SIGKILL everything left in the cgroup (cgroup.kill, or each listed PID on kernels before 5.14)."""
+        try:
+            if os.path.exists(os.path.join(path, 'cgroup.kill')):
+                _write(os.path.join(path, 'cgroup.kill'), '1')
+                return
+            for pid in _read(os.path.join(path, 'cgroup.procs')).split():
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except (OSError, ValueError):
+                    pass
+        except OSError:
+            pass
+
+    def remove(self, path):
+        """Remove an empty cgroup. Returns False while processes are still in it."""
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            if e.errno in (errno.EBUSY, errno.ENOTEMPTY):
+                return False
+            raise
+        with self._lock:
+            self._prev.pop(path, None)
+        return True
+
+    def prune(self, keep=()):
+        """Remove empty per-stream cgroups not in ``keep`` (left over from crashes or earlier runs). Returns how many."""
+        if not self.enabled:
+            return 0
+        keep = set(keep)
+        removed = 0
+        try:
+            entries = [e.path for e in os.scandir(self.streams_dir) if e.is_dir()]
+        except OSError:
+            return 0
+        for path in entries:
+            if path not in keep:
+                try:
+                    removed += self.remove(path)
+                except OSError:
+                    pass
+        return removed
+
+    def status(self):
+        count = 0
+        if self.enabled:
+            try:
+                count = sum(1 for e in os.scandir(self.streams_dir) if e.is_dir())
+            except OSError:
+                pass
+        return {'enabled': self.enabled, 'reason': self.reason, 'root': self.base, 'streams_dir': self.streams_dir,
+                'controllers': self.controllers, 'cgroups': count}
@@ -0,0 +1,141 @@
+"""
+Cluster bookkeeping for StreamAlchemy coordinator mode.
+
+Nodes send a heartbeat to the coordinator with their capacity: cores, the
+encoder picked for each codec/hardware combination, load average, running
+streams and a stream limit. The coordinator keeps two tables here. One is the
+node table. The other maps each stream it placed to a node, together with the
+start request, so the stream can be placed again if that node dies.
+
+This module does no I/O. app.py does the HTTP calls and calls back into the
+ClusterState methods, which makes the placement and failover rules testable
+on their own.
+"""
+
+import threading
+import time
+
+
+class ClusterState:
+    """Node registry, stream assignments and placement decisions. Thread-safe."""
+
+    def __init__(self, node_timeout=15.0, clock=time.time):
+        self.node_timeout = node_timeout
+        self._clock = clock
+        self._lock = threading.RLock()
+        self._nodes = {}        # node_id -> node dict
+        self._assignments = {}  # stream name -> {'node_id', 'request', 'assigned_at', 'placements'}
+
+    # --- nodes ---
+
+    def heartbeat(self, node_id, url, cores=1, max_streams=None, encoders=None, load=0.0, streams=()):
+        """Register or refresh a node. Returns True if the node is new or was previously dead."""
+        now = self._clock()
+        with self._lock:
+            node = self._nodes.get(node_id)
+            revived = node is None or not node['alive']
+            self._nodes[node_id] = {
+                'node_id': node_id,
+                'url': url.rstrip('/'),
+                'cores': max(1, int(cores or 1)),
+                'max_streams': int(max_streams) if max_streams else max(1, int(cores or 1)),
+                'encoders': dict(encoders or {}),
+                'load': float(load or 0.0),
+                'streams': sorted(streams),
+                'last_seen': now,
+                'registered_at': node['registered_at'] if node else now,
+                'alive': True,
+            }
+            return revived
+
+    def nodes(self):
+        with self._lock:
+            return [dict(n, assigned=self._assigned_count(n['node_id'])) for n in self._nodes.values()]
+
+    def node(self, node_id):
+        with self._lock:
+            node = self._nodes.get(node_id)
+            return dict(node) if node else None
+
+    def remove_node(self, node_id):
+        with self._lock:
+            self._nodes.pop(node_id, None)
+
+    def expire_nodes(self):
+        """Mark nodes without a recent heartbeat as dead. Returns the node ids that just died."""
+        cutoff = self._clock() - self.node_timeout
+        died = []
+        with self._lock:
+            for node in self._nodes.values():
+                if node['alive'] and node['last_seen'] < cutoff:
+                    node['alive'] = False
+                    died.append(node['node_id'])
+        return died
+
+    # --- placement ---
+
+    def _assigned_count(self, node_id):
+        return sum(1 for a in self._assignments.values() if a['node_id'] == node_id)
+
+    def _score(self, node, encoder_key):
+        """Higher is better; None if the node can't take the stream."""
+        if not node['alive'] or encoder_key not in node['encoders']:
+            return None
+        # Streams placed since the node's last heartbeat aren't in its report yet
+        running = max(len(node['streams']), self._assigned_count(node['node_id']))
+        if running >= node['max_streams']:
+            return None
+        headroom = 1.0 - max(running / node['max_streams'], min(1.0, node['load'] / node['cores']))
+        encoder = node['encoders'][encoder_key] or {}
+        # A hardware request lands on a node that really has the hardware encoder first
+        hardware = encoder_key.endswith(':hw') and encoder.get('type', 'software') != 'software'
+        return (1 if hardware else 0, headroom, -running)
+
+    def candidates(self, encoder_key, exclude=()):
+        """Node ids able to run a stream needing ``encoder_key`` (e.g. "h264:hw"), best first."""
+        with self._lock:
+            scored = [(self._score(n, encoder_key), n['node_id']) for n in self._nodes.values() if n['node_id'] not in exclude]
+        scored = [(score, node_id) for score, node_id in scored if score is not None]
+        scored.sort(key=lambda item: item[1])  # Stable tie-break by node id
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [node_id for _, node_id in scored]
+
+    # --- assignments ---
+
+    def assign(self, stream_name, node_id, request):
+        with self._lock:
+            prev = self._assignments.get(stream_name)
+            self._assignments[stream_name] = {
+                'node_id': node_id,
+                'request': dict(request),
+                'assigned_at': self._clock(),
+                'placements': (prev['placements'] if prev else 0) + 1,
+            }
+
+    def release(self, stream_name, previous=None):
+        """Undo a tentative assign(): put back ``previous`` (as returned by assignment()) or drop the stream."""
+        with self._lock:
+            if previous:
+                self._assignments[stream_name] = dict(previous)
+            else:
+                self._assignments.pop(stream_name, None)
+
+    def unassign(self, stream_name):
+        with self._lock:
+            return self._assignments.pop(stream_name, None)
+
+    def assignment(self, stream_name):
+        with self._lock:
+            a = self._assignments.get(stream_name)
+            return dict(a) if a else None
+
+    def assignments(self):
+        with self._lock:
+            return {name: dict(a) for name, a in self._assignments.items()}
+
+    def orphaned_streams(self):
+        """Streams assigned to dead or unknown nodes: (name, request, old node id), oldest first."""
+        with self._lock:
+            out = sorted((a['assigned_at'], name, dict(a['request']), a['node_id']) for name, a in self._assignments.items()
+                         if not self._nodes.get(a['node_id'], {}).get('alive'))
+        return [(name, request, node_id) for _, name, request, node_id in out]
@@ -2,6 +2,7 @@
 
 import os
 import platform
+import socket
 import tempfile
 
 # Detect operating system
@@ -40,12 +41,53 @@ RTSP_PORT = int(os.environ.get('RTSP_PORT', '8554'))
 HLS_DIR = os.path.join(BASE_TMP_DIR, "hls_streams")
 HLS_SEGMENT_DURATION = 2  # seconds
 HLS_PLAYLIST_SIZE = 5  # number of segments to keep
+# 'tee': the stream's own ffmpeg writes RTSP and HLS in one process (tee muxer)
+# 'converter': a second ffmpeg reads the RTSP output back and remuxes it to HLS
+HLS_OUTPUT_MODE = os.environ.get('HLS_OUTPUT_MODE', 'tee').lower()
+HLS_CONVERTER_READY_TIMEOUT = 10  # seconds to wait for the RTSP path before starting a converter
+HLS_CONVERTER_RESTART_DELAY = 2  # base seconds between converter restarts (grows while it keeps failing)
 
 # Health monitoring limits
 MAX_CPU_USAGE = float(os.environ.get('MAX_CPU_USAGE', '90.0'))  # Percentage
 MAX_MEMORY_USAGE = int(os.environ.get('MAX_MEMORY_USAGE', '2048'))  # MB
 MAX_STREAM_DURATION = int(os.environ.get('MAX_STREAM_DURATION', str(48 * 3600)))  # Seconds
 HEALTH_CHECK_INTERVAL = int(os.environ.get('HEALTH_CHECK_INTERVAL', '60'))  # Seconds
+PROCESS_SAMPLE_INTERVAL = float(os.environ.get('PROCESS_SAMPLE_INTERVAL', '5'))  # Seconds between CPU/memory sampling passes over all streams
+
+# Per-stream cgroup v2 limits: each stream (ffmpeg, its children and HLS converter) runs in its own cgroup with
+# kernel-enforced cpu.max/memory.max/io.weight. Opt-in; needs a cgroup v2 tree delegated to the app (systemd Delegate=yes,
+# or CGROUP_ROOT owned by the app's user); without one, streams fall back to the MAX_CPU_USAGE/MAX_MEMORY_USAGE health check limits above
+ENABLE_CGROUP_LIMITS = os.environ.get('ENABLE_CGROUP_LIMITS', 'False').lower() == 'true'
+CGROUP_ROOT = os.environ.get('CGROUP_ROOT', '')  # Delegated cgroup directory to create streams/ in; empty = this process's own cgroup
+STREAM_RESOURCE_CLASSES = {  # Per-stream "resource_class"; "cpu_limit" (cores), "memory_limit_mb" and "io_weight" override single values
+    'light': {'cpu_cores': 1, 'memory_mb': 512, 'io_weight': 50},  # Passthrough, relays, SD encodes
+    'standard': {'cpu_cores': 2, 'memory_mb': 2048, 'io_weight': 100},  # Same memory as the MAX_MEMORY_USAGE polling limit
+    'heavy': {'cpu_cores': 4, 'memory_mb': 4096, 'io_weight': 100},  # 4K or libx265 software encodes
+}
+DEFAULT_RESOURCE_CLASS = os.environ.get('DEFAULT_RESOURCE_CLASS', 'standard')
+
+# CPU placement: pin each encoder to whole physical cores sized to its expected cost (encoder, resolution, fps),
+# on the NUMA node with the most spare capacity; streams are moved onto freed cores as others stop. Opt-in: a pinned
+# stream can no longer burst onto idle cores, which suits hosts running near capacity rather than lightly loaded ones
+ENABLE_CPU_PLACEMENT = os.environ.get('ENABLE_CPU_PLACEMENT', 'False').lower() == 'true'
+PLACEMENT_RESERVED_CPUS = os.environ.get('PLACEMENT_RESERVED_CPUS', '')  # e.g. "0-1": kept free for the app and MediaMTX
+PLACEMENT_REBALANCE_DELAY = 2  # Seconds after a stop before rebalancing, so a batch stop triggers one pass
+
+# Encoder thread budget: -threads, x264/x265 thread options and decoder/filter threads come from a host-wide budget of
+# cores x oversubscription, shared by running streams by expected cost, so N streams don't each start ~1.5 threads per core
+ENABLE_THREAD_BUDGET = os.environ.get('ENABLE_THREAD_BUDGET', 'True').lower() == 'true'
+THREAD_BUDGET_CORES = int(os.environ.get('THREAD_BUDGET_CORES', '0'))  # 0 = the CPUs this process may run on
+THREAD_BUDGET_OVERSUBSCRIPTION = float(os.environ.get('THREAD_BUDGET_OVERSUBSCRIPTION', '1.5'))  # Threads per core across all streams
+THREAD_BUDGET_MAX_THREADS = 16  # Most encoder threads any single stream gets
+
+# Child process reaper (one thread watches every ffmpeg process)
+REAPER_CALLBACK_WORKERS = int(os.environ.get('REAPER_CALLBACK_WORKERS', '4'))  # Threads handling exit callbacks
+REAPER_POLL_INTERVAL = float(os.environ.get('REAPER_POLL_INTERVAL', '0.05'))  # Seconds, only used without pidfd support
+
+# Timer scheduler (one thread runs expiry, health checks, restarts, idle checks, cleanup and cluster heartbeats)
+SCHEDULER_WORKERS = 2  # Threads for quick callbacks such as stream expiry
+SCHEDULER_LAUNCH_WORKERS = int(os.environ.get('SCHEDULER_LAUNCH_WORKERS', '4'))  # Threads for crash and HLS converter restarts
+HEALTH_CHECK_WORKERS = int(os.environ.get('HEALTH_CHECK_WORKERS', '2'))  # Health checks running at once
 
 # FFmpeg defaults
 DEFAULT_VIDEO_CODEC = os.environ.get('DEFAULT_VIDEO_CODEC', 'h264')
@@ -59,6 +101,77 @@ ENABLE_HEALTH_MONITORING = os.environ.get('ENABLE_HEALTH_MONITORING', 'True').lo
 ENABLE_YOUTUBE_SUPPORT = True  # Enable YouTube URL support with yt-dlp
 ENABLE_HARDWARE_ACCEL = os.environ.get('ENABLE_HARDWARE_ACCEL', 'True').lower() == 'true'
 
+# Encoder capability cache (probed once, re-probed when ffmpeg or GPU devices change)
+ENCODER_CACHE_FILE = os.environ.get('ENCODER_CACHE_FILE', os.path.join(BASE_TMP_DIR, 'encoder_capabilities.json'))
+
+# Encode-once fan-out: identical stream definitions share one encoder, extra names are "-c copy" relays
+ENABLE_ENCODE_FANOUT = os.environ.get('ENABLE_ENCODE_FANOUT', 'False').lower() == 'true'
+FANOUT_READY_TIMEOUT = float(os.environ.get('FANOUT_READY_TIMEOUT', '10'))  # Seconds to wait for the shared encoder to publish
+
+# Transcode loop cache: file streams are encoded once in the background, then looped with "-c copy"
+ENABLE_TRANSCODE_CACHE = os.environ.get('ENABLE_TRANSCODE_CACHE', 'False').lower() == 'true'
+TRANSCODE_CACHE_DIR = os.environ.get('TRANSCODE_CACHE_DIR', os.path.join(BASE_TMP_DIR, 'transcode_cache'))
+TRANSCODE_CACHE_MAX_MB = int(os.environ.get('TRANSCODE_CACHE_MAX_MB', '10240'))  # LRU eviction above this disk budget
+TRANSCODE_CACHE_WORKERS = int(os.environ.get('TRANSCODE_CACHE_WORKERS', '2'))  # Concurrent background transcodes
+TRANSCODE_CACHE_KEY_MODE = os.environ.get('TRANSCODE_CACHE_KEY_MODE', 'mtime')  # 'mtime' (path+size+mtime) or 'content' (sha256)
+
+# Source-aware passthrough: copy tracks that already match the requested codec/resolution/fps/audio.
+# Opt-in: every start then waits for an ffprobe of its source, and copied video keeps the source's bitrate and GOP
+ENABLE_PASSTHROUGH = os.environ.get('ENABLE_PASSTHROUGH', 'False').lower() == 'true'
+PASSTHROUGH_PROBE_TIMEOUT = float(os.environ.get('PASSTHROUGH_PROBE_TIMEOUT', '8'))  # Seconds per ffprobe run
+PASSTHROUGH_PROBE_TTL = int(os.environ.get('PASSTHROUGH_PROBE_TTL', '60'))  # Seconds to reuse a probe of a live (RTSP) source
+
+# On-demand encoding: suspend streams MediaMTX reports no readers for, wake them via runOnDemand
+ENABLE_IDLE_SUSPEND = os.environ.get('ENABLE_IDLE_SUSPEND', 'False').lower() == 'true'
+IDLE_SUSPEND_GRACE = int(os.environ.get('IDLE_SUSPEND_GRACE', '60'))  # Seconds without readers before suspending
+IDLE_CHECK_INTERVAL = 5  # Seconds between reader-count checks
+IDLE_WAKE_TIMEOUT = 20  # Seconds MediaMTX holds a reader while a suspended stream wakes
+
+# Process spawning
+SPAWN_CHECK_DELAY = float(os.environ.get('SPAWN_CHECK_DELAY', '0.5'))  # Seconds to watch a new ffmpeg for an immediate failure
+YTDLP_TIMEOUT = 30  # Seconds allowed for yt-dlp to resolve a YouTube URL
+START_JOB_WORKERS = int(os.environ.get('START_JOB_WORKERS', '16'))  # Concurrent async start jobs
+START_JOB_TTL = 600  # Seconds a finished start job stays queryable
+START_JOB_MAX_WAIT = 60  # Upper bound for the "wait" parameter, in seconds
+BATCH_PARALLELISM = 16  # Default concurrent launches/stops for /streams/batch_* requests
+BATCH_MAX_PARALLELISM = 64  # Upper bound a batch request may ask for
+BATCH_RAMP_PER_SEC = 0  # Default launches per second for batch starts (0 = as fast as parallelism allows)
+BATCH_MAX_ITEMS = 2000  # Largest accepted batch
+STOP_GRACE_PERIOD = float(os.environ.get('STOP_GRACE_PERIOD', '2'))  # Seconds a stopped stream gets to exit after SIGTERM before SIGKILL
+SHUTDOWN_GRACE_PERIOD = float(os.environ.get('SHUTDOWN_GRACE_PERIOD', '3'))  # One deadline for all processes at server shutdown
+
+# Crash restart: relaunch streams whose ffmpeg exits unexpectedly, backing off exponentially;
+# streams that crash CRASH_LOOP_THRESHOLD times within CRASH_LOOP_WINDOW seconds are parked in the error state
+ENABLE_AUTO_RESTART = os.environ.get('ENABLE_AUTO_RESTART', 'False').lower() == 'true'  # Opt-in; otherwise crashed streams are stopped and removed
+RESTART_MAX_RETRIES = int(os.environ.get('RESTART_MAX_RETRIES', '5'))  # Consecutive restarts before parking (per-stream "max_restarts" overrides)
+RESTART_BASE_DELAY = float(os.environ.get('RESTART_BASE_DELAY', '2'))  # Seconds before the first restart, doubled for each further one
+RESTART_MAX_DELAY = float(os.environ.get('RESTART_MAX_DELAY', '60'))
+RESTART_JITTER = 0.3  # +/- fraction applied to each delay so streams that crashed together don't restart together
+RESTART_STABLE_AFTER = 60  # Seconds of uptime after which a crash counts as the first one again
+CRASH_LOOP_THRESHOLD = int(os.environ.get('CRASH_LOOP_THRESHOLD', '5'))
+CRASH_LOOP_WINDOW = float(os.environ.get('CRASH_LOOP_WINDOW', '300'))
+FLEET_RESTART_RATE = float(os.environ.get('FLEET_RESTART_RATE', '2'))  # Restarts per second across all streams
+FLEET_RESTART_BURST = int(os.environ.get('FLEET_RESTART_BURST', '10'))
+
+# Stream supervisor: "embedded" runs everything in the web process; "supervisor" is set by stream_supervisor.py,
+# which owns ffmpeg/MediaMTX; "client" web workers forward stream-control routes to it over SUPERVISOR_SOCKET
+SUPERVISOR_MODE = os.environ.get('SUPERVISOR_MODE', 'embedded').lower()
+SUPERVISOR_SOCKET = os.environ.get('SUPERVISOR_SOCKET', os.path.join(BASE_TMP_DIR, "supervisor.sock"))
+SUPERVISOR_TIMEOUT = float(os.environ.get('SUPERVISOR_TIMEOUT', '300'))  # Longest a forwarded request may take (batches, waits)
+HLS_READER_REPORT_INTERVAL = float(os.environ.get('HLS_READER_REPORT_INTERVAL', '5'))  # Client workers serve HLS playlists and report readers this often
+
+# Cluster mode: "standalone" (default), "node" (reports capacity to CLUSTER_COORDINATOR_URL) or
+# "coordinator" (places /start_stream requests on the registered nodes)
+CLUSTER_ROLE = os.environ.get('CLUSTER_ROLE', 'standalone').lower()
+CLUSTER_COORDINATOR_URL = os.environ.get('CLUSTER_COORDINATOR_URL', '')
+CLUSTER_NODE_ID = os.environ.get('CLUSTER_NODE_ID', f"{socket.gethostname()}:{PORT}")
+CLUSTER_NODE_URL = os.environ.get('CLUSTER_NODE_URL', f"http://{socket.gethostname()}:{PORT}")  # How the coordinator reaches this node
+CLUSTER_NODE_MAX_STREAMS = int(os.environ.get('CLUSTER_NODE_MAX_STREAMS', '0'))  # 0 = one stream per core
+CLUSTER_HEARTBEAT_INTERVAL = float(os.environ.get('CLUSTER_HEARTBEAT_INTERVAL', '5'))
+CLUSTER_NODE_TIMEOUT = float(os.environ.get('CLUSTER_NODE_TIMEOUT', '15'))  # Silence after which a node is dead and its streams move
+CLUSTER_PLACEMENT_ATTEMPTS = 3  # Nodes tried, best first, before a start request fails
+CLUSTER_REQUEST_TIMEOUT = 30  # Seconds for coordinator -> node requests
+
 # OS-specific hardware acceleration support
 HARDWARE_ACCEL_SUPPORT = {
     'windows': ['nvenc', 'qsv', 'amf'],
@@ -115,6 +228,7 @@ WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
 
 # MediaMTX settings
 RTSP_PORT = 8554  # Default RTSP port for MediaMTX
+MEDIAMTX_API_URL = os.environ.get('MEDIAMTX_API_URL', 'http://127.0.0.1:9997')  # Must match apiAddress in mediamtx.yml
 
 # Stream Persistence settings
 ENABLE_STREAM_PERSISTENCE = os.environ.get('ENABLE_STREAM_PERSISTENCE', 'True').lower() == 'true'
@@ -122,6 +236,11 @@ ENABLE_STREAM_PERSISTENCE = os.environ.get('ENABLE_STREAM_PERSISTENCE', 'True').
 STREAM_PERSISTENCE_DIR = os.environ.get('STREAM_PERSISTENCE_DIR', os.path.join(BASE_DIR, 'data'))
 STREAM_PERSISTENCE_FILE = os.path.join(STREAM_PERSISTENCE_DIR, "active_streams.json")
 STREAM_PERSISTENCE_BACKUP_COUNT = int(os.environ.get('STREAM_PERSISTENCE_BACKUP_COUNT', 3))
+RESTORE_PARALLELISM = int(os.environ.get('RESTORE_PARALLELISM', '8'))  # Persisted streams restored concurrently on startup
+RESTORE_RAMP_PER_SEC = float(os.environ.get('RESTORE_RAMP_PER_SEC', '5'))  # Restore launch rate in streams per second (0 = no ramp)
+# Upgrade restarts: SIGUSR2 always leaves encoders running for the next instance to adopt; with this set, SIGTERM does too
+ADOPT_ON_SHUTDOWN = os.environ.get('ADOPT_ON_SHUTDOWN', 'False').lower() == 'true'
+ADOPTION_MANIFEST_FILE = os.path.join(STREAM_PERSISTENCE_DIR, "adoptable_streams.json")
 
 def validate_config():
     """Validate configuration values"""
@@ -142,6 +261,18 @@ def validate_config():
     if PORT < 1 or PORT > 65535:
         errors.append(f"PORT must be between 1 and 65535, got {PORT}")
     
+    if CLUSTER_ROLE not in ('standalone', 'node', 'coordinator'):
+        errors.append(f"CLUSTER_ROLE must be standalone, node or coordinator, got {CLUSTER_ROLE}")
+    
+    if CLUSTER_ROLE == 'node' and not CLUSTER_COORDINATOR_URL:
+        errors.append("CLUSTER_COORDINATOR_URL is required when CLUSTER_ROLE is node")
+    
+    if DEFAULT_RESOURCE_CLASS not in STREAM_RESOURCE_CLASSES:
+        errors.append(f"DEFAULT_RESOURCE_CLASS must be one of {', '.join(STREAM_RESOURCE_CLASSES)}, got {DEFAULT_RESOURCE_CLASS}")
+    
+    if SUPERVISOR_MODE not in ('embedded', 'supervisor', 'client'):
+        errors.append(f"SUPERVISOR_MODE must be embedded, supervisor or client, got {SUPERVISOR_MODE}")
+    
     return errors
 
 # Load optional local config overrides
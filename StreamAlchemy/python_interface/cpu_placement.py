@@ -0,0 +1,273 @@
+"""
+NUMA- and core-aware CPU placement for StreamAlchemy's encoders.
+
+Left alone, the scheduler moves hundreds of encoder threads across every core.
+Their caches go cold and latency becomes unpredictable. ``PlacementEngine``
+gives each stream a fixed set of physical cores instead, sized to the
+stream's expected cost. All hyperthread siblings of a chosen core come with
+it. A stream never spans NUMA nodes if one node is big enough for it. The
+caller applies the result with ``apply_affinity()``, which uses
+sched_setaffinity on every thread of the process.
+
+Cost is measured in cores. ``estimate_cost()`` reads it from the ffmpeg
+command: each video encoder's per-1080p30 weight is scaled by its output
+pixel rate. Each core carries the sum of the costs placed on it, split evenly
+over a stream's cores. New streams go to the NUMA node with the most spare
+capacity, then onto its least-loaded cores. ``rebalance()`` moves streams off
+overloaded cores after others stop.
+
+New processes are started inside ``spawn_affinity()``. It pins the spawning
+thread for the duration of the spawn, so the child inherits its CPU set
+before exec, without a preexec_fn. ffmpeg therefore never creates a thread
+outside its cores. ``apply_affinity()`` moves processes that are already
+running, e.g. on rebalance.
+
+The topology comes from /sys/devices/system (``read_topology()``), limited
+to the CPUs this process may run on.
+"""
+
+import contextlib
+import math
+import os
+import re
+import threading
+
+# Cores needed for 1920x1080 at 30 fps, by encoder name prefix; scaled by pixel rate
+ENCODER_WEIGHTS = (
+    ('copy', 0.05), ('libx265', 4.0), ('libvpx', 3.0), ('libaom', 6.0), ('libsvtav1', 3.0),
+    ('libx264', 1.5), ('mpeg4', 0.6),
+)
+HARDWARE_ENCODER_WEIGHT = 0.25  # nvenc/vaapi/qsv/amf/videotoolbox: the CPU only feeds frames
+HARDWARE_SUFFIXES = ('_nvenc', '_vaapi', '_qsv', '_amf', '_videotoolbox', '_v4l2m2m')
+DEFAULT_ENCODER_WEIGHT = 1.5
+DECODE_COST = 0.1  # Per input, on top of the encoders
+MIN_COST = 0.05
+_REFERENCE_PIXEL_RATE = 1920 * 1080 * 30
+
+
+def parse_cpu_list(text):
+    """'0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]"""
+    cpus = set()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        cpus.update(range(int(low), int(high or low) + 1))
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus):
+    """[0, 1, 2, 3, 8] -> '0-3,8'"""
+    cpus = sorted(cpus)
+    ranges, start = [], None
+    for i, cpu in enumerate(cpus):
+        if start is None:
+            start = cpu
+        if i + 1 == len(cpus) or cpus[i + 1] != cpu + 1:
+            ranges.append(str(start) if start == cpu else f"{start}-{cpu}")
+            start = None
+    return ','.join(ranges)
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def read_topology(sys_root='/sys/devices/system', allowed=None, reserved=()):
+    """Physical cores as [{'id', 'node', 'cpus'}], grouping hyperthread siblings, for the CPUs this process may use.
+    ``allowed`` defaults to sched_getaffinity(0); ``reserved`` CPUs (e.g. for the app and MediaMTX) are left out."""
+    if allowed is None:
+        allowed = os.sched_getaffinity(0) if hasattr(os, 'sched_getaffinity') else range(os.cpu_count() or 1)
+    usable = set(allowed) - set(reserved)
+    online = _read(os.path.join(sys_root, 'cpu', 'online'))
+    cpus = [c for c in (parse_cpu_list(online) if online else sorted(usable)) if c in usable]
+    node_of = {}
+    try:
+        for entry in os.listdir(os.path.join(sys_root, 'node')):
+            if re.fullmatch(r'node\d+', entry):
+                for cpu in parse_cpu_list(_read(os.path.join(sys_root, 'node', entry, 'cpulist'), '')):
+                    node_of[cpu] = int(entry[4:])
+    except OSError:
+        pass  # No NUMA information: everything is node 0
+    cores = {}
+    for cpu in cpus:
+        topo = os.path.join(sys_root, 'cpu', f"cpu{cpu}", 'topology')
+        key = (int(_read(os.path.join(topo, 'physical_package_id'), '0')), int(_read(os.path.join(topo, 'core_id'), str(cpu))))
+        cores.setdefault(key, {'node': node_of.get(cpu, 0), 'cpus': []})['cpus'].append(cpu)
+    ordered = sorted(cores.values(), key=lambda c: (c['node'], c['cpus'][0]))
+    return [{'id': i, 'node': c['node'], 'cpus': c['cpus']} for i, c in enumerate(ordered)]
+
+
+def _encoder_weight(encoder):
+    if encoder.endswith(HARDWARE_SUFFIXES):
+        return HARDWARE_ENCODER_WEIGHT
+    for prefix, weight in ENCODER_WEIGHTS:
+        if encoder.startswith(prefix):
+            return weight
+    return DEFAULT_ENCODER_WEIGHT
+
+
+def estimate_cost(cmd, default_fps=30):
+    """Expected CPU cost in cores of an ffmpeg argv: each video encoder's weight scaled by its output size and fps."""
+    encoders, sizes, fps, inputs = [], [], None, 0
+    for i, arg in enumerate(cmd[:-1]):
+        value = cmd[i + 1]
+        if arg == '-i':
+            inputs += 1
+        elif arg in ('-c:v', '-vcodec') or arg.startswith('-c:v:'):
+            encoders.append(value)
+        elif arg == '-c' and value == 'copy':
+            encoders.append('copy')
+        elif arg == '-s' or arg.startswith('-s:v'):
+            w, _, h = value.partition('x')
+            if w.isdigit() and h.isdigit():
+                sizes.append((int(w), int(h)))
+        elif arg == '-filter_complex' or arg in ('-vf', '-filter:v'):
+            sizes += [(int(w), int(h)) for w, h in re.findall(r'scale(?:_vaapi|_cuda|_npp)?=(\d+):(\d+)', value)]
+        elif arg == '-r' and fps is None:
+            try:
+                fps = float(value)
+            except ValueError:
+                pass
+    cost = DECODE_COST * inputs
+    for n, encoder in enumerate(encoders):
+        if encoder == 'copy':
+            cost += _encoder_weight(encoder)
+            continue
+        w, h = sizes[n] if n < len(sizes) else (sizes[-1] if sizes else (1920, 1080))
+        cost += _encoder_weight(encoder) * (w * h * (fps or default_fps)) / _REFERENCE_PIXEL_RATE
+    return round(max(MIN_COST, cost), 2)
+
+
+def apply_affinity(pid, cpus, proc_root='/proc'):
+    """Pin every thread of ``pid`` to ``cpus``. Threads started later inherit it. Returns False if the process is gone."""
+    try:
+        tids = [int(t) for t in os.listdir(os.path.join(proc_root, str(pid), 'task'))]
+    except OSError:
+        tids = [pid]
+    applied = False
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+            applied = True
+        except (ProcessLookupError, PermissionError):
+            pass
+    return applied
+
+
+@contextlib.contextmanager
+def spawn_affinity(cpus):
+    """Pin the calling thread to ``cpus`` for the block, so processes it spawns start with that CPU set.
+    Other threads are unaffected and the thread's own affinity is restored afterwards. No-op for an empty ``cpus``."""
+    if not cpus:
+        yield
+        return
+    previous = os.sched_getaffinity(0)  # pid 0 is the calling thread
+    os.sched_setaffinity(0, cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, previous)
+
+
+class PlacementEngine:
+    """Tracks which cores each stream runs on and how loaded each core is. Thread-safe."""
+
+    def __init__(self, cores):
+        self.cores = cores
+        self._load = [0.0] * len(cores)
+        self._streams = {}  # name -> {'cores': [core ids], 'cost': cores}
+        self._lock = threading.Lock()
+        self.nodes = sorted({c['node'] for c in cores})
+
+    def place(self, name, cost):
+        """Pick cores for ``name`` (replacing any earlier placement). Returns the sorted CPU list."""
+        with self._lock:
+            self._release(name)
+            return self._place(name, cost)
+
+    def release(self, name):
+        """Forget ``name``'s placement. Returns True if it had one."""
+        with self._lock:
+            return self._release(name)
+
+    def cpus_of(self, name):
+        with self._lock:
+            entry = self._streams.get(name)
+            return self._cpus(entry['cores']) if entry else None
+
+    def rebalance(self, max_moves=None, tolerance=0.5):
+        """Move streams from the busiest core towards idle ones until loads are within ``tolerance`` cores.
+        Returns {name: new CPU list} for the streams that moved."""
+        moved = {}
+        with self._lock:
+            for _ in range(max_moves if max_moves is not None else len(self._streams)):
+                if not self._streams:
+                    break
+                busiest = max(range(len(self.cores)), key=lambda i: self._load[i])
+                idlest = min(range(len(self.cores)), key=lambda i: self._load[i])
+                gap = self._load[busiest] - self._load[idlest]
+                if gap <= tolerance:
+                    break
+                # The stream on the busiest core whose share best closes the gap without overshooting
+                candidates = [(n, e['cost'] / len(e['cores'])) for n, e in self._streams.items() if busiest in e['cores']]
+                fitting = [c for c in candidates if c[1] < gap]
+                if not fitting:
+                    break
+                name, _ = max(fitting, key=lambda c: c[1])
+                before = self._streams[name]['cores']
+                cost = self._streams[name]['cost']
+                self._release(name)
+                cpus = self._place(name, cost)
+                if self._streams[name]['cores'] == before:
+                    break  # Already as good as it gets
+                moved[name] = cpus
+        return moved
+
+    def snapshot(self):
+        """The core map: per-node and per-core load and the streams on each core."""
+        with self._lock:
+            on_core = {i: [] for i in range(len(self.cores))}
+            for name, entry in self._streams.items():
+                for i in entry['cores']:
+                    on_core[i].append(name)
+            cores = [{'core': i, 'node': c['node'], 'cpus': format_cpu_list(c['cpus']), 'load': round(self._load[i], 2),
+                      'streams': sorted(on_core[i])} for i, c in enumerate(self.cores)]
+            nodes = {node: {'cores': sum(1 for c in self.cores if c['node'] == node),
+                            'load': round(sum(self._load[i] for i, c in enumerate(self.cores) if c['node'] == node), 2)}
+                     for node in self.nodes}
+            streams = {name: {'cpus': format_cpu_list(self._cpus(e['cores'])), 'cost': e['cost'],
+                              'node': self.cores[e['cores'][0]]['node']} for name, e in self._streams.items()}
+            return {'nodes': nodes, 'cores': cores, 'streams': streams,
+                    'total_load': round(sum(self._load), 2), 'total_cores': len(self.cores)}
+
+    # --- internals (lock held) ---
+
+    def _cpus(self, core_ids):
+        return sorted(cpu for i in core_ids for cpu in self.cores[i]['cpus'])
+
+    def _place(self, name, cost):
+        # The node with the most spare capacity, then that node's least-loaded cores (lowest id on ties, for locality)
+        def spare(node):
+            members = [i for i, c in enumerate(self.cores) if c['node'] == node]
+            return len(members) - sum(self._load[i] for i in members)
+        node = max(self.nodes, key=lambda n: (spare(n), -n))
+        members = [i for i, c in enumerate(self.cores) if c['node'] == node]
+        count = max(1, min(len(members), math.ceil(cost - 1e-9)))
+        chosen = sorted(sorted(members, key=lambda i: (round(self._load[i], 6), i))[:count])
+        for i in chosen:
+            self._load[i] += cost / count
+        self._streams[name] = {'cores': chosen, 'cost': cost}
+        return self._cpus(chosen)
+
+    def _release(self, name):
+        entry = self._streams.pop(name, None)
+        if not entry:
+            return False
+        for i in entry['cores']:
+            self._load[i] = max(0.0, self._load[i] - entry['cost'] / len(entry['cores']))
+        return True
@@ -0,0 +1,195 @@
+"""
+Batched CPU and memory sampling for StreamAlchemy's health checks.
+
+``ProcessSampler.sample(pids)`` reads every PID's CPU time and RSS in one
+pass. On Linux it parses /proc/<pid>/stat directly; elsewhere it uses
+psutil's oneshot() API. CPU usage is the change in CPU time since the
+previous pass divided by the wall time between the passes, so sampling never
+sleeps. The result is in psutil's cpu_percent() units, where 100 means one
+full core. The first sample of a process reports its average over its
+lifetime so far.
+
+A previous sample only counts if it belongs to the same process. That is
+checked against the process start time, so a reused PID starts fresh.
+
+``sample_sessions(leaders)`` adds up every process in each leader's session.
+Streams start ffmpeg with start_new_session=True, so the session holds ffmpeg
+and anything it forks, including children that outlive or detach from it.
+Memory is the sum of RSS, so pages the processes share are counted once per
+process.
+"""
+
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # Only needed where /proc is missing
+    psutil = None
+
+
+class ProcessSampler:
+    """Keeps the previous pass so each pass can compute CPU deltas. Thread-safe."""
+
+    def __init__(self, proc_root='/proc', clock=time.monotonic):
+        self.proc_root = proc_root
+        self._clock = clock
+        self._use_proc = os.path.exists(os.path.join(proc_root, 'self', 'stat'))
+        self._clk_tck = os.sysconf('SC_CLK_TCK') if self._use_proc else 100
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if self._use_proc else 4096
+        self._prev = {}    # pid -> (start id, cpu seconds, sampled at)
+        self._latest = {}  # pid -> stats dict from the last pass
+        self._sessions = {}  # session leader pid -> totals from the last sample_sessions() pass
+        self._lock = threading.Lock()
+        self.last_sample_at = None
+        self.last_duration = None
+
+    @property
+    def available(self):
+        return self._use_proc or psutil is not None
+
+    def _uptime(self):
+        try:
+            with open(os.path.join(self.proc_root, 'uptime')) as f:
+                return float(f.read().split()[0])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _read_proc(self, pid, uptime):
+        """(state, start id, cpu seconds, age seconds, rss bytes, session id) from /proc/<pid>/stat, or None if gone."""
+        try:
+            with open(os.path.join(self.proc_root, str(pid), 'stat'), 'rb') as f:
+                data = f.read().decode(errors='replace')
+        except OSError:
+            return None
+        # comm can contain spaces and parentheses; the fields after the last ')' are fixed
+        fields = data[data.rfind(')') + 2:].split()
+        try:
+            cpu = (int(fields[11]) + int(fields[12])) / self._clk_tck  # utime + stime
+            start = int(fields[19])
+            rss = int(fields[21]) * self._page_size
+            session = int(fields[3])
+        except (IndexError, ValueError):
+            return None
+        age = uptime - start / self._clk_tck if uptime is not None else None
+        return fields[0], start, cpu, age, rss, session
+
+    def _read_psutil(self, pid):
+        try:
+            p = psutil.Process(pid)
+            with p.oneshot():
+                times = p.cpu_times()
+                created = p.create_time()
+                return p.status(), created, times.user + times.system, time.time() - created, p.memory_info().rss, None
+        except (psutil.Error, OSError):
+            return None
+
+    def _read(self, pid, uptime):
+        if self._use_proc:
+            return self._read_proc(pid, uptime)
+        return self._read_psutil(pid) if psutil else None
+
+    def _cpu_percent(self, pid, raw, now):
+        """CPU since this process's previous sample, or its lifetime average. Records this sample."""
+        _, start, cpu, age, _, _ = raw
+        prev = self._prev.get(pid)
+        if prev and prev[0] == start and now > prev[2]:
+            cpu_percent = (cpu - prev[1]) / (now - prev[2]) * 100
+        else:
+            cpu_percent = cpu / age * 100 if age and age > 0 else 0.0
+        self._prev[pid] = (start, cpu, now)
+        return max(0.0, cpu_percent)
+
+    def sample(self, pids, prune=True):
+        """Sample ``pids`` in one pass. Returns {pid: {'cpu_percent', 'memory_mb', 'status'}} for live PIDs.
+        With ``prune``, history for PIDs not in this pass is dropped."""
+        with self._lock:
+            return self._sample(pids, prune)
+
+    def _sample(self, pids, prune):
+        t0 = time.perf_counter()
+        now = self._clock()
+        uptime = self._uptime() if self._use_proc else None
+        out = {}
+        for pid in set(pids):
+            raw = self._read(pid, uptime)
+            if raw is None:
+                continue
+            out[pid] = {'cpu_percent': round(self._cpu_percent(pid, raw, now), 1),
+                        'memory_mb': round(raw[4] / (1024 * 1024), 1), 'status': raw[0]}
+        if prune:
+            self._prev = {pid: v for pid, v in self._prev.items() if pid in out}
+            self._latest = out
+        else:
+            self._latest.update(out)
+        self.last_sample_at = time.time()
+        self.last_duration = time.perf_counter() - t0
+        return out
+
+    def sample_sessions(self, leaders, prune=True):
+        """Sample every process in the sessions led by ``leaders`` in one pass.
+        Returns {leader: {'cpu_percent', 'memory_mb', 'processes', 'status'}} for sessions with a live process;
+        ``status`` is the leader's own state, or None once only its children are left."""
+        with self._lock:
+            return self._sample_sessions(leaders, prune)
+
+    def _sample_sessions(self, leaders, prune):
+        t0 = time.perf_counter()
+        now = self._clock()
+        uptime = self._uptime() if self._use_proc else None
+        out = {}
+        seen = set()
+        for leader, pid, raw in self._session_members(set(leaders), uptime):
+            seen.add(pid)
+            totals = out.setdefault(leader, {'cpu_percent': 0.0, 'memory_mb': 0.0, 'processes': 0, 'status': None})
+            totals['cpu_percent'] += self._cpu_percent(pid, raw, now)
+            totals['memory_mb'] += raw[4] / (1024 * 1024)
+            totals['processes'] += 1
+            if pid == leader:
+                totals['status'] = raw[0]
+        for totals in out.values():
+            totals['cpu_percent'] = round(totals['cpu_percent'], 1)
+            totals['memory_mb'] = round(totals['memory_mb'], 1)
+        if prune:
+            self._prev = {pid: v for pid, v in self._prev.items() if pid in seen}
+            self._sessions = out
+        else:
+            self._sessions.update(out)
+        self.last_sample_at = time.time()
+        self.last_duration = time.perf_counter() - t0
+        return out
+
+    def _session_members(self, leaders, uptime):
+        """Yield (leader, pid, raw stats) for every live process in the leaders' sessions."""
+        if not self._use_proc:
+            if psutil is None:
+                return
+            # psutil has no session id on every platform; walk each leader's descendants instead
+            for leader in leaders:
+                try:
+                    pids = [leader] + [c.pid for c in psutil.Process(leader).children(recursive=True)]
+                except (psutil.Error, OSError):
+                    continue
+                for pid in pids:
+                    raw = self._read_psutil(pid)
+                    if raw is not None:
+                        yield leader, pid, raw
+            return
+        # One scan of /proc finds members even after they are re-parented away from the leader
+        try:
+            entries = [e.name for e in os.scandir(self.proc_root) if e.name.isdigit()]
+        except OSError:
+            return
+        for name in entries:
+            raw = self._read_proc(int(name), uptime)
+            if raw is not None and raw[5] in leaders:
+                yield raw[5], int(name), raw
+
+    def latest(self, pid):
+        """Stats for ``pid`` from the most recent pass, or None."""
+        return self._latest.get(pid)
+
+    def latest_session(self, leader):
+        """Session totals for ``leader`` from the most recent sample_sessions() pass, or None."""
+        return self._sessions.get(leader)
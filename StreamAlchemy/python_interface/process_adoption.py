@@ -0,0 +1,109 @@
+"""
+Process identity checks and adoption for StreamAlchemy upgrade restarts.
+
+An upgrade restart leaves the ffmpeg encoders running and the new app
+process takes them over. A PID on its own is not enough to trust, since the
+PID could have been reused by an unrelated process. ``process_identity``
+records the kernel start time (field 22 of /proc/<pid>/stat, in clock ticks
+since boot) and the argv of a process. ``adopt`` only returns a handle when
+both still match what was recorded.
+
+The handle, ``AdoptedProcess``, looks enough like subprocess.Popen (``pid``,
+``poll()``, ``wait()``, ``returncode``) for the rest of the app and for
+ChildReaper. ChildReaper watches it through a pidfd, which works for
+processes that are not our children. Their real exit status is not
+available to us, so an adopted process that exits reports
+``ADOPTED_EXIT_UNKNOWN``.
+"""
+
+import os
+import signal
+import subprocess
+import time
+
+ADOPTED_EXIT_UNKNOWN = -1
+
+
+def _read_stat(pid):
+    """Return (state, starttime) from /proc/<pid>/stat, or None if the process is gone."""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            data = f.read().decode(errors='replace')
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    # comm (field 2) may contain spaces and parentheses, so split after the last ')'
+    fields = data.rsplit(')', 1)[1].split()
+    return fields[0], int(fields[19])
+
+
+def _read_cmdline(pid):
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            raw = f.read()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    return [a.decode(errors='surrogateescape') for a in raw.split(b'\0')[:-1]]
+
+
+def process_identity(pid):
+    """{'pid', 'starttime', 'cmdline'} for a live process, or None if it is gone or a zombie."""
+    stat = _read_stat(pid)
+    if stat is None or stat[0] in ('Z', 'X'):
+        return None
+    cmdline = _read_cmdline(pid)
+    if cmdline is None:
+        return None
+    return {'pid': pid, 'starttime': stat[1], 'cmdline': cmdline}
+
+
+def identity_matches(pid, starttime, cmdline):
+    """True if ``pid`` is still the process that was recorded with this start time and argv."""
+    current = process_identity(pid)
+    return bool(current and current['starttime'] == starttime and current['cmdline'] == list(cmdline))
+
+
+class AdoptedProcess:
+    """A Popen-like handle for a process started by an earlier app instance."""
+
+    adopted = True
+
+    def __init__(self, pid, starttime, args):
+        self.pid = pid
+        self.starttime = starttime
+        self.args = list(args)
+        self.returncode = None
+
+    def poll(self):
+        if self.returncode is None:
+            stat = _read_stat(self.pid)
+            if stat is None or stat[0] in ('Z', 'X') or stat[1] != self.starttime:
+                self.returncode = ADOPTED_EXIT_UNKNOWN
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.poll() is None:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(0.05)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+    def __repr__(self):
+        return f"<AdoptedProcess pid={self.pid} returncode={self.returncode}>"
+
+
+def adopt(pid, starttime, cmdline):
+    """Return an AdoptedProcess if ``pid`` is still the recorded process, else None."""
+    if not identity_matches(pid, starttime, cmdline):
+        return None
+    return AdoptedProcess(pid, starttime, cmdline)
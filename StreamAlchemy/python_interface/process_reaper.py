@@ -0,0 +1,231 @@
+"""
+Event-driven child process reaper for StreamAlchemy.
+
+One ChildReaper thread watches every ffmpeg process the app starts. On Linux
+(kernel 5.3+, Python 3.9+) each process is watched through a pidfd, so the
+kernel wakes the reaper the moment a child exits. Elsewhere the reaper falls
+back to polling all watched processes from the same single thread.
+
+Exit and deadline callbacks run on a small fixed-size worker pool so a slow
+callback (crash report, persistence I/O) never delays exit detection for the
+other streams. The exit status is collected there too, with a blocking
+``wait()``: ``Popen.poll()`` returns None while another thread holds the
+process's wait lock, so it cannot be trusted to report an exit code.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import selectors
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HAS_PIDFD = hasattr(os, 'pidfd_open')
+EXIT_UNKNOWN = None  # Reported when the exit status cannot be collected; never a real code or signal
+
+
+class _Watch:
+    __slots__ = ('key', 'proc', 'on_exit', 'on_deadline', 'deadline', 'pidfd', 'done')
+
+    def __init__(self, key, proc, on_exit, on_deadline, deadline):
+        self.key = key
+        self.proc = proc
+        self.on_exit = on_exit
+        self.on_deadline = on_deadline
+        self.deadline = deadline
+        self.pidfd = None
+        self.done = False
+
+
+class ChildReaper:
+    """Watch many child processes from a single thread.
+
+    ``watch(proc, on_exit)`` calls ``on_exit(proc, returncode)`` once the
+    process exits. An optional ``deadline`` (time.time() based) calls
+    ``on_deadline(proc)`` once if the process is still alive by then.
+    ``proc`` only needs ``pid``, ``poll()`` and ``wait()``, like subprocess.Popen.
+    ``returncode`` passed to ``on_exit`` is ``EXIT_UNKNOWN`` (None) only when
+    the exit status could not be collected.
+    """
+
+    def __init__(self, workers=4, poll_interval=0.05, logger=None):
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='reaper-cb')
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._lock = threading.Lock()
+        self._pending = []      # watches added since the loop last ran
+        self._watches = {}      # key -> _Watch, owned by the reaper thread
+        self._polled = {}       # key -> _Watch without a pidfd
+        self._deadlines = []    # heap of (deadline, key)
+        self._keys = itertools.count(1)
+        self._thread = None
+        self._running = False
+        self.exits_seen = 0
+
+    # --- public API ---
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='child-reaper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread:
+            self._thread.join(timeout=2)
+        self._executor.shutdown(wait=False)
+
+    def watch(self, proc, on_exit, deadline=None, on_deadline=None):
+        """Start watching ``proc``; returns a key usable with unwatch()."""
+        w = _Watch(next(self._keys), proc, on_exit, on_deadline, deadline)
+        with self._lock:
+            self._pending.append(('add', w))
+        self._wake()
+        return w.key
+
+    def unwatch(self, key):
+        with self._lock:
+            self._pending.append(('remove', key))
+        self._wake()
+
+    def stats(self):
+        return {
+            'watched': len(self._watches),
+            'pidfd': HAS_PIDFD,
+            'exits_seen': self.exits_seen,
+            'pending_deadlines': len(self._deadlines),
+        }
+
+    # --- reaper thread ---
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except (BlockingIOError, OSError):
+            pass  # Pipe full means a wakeup is already queued
+
+    def _drain_pending(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for op, item in pending:
+            if op == 'add':
+                self._add(item)
+            else:
+                w = self._watches.get(item)
+                if w:
+                    self._forget(w)
+
+    def _add(self, w):
+        self._watches[w.key] = w
+        if w.deadline:
+            heapq.heappush(self._deadlines, (w.deadline, w.key))
+        if HAS_PIDFD:
+            try:
+                w.pidfd = os.pidfd_open(w.proc.pid)
+                self._selector.register(w.pidfd, selectors.EVENT_READ, w)
+                return
+            except ProcessLookupError:
+                # Already gone (and possibly already reaped); report it now
+                self._reap(w)
+                return
+            except OSError as e:
+                self.logger.debug(f"pidfd_open failed for PID {w.proc.pid}, polling instead: {e}")
+                w.pidfd = None
+        self._polled[w.key] = w
+        if w.proc.poll() is not None:
+            self._reap(w)
+
+    def _forget(self, w):
+        w.done = True
+        self._watches.pop(w.key, None)
+        self._polled.pop(w.key, None)
+        if w.pidfd is not None:
+            try:
+                self._selector.unregister(w.pidfd)
+            except (KeyError, ValueError):
+                pass
+            try:
+                os.close(w.pidfd)
+            except OSError:
+                pass
+            w.pidfd = None
+
+    def _reap(self, w):
+        if w.done:
+            return
+        self._forget(w)
+        self.exits_seen += 1
+        self._executor.submit(self._call_exit, w.on_exit, w.proc)
+
+    def _call_exit(self, fn, proc):
+        # The process has exited, so wait() returns at once; unlike poll() it also
+        # returns the status when another thread is waiting on the same process
+        try:
+            rc = proc.wait()
+        except Exception as e:
+            rc = proc.returncode if getattr(proc, 'returncode', None) is not None else EXIT_UNKNOWN
+            self.logger.warning(f"Could not collect exit status of PID {proc.pid}, reporting {rc}: {e}")
+        self._call(fn, proc, rc)
+
+    def _call(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            self.logger.error(f"Reaper callback {getattr(fn, '__name__', fn)} failed: {e}", exc_info=True)
+
+    def _next_timeout(self):
+        timeout = None
+        if self._polled:
+            timeout = self.poll_interval
+        while self._deadlines:
+            when, key = self._deadlines[0]
+            w = self._watches.get(key)
+            if w is None or w.deadline != when:
+                heapq.heappop(self._deadlines)  # Stale entry
+                continue
+            remaining = max(0.0, when - time.time())
+            timeout = remaining if timeout is None else min(timeout, remaining)
+            break
+        return timeout
+
+    def _fire_deadlines(self):
+        now = time.time()
+        while self._deadlines and self._deadlines[0][0] <= now:
+            when, key = heapq.heappop(self._deadlines)
+            w = self._watches.get(key)
+            if w is None or w.deadline != when or w.on_deadline is None:
+                continue
+            w.deadline = None
+            self._executor.submit(self._call, w.on_deadline, w.proc)
+
+    def _run(self):
+        while self._running:
+            try:
+                events = self._selector.select(self._next_timeout())
+                for sel_key, _ in events:
+                    if sel_key.data is None:
+                        self._drain_pending()
+                    else:
+                        self._reap(sel_key.data)
+                for w in list(self._polled.values()):
+                    if w.proc.poll() is not None:
+                        self._reap(w)
+                self._fire_deadlines()
+            except Exception as e:
+                self.logger.error(f"Child reaper loop error: {e}", exc_info=True)
+                time.sleep(self.poll_interval)
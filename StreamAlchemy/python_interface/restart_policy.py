@@ -0,0 +1,103 @@
+"""
+Crash restart decisions for StreamAlchemy streams.
+
+RestartTracker keeps one stream's crash history and decides each time its
+ffmpeg exits unexpectedly. It can restart the stream after an exponential
+backoff with jitter, or park the stream. A stream is parked when it crashes
+too often inside a window (a crash loop) or runs out of retries. A stream that
+stayed up for ``stable_after`` seconds before crashing starts counting from
+zero again.
+
+TokenBucket rate-limits restarts across the whole fleet, so a flapping
+upstream that takes down many streams at once can't trigger a restart storm.
+"""
+
+import collections
+import random
+import threading
+import time
+
+
+class RestartPolicy:
+    """Backoff and crash-loop settings; one instance can be shared by many trackers."""
+
+    def __init__(self, max_retries=5, base_delay=2.0, max_delay=60.0, jitter=0.3,
+                 crash_loop_threshold=5, crash_loop_window=300.0, stable_after=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.crash_loop_threshold = crash_loop_threshold
+        self.crash_loop_window = crash_loop_window
+        self.stable_after = stable_after
+
+    def delay(self, attempt, rng=random.random):
+        """Seconds to wait before restart number ``attempt`` (1-based): base * 2^(attempt-1), capped, +/- jitter."""
+        delay = min(self.max_delay, self.base_delay * (2 ** max(0, attempt - 1)))
+        return max(0.0, delay * (1 + self.jitter * (2 * rng() - 1)))
+
+
+class RestartTracker:
+    """Crash history of one stream."""
+
+    def __init__(self, policy, max_retries=None, clock=time.time, rng=random.random):
+        self.policy = policy
+        self.max_retries = policy.max_retries if max_retries is None else max_retries
+        self._clock = clock
+        self._rng = rng
+        self.attempts = 0
+        self.total_crashes = 0
+        self._crashes = collections.deque()
+
+    def record_crash(self, uptime):
+        """Register a crash after ``uptime`` seconds of running.
+        Returns ('restart', delay_seconds) or ('park', reason)."""
+        now = self._clock()
+        self.total_crashes += 1
+        if uptime >= self.policy.stable_after:
+            self.attempts = 0
+        self._crashes.append(now)
+        while self._crashes and self._crashes[0] < now - self.policy.crash_loop_window:
+            self._crashes.popleft()
+        if len(self._crashes) >= self.policy.crash_loop_threshold:
+            return 'park', f"Crash loop: {len(self._crashes)} crashes in {self.policy.crash_loop_window:g}s"
+        if self.attempts >= self.max_retries:
+            return 'park', f"Gave up after {self.attempts} restarts"
+        self.attempts += 1
+        return 'restart', self.policy.delay(self.attempts, self._rng)
+
+    def recent_crashes(self):
+        return len(self._crashes)
+
+
+class TokenBucket:
+    """``rate`` tokens per second up to ``burst``; thread-safe."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Take a token. Returns 0 if one was available, else the seconds until the next one."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            if self.rate <= 0:
+                return float('inf')
+            return (1 - self._tokens) / self.rate
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self._tokens
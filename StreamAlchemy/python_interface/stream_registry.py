@@ -0,0 +1,191 @@
+"""
+Registry of the streams a StreamAlchemy process is running.
+
+Request handlers, reaper callbacks, timers and the shutdown path all read and
+change the set of running streams at the same time. StreamRegistry keeps the
+name -> StreamRecord table copy-on-write. Every change builds a new dict under
+one write lock and swaps it in, so readers never lock. Iterating over
+``items()`` always walks one consistent snapshot, even while streams start
+and stop.
+
+Secondary indexes by status, encoder type and source answer filtered
+listings without scanning every record. They are updated under the same lock
+as the table.
+
+StreamRecord uses ``__slots__`` to keep thousands of entries small. It still
+supports the ``details['process']`` / ``details.get('config')`` style used
+throughout app.py.
+"""
+
+import threading
+
+INDEXED_FIELDS = ('status', 'encoder_type', 'source')
+
+
+def _source_of(stream_config):
+    return stream_config.get('source_url') or stream_config.get('video_file_path') or stream_config.get('video_file') or ''
+
+
+class StreamRecord:
+    """One running stream. Unset optional fields behave like missing dict keys."""
+
+    __slots__ = ('name', 'process', 'cmd', 'stop_event', 'exit_event', 'paths', 'config', 'start_time', 'duration_s',
+                 'hls_converter', 'suspend_requested', 'status', 'error', 'encoder_type', 'source', 'cgroup')
+
+    def __init__(self, name, process, cmd, stop_event, exit_event, paths, config, start_time, duration_s, status='running', cgroup=None):
+        self.name = name
+        self.process = process
+        self.cmd = cmd
+        self.stop_event = stop_event
+        self.exit_event = exit_event
+        self.paths = paths
+        self.config = config
+        self.start_time = start_time
+        self.duration_s = duration_s
+        self.status = status
+        self.error = ''
+        self.encoder_type = (config.get('encoder_details') or {}).get('type', 'unknown')
+        self.source = _source_of(config)
+        self.cgroup = cgroup  # Path of the stream's own cgroup, if it has one
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key in INDEXED_FIELDS:
+            raise KeyError(f"{key} is indexed; change it through StreamRegistry")
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return hasattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+
+class StreamRegistry:
+    """Thread-safe name -> StreamRecord mapping with lock-free snapshot reads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}  # Never mutated in place; replaced on every change
+        self._indexes = {field: {} for field in INDEXED_FIELDS}  # field -> value -> set of names
+
+    # --- reads (lock-free) ---
+
+    def __getitem__(self, name):
+        return self._records[name]
+
+    def __contains__(self, name):
+        return name in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def get(self, name, default=None):
+        return self._records.get(name, default)
+
+    def keys(self):
+        return self._records.keys()
+
+    def values(self):
+        return self._records.values()
+
+    def items(self):
+        return self._records.items()
+
+    def snapshot(self):
+        """The current table. It is never modified, so it can be iterated or kept freely."""
+        return self._records
+
+    # --- writes ---
+
+    def add(self, record):
+        """Insert or replace the record for ``record.name``."""
+        with self._lock:
+            records = dict(self._records)
+            old = records.get(record.name)
+            if old is not None:
+                self._unindex(old)
+            records[record.name] = record
+            self._index(record)
+            self._records = records
+
+    def pop(self, name, default=None):
+        with self._lock:
+            if name not in self._records:
+                return default
+            return self._remove(name)
+
+    def discard(self, name, record):
+        """Remove ``name`` only if it still maps to ``record`` (not a newer stream with the same name)."""
+        with self._lock:
+            if self._records.get(name) is not record:
+                return False
+            self._remove(name)
+            return True
+
+    def set_status(self, name, status, error=None):
+        """Update a stream's status (and error message) if it is registered."""
+        with self._lock:
+            record = self._records.get(name)
+            if record is None:
+                return False
+            if record.status != status:
+                self._index_remove('status', record.status, name)
+                record.status = status
+                self._indexes['status'].setdefault(status, set()).add(name)
+            if error:
+                record.error = error
+            elif status in ('running', 'stopped'):
+                record.error = ''
+            return True
+
+    # --- indexes ---
+
+    def names(self, **filters):
+        """Names matching every given ``field=value`` filter on the indexed fields, sorted."""
+        unknown = set(filters) - set(INDEXED_FIELDS)
+        if unknown:
+            raise KeyError(f"not an indexed field: {', '.join(sorted(unknown))}")
+        with self._lock:
+            if not filters:
+                return sorted(self._records)
+            sets = [self._indexes[field].get(value, ()) for field, value in filters.items()]
+            smallest = min(sets, key=len)
+            return sorted(n for n in smallest if all(n in s for s in sets))
+
+    def counts(self, field):
+        with self._lock:
+            return {value: len(names) for value, names in self._indexes[field].items()}
+
+    def _remove(self, name):
+        records = dict(self._records)
+        record = records.pop(name)
+        self._unindex(record)
+        self._records = records
+        return record
+
+    def _index(self, record):
+        for field in INDEXED_FIELDS:
+            self._indexes[field].setdefault(getattr(record, field), set()).add(record.name)
+
+    def _unindex(self, record):
+        for field in INDEXED_FIELDS:
+            self._index_remove(field, getattr(record, field), record.name)
+
+    def _index_remove(self, field, value, name):
+        names = self._indexes[field].get(value)
+        if names is not None:
+            names.discard(name)
+            if not names:
+                del self._indexes[field][value]
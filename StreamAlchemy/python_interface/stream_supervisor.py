@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+StreamAlchemy stream supervisor.
+
+Owns every ffmpeg and MediaMTX process and serves the stream-control API on a
+Unix socket (config.SUPERVISOR_SOCKET). Web workers started with
+SUPERVISOR_MODE=client forward stream routes to it. They can then be scaled,
+restarted or crash without touching a running stream.
+
+Usage:
+    python stream_supervisor.py                      # supervisor
+    SUPERVISOR_MODE=client python app.py             # web tier (or any WSGI server with several workers)
+"""
+
+import os
+import sys
+
+# Must be set before config/app are imported: it decides whether app.py starts MediaMTX, the reaper, etc.
+os.environ['SUPERVISOR_MODE'] = 'supervisor'
+
+import config
+import app as stream_app
+from supervisor_ipc import SupervisorServer
+
+
+def main():
+    errors = config.validate_config() if hasattr(config, 'validate_config') else []
+    for error in errors:
+        stream_app.app.logger.error(f"Configuration error: {error}")
+    if errors:
+        sys.exit(1)
+
+    server = SupervisorServer(config.SUPERVISOR_SOCKET, stream_app.supervisor_ops(), logger=stream_app.app.logger)
+    stream_app.app.logger.info(f"Stream supervisor (PID {os.getpid()}) listening on {config.SUPERVISOR_SOCKET}")
+    stream_app._start_restore_thread()
+    try:
+        # SIGTERM/SIGINT run app.py's shutdown handler, which stops the streams and raises SystemExit here
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Unix socket control protocol between the StreamAlchemy web tier and the stream supervisor.
+
+The supervisor process owns every ffmpeg and MediaMTX process. Web workers
+talk to it over a local Unix socket using newline-delimited JSON: one request
+object per line, answered by one response object per line, on a connection
+that may carry any number of requests.
+
+    request:  {"id": 1, "op": "ping"}
+    response: {"id": 1, "ok": true, "result": {...}}
+    error:    {"id": 1, "ok": false, "error": "message"}
+
+The ops themselves are supplied by the server's owner as a dict of
+``op name -> callable(**args)``. This module only handles framing,
+connections and errors.
+"""
+
+import itertools
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class SupervisorUnavailable(ConnectionError):
+    """The supervisor socket is missing, refused the connection or hung up."""
+
+
+class SupervisorError(RuntimeError):
+    """The supervisor answered with an error."""
+
+
+def _send(sock_file, obj):
+    sock_file.write(json.dumps(obj, separators=(',', ':')).encode() + b'\n')
+    sock_file.flush()
+
+
+def _recv(sock_file):
+    line = sock_file.readline(MAX_MESSAGE_BYTES + 1)
+    if not line:
+        return None
+    if len(line) > MAX_MESSAGE_BYTES:
+        raise ValueError("message too large")
+    return json.loads(line)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                req = _recv(self.rfile)
+            except (ValueError, OSError) as e:
+                try:
+                    _send(self.wfile, {'id': None, 'ok': False, 'error': f"bad request: {e}"})
+                except OSError:
+                    pass
+                return
+            if req is None:
+                return
+            resp = {'id': req.get('id') if isinstance(req, dict) else None}
+            try:
+                op = server.ops.get(req.get('op')) if isinstance(req, dict) else None
+                if op is None:
+                    raise KeyError(f"unknown op {req.get('op') if isinstance(req, dict) else req!r}")
+                resp.update(ok=True, result=op(**(req.get('args') or {})))
+            except Exception as e:
+                server.logger.debug(f"Supervisor op {req!r} failed: {e}", exc_info=True)
+                resp.update(ok=False, error=str(e))
+            try:
+                _send(self.wfile, resp)
+            except OSError:
+                return
+
+
+class SupervisorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve ``ops`` on a Unix socket; each client connection gets its own thread."""
+
+    daemon_threads = True
+    request_queue_size = 128  # Several web workers connect at once; the default backlog of 5 refuses them
+
+    def __init__(self, path, ops, logger=None, mode=0o660):
+        self.ops = dict(ops)
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = path
+        if os.path.exists(path):
+            # A stale socket from a dead supervisor; a live one would still accept connections
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except OSError:
+                os.unlink(path)
+            else:
+                raise OSError(f"A supervisor is already listening on {path}")
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        super().__init__(path, _Handler)
+        os.chmod(path, mode)
+
+    def start(self):
+        """Serve from a background thread."""
+        thread = threading.Thread(target=self.serve_forever, name='supervisor-ipc', daemon=True)
+        thread.start()
+        return thread
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class SupervisorClient:
+    """Blocking client that keeps up to ``pool_size`` idle connections for reuse; safe to share between threads."""
+
+    def __init__(self, path, timeout=30.0, pool_size=8):
+        self.path = path
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = []  # (socket, file) pairs with no request in flight
+        self._idle_lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def _connect(self, sock):
+        deadline = time.monotonic() + (sock.gettimeout() or self.timeout)
+        while True:
+            try:
+                sock.connect(self.path)
+                return
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                raise SupervisorUnavailable(f"Stream supervisor not reachable at {self.path}: {e}") from e
+            except BlockingIOError as e:
+                # Listen backlog is full (EAGAIN on Unix sockets); the supervisor is busy, not gone
+                if time.monotonic() >= deadline:
+                    raise SupervisorUnavailable(f"Stream supervisor at {self.path} is not accepting connections") from e
+                time.sleep(0.01)
+
+    def _checkout(self):
+        """An idle connection the supervisor has not closed, or None."""
+        while True:
+            with self._idle_lock:
+                if not self._idle:
+                    return None
+                sock, f = self._idle.pop()
+            try:
+                # An idle connection has nothing to read; EOF or data means the supervisor hung up or restarted
+                sock.setblocking(False)
+                if sock.recv(1, socket.MSG_PEEK) == b'':
+                    raise ConnectionResetError
+            except BlockingIOError:
+                return sock, f
+            except OSError:
+                pass
+            self._discard(sock, f)
+
+    def _checkin(self, sock, f):
+        with self._idle_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((sock, f))
+                return
+        self._discard(sock, f)
+
+    @staticmethod
+    def _discard(sock, f):
+        for closable in (f, sock):
+            try:
+                closable.close()
+            except OSError:
+                pass
+
+    def close(self):
+        """Close the idle connections."""
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for sock, f in idle:
+            self._discard(sock, f)
+
+    def call(self, op, timeout=None, **args):
+        conn = self._checkout()
+        if conn is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout if timeout is None else timeout)
+            try:
+                self._connect(sock)
+            except BaseException:
+                sock.close()
+                raise
+            conn = sock, sock.makefile('rwb')
+        sock, f = conn
+        sock.settimeout(self.timeout if timeout is None else timeout)
+        req_id = next(self._ids)
+        try:
+            _send(f, {'id': req_id, 'op': op, 'args': args})
+            resp = _recv(f)
+        except socket.timeout as e:
+            self._discard(sock, f)
+            raise SupervisorUnavailable(f"Stream supervisor did not answer {op!r} in time") from e
+        except (ConnectionResetError, BrokenPipeError) as e:
+            self._discard(sock, f)
+            raise SupervisorUnavailable(f"Stream supervisor hung up during {op!r}: {e}") from e
+        except BaseException:
+            self._discard(sock, f)
+            raise
+        if resp is None or resp.get('id') != req_id:
+            self._discard(sock, f)
+            raise SupervisorUnavailable(f"Stream supervisor closed the connection during {op!r}")
+        self._checkin(sock, f)
+        if not resp.get('ok'):
+            raise SupervisorError(resp.get('error') or 'unknown error')
+        return resp.get('result')
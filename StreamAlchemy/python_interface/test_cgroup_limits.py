@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Tests for per-stream cgroup v2 limits (cgroup_limits.py).
+Runs against a fake cgroupfs tree in a temp directory; no root or real cgroups are needed.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cgroup_limits import CgroupManager, resolve_limits
+
+CLASSES = {'light': {'cpu_cores': 0.5, 'memory_mb': 256, 'io_weight': 50},
+           'standard': {'cpu_cores': 2, 'memory_mb': 1024}}
+
+
+def _fake_tree(tmp, own='/service', procs='', controllers='cpuset cpu io memory pids'):
+    """A cgroup v2 mount with this process in ``own``, plus the /proc/self/cgroup that points there."""
+    mount, proc = os.path.join(tmp, 'cgroup'), os.path.join(tmp, 'proc')
+    base = os.path.join(mount, own.lstrip('/'))
+    os.makedirs(base)
+    os.makedirs(os.path.join(proc, 'self'))
+    for path, content in [(os.path.join(mount, 'cgroup.controllers'), controllers),
+                          (os.path.join(base, 'cgroup.controllers'), controllers),
+                          (os.path.join(base, 'cgroup.subtree_control'), ''),
+                          (os.path.join(base, 'cgroup.procs'), procs),
+                          (os.path.join(proc, 'self', 'cgroup'), f"0::{own}\n")]:
+        with open(path, 'w') as f:
+            f.write(content)
+    return mount, proc, base
+
+
+def _manager(tmp, delegate=True, **kwargs):
+    mount, proc, base = _fake_tree(tmp, **kwargs)
+    if delegate:  # What systemd's Delegate=yes leaves on the cgroup
+        try:
+            os.setxattr(base, 'user.delegate', b'1')
+        except OSError:
+            pytest.skip("temp filesystem has no user xattrs")
+    mgr = CgroupManager(mount=mount, proc_root=proc, uid=0)
+    # mkdir on real cgroupfs creates the interface files; seed the ones setup() reads
+    os.makedirs(os.path.join(base, 'streams'))
+    with open(os.path.join(base, 'streams', 'cgroup.subtree_control'), 'w') as f:
+        f.write('')
+    return mgr, base
+
+
+def test_limits_come_from_the_class_with_per_stream_overrides():
+    """The stream's class sets the defaults; cpu_limit/memory_limit_mb/io_weight override them"""
+    assert resolve_limits({}, CLASSES, 'standard') == {'class': 'standard', 'cpu_cores': 2, 'memory_mb': 1024, 'io_weight': None}
+    limits = resolve_limits({'resource_class': 'light', 'cpu_limit': 1.5}, CLASSES, 'standard')
+    assert limits == {'class': 'light', 'cpu_cores': 1.5, 'memory_mb': 256, 'io_weight': 50}
+    with pytest.raises(ValueError):
+        resolve_limits({'resource_class': 'huge'}, CLASSES, 'standard')
+
+
+def test_setup_falls_back_with_a_reason_when_cgroups_are_unusable():
+    """No v2 mount, or no delegated memory controller, leaves limits disabled and explains why"""
+    with tempfile.TemporaryDirectory() as tmp:
+        mgr = CgroupManager(mount=os.path.join(tmp, 'missing'))
+        assert not mgr.setup() and 'cgroup v1 or hybrid' in mgr.reason
+        assert mgr.find(os.getpid()) is None and mgr.prune() == 0
+    with tempfile.TemporaryDirectory() as tmp:
+        mgr, _ = _manager(tmp, controllers='cpu pids')
+        assert not mgr.setup() and 'memory controller not delegated' in mgr.reason
+        assert mgr.status()['enabled'] is False
+
+
+def test_setup_requires_delegation_not_just_write_access():
+    """Root may write anywhere, so its own cgroup needs systemd's delegate mark; an explicit CGROUP_ROOT must be owned by the app's user"""
+    with tempfile.TemporaryDirectory() as tmp:
+        mgr, base = _manager(tmp, delegate=False, procs='4242\n')
+        assert not mgr.setup() and 'not delegated' in mgr.reason
+        assert not os.path.exists(os.path.join(base, 'app'))  # Nothing was moved
+        assert open(os.path.join(base, 'cgroup.subtree_control')).read() == ''
+    with tempfile.TemporaryDirectory() as tmp:
+        mount, proc, base = _fake_tree(tmp)
+        owner = os.stat(base).st_uid
+        assert not CgroupManager(root=base, mount=mount, proc_root=proc, uid=owner + 1).setup()
+        mgr = CgroupManager(root=base, mount=mount, proc_root=proc, uid=owner)
+        os.makedirs(os.path.join(base, 'streams'))
+        with open(os.path.join(base, 'streams', 'cgroup.subtree_control'), 'w') as f:
+            f.write('')
+        assert mgr.setup(), mgr.reason
+
+
+def test_setup_moves_own_processes_to_a_leaf_and_writes_limits():
+    """The app moves out of its own cgroup so controllers can be enabled, and each stream gets cpu.max/memory.max/io.weight"""
+    with tempfile.TemporaryDirectory() as tmp:
+        mgr, base = _manager(tmp, procs='4242\n')
+        assert mgr.setup(), mgr.reason
+        assert open(os.path.join(base, 'app', 'cgroup.procs')).read() == '4242'
+        assert open(os.path.join(base, 'cgroup.subtree_control')).read() == '+cpu +memory +io'
+        assert mgr.controllers == ['cpu', 'memory', 'io']
+        path = mgr.create('cam1', {'cpu_cores': 1.5, 'memory_mb': 512, 'io_weight': 50})
+        assert os.path.dirname(path) == mgr.streams_dir and os.path.basename(path).startswith('cam1-')
+        assert open(os.path.join(path, 'cpu.max')).read() == '150000 100000'
+        assert open(os.path.join(path, 'memory.max')).read() == str(512 * 1024 * 1024)
+        assert open(os.path.join(path, 'io.weight')).read() == 'default 50'
+        mgr.attach(path, 777)
+        assert open(os.path.join(path, 'cgroup.procs')).read() == '777'
+        unlimited = mgr.create('cam2', {'cpu_cores': None, 'memory_mb': None})
+        assert open(os.path.join(unlimited, 'cpu.max')).read() == 'max 100000'
+        assert open(os.path.join(unlimited, 'memory.max')).read() == 'max'
+
+
+def test_usage_reads_cpu_stat_and_memory_current():
+    """CPU is the usage_usec delta between reads; throttling and OOM kills are reported; a gone cgroup reads None"""
+    with tempfile.TemporaryDirectory() as tmp:
+        now = [100.0]
+        mgr, base = _manager(tmp, procs='')
+        mgr._clock = lambda: now[0]
+        assert mgr.setup(), mgr.reason
+        path = mgr.create('cam1', {'cpu_cores': 2, 'memory_mb': 1024})
+
+        def write(usage_usec, throttled_usec=0, oom_kills=0):
+            for name, content in [('cpu.stat', f"usage_usec {usage_usec}\nnr_throttled 3\nthrottled_usec {throttled_usec}\n"),
+                                  ('memory.current', str(300 * 1024 * 1024)), ('cgroup.procs', '10\n11\n'),
+                                  ('memory.events', f"low 0\nhigh 0\nmax 2\noom 1\noom_kill {oom_kills}\n")]:
+                with open(os.path.join(path, name), 'w') as f:
+                    f.write(content)
+
+        write(5000000)
+        first = mgr.usage(path)
+        assert first['cpu_percent'] == 0.0 and first['memory_mb'] == 300.0 and first['processes'] == 2
+        now[0] += 2
+        write(8000000, throttled_usec=250000, oom_kills=1)  # 3 CPU seconds over 2 wall seconds
+        second = mgr.usage(path)
+        assert second['cpu_percent'] == 150.0 and second['throttled_ms'] == 250 and second['oom_kills'] == 1
+        assert mgr.usage(os.path.join(mgr.streams_dir, 'gone')) is None
+
+
+if __name__ == "__main__":
+    for test in [test_limits_come_from_the_class_with_per_stream_overrides, test_setup_falls_back_with_a_reason_when_cgroups_are_unusable,
+                 test_setup_requires_delegation_not_just_write_access, test_setup_moves_own_processes_to_a_leaf_and_writes_limits, test_usage_reads_cpu_stat_and_memory_current]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All cgroup limit tests passed!")
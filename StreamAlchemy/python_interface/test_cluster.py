@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for cluster placement and failover bookkeeping (cluster.py).
+Pure in-memory tests with a fake clock; no nodes or network needed.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cluster import ClusterState
+
+SW = {'h264:sw': {'name': 'libx264', 'type': 'software'}, 'h264:hw': {'name': 'libx264', 'type': 'software'}}
+HW = {'h264:sw': {'name': 'libx264', 'type': 'software'}, 'h264:hw': {'name': 'h264_nvenc', 'type': 'hardware_nvidia'}}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_places_on_node_with_most_headroom():
+    """The emptier node wins, and placements count before the next heartbeat"""
+    state = ClusterState()
+    state.heartbeat('a', 'http://a', cores=4, max_streams=4, encoders=SW, streams=['x', 'y'])
+    state.heartbeat('b', 'http://b', cores=4, max_streams=4, encoders=SW, streams=[])
+    assert state.candidates('h264:sw') == ['b', 'a']
+    state.assign('s1', 'b', {'stream_name': 's1'})
+    state.assign('s2', 'b', {'stream_name': 's2'})
+    state.assign('s3', 'b', {'stream_name': 's3'})
+    assert state.candidates('h264:sw')[0] == 'a'
+
+
+def test_capacity_encoders_and_hardware_preference():
+    """Full nodes and nodes without the encoder are skipped; real hardware wins for hw requests"""
+    state = ClusterState()
+    state.heartbeat('full', 'http://full', cores=2, max_streams=1, encoders=HW, streams=['x'])
+    state.heartbeat('gpu', 'http://gpu', cores=2, max_streams=8, encoders=HW, streams=['a', 'b', 'c'])
+    state.heartbeat('cpu', 'http://cpu', cores=2, max_streams=8, encoders=SW, streams=[])
+    state.heartbeat('old', 'http://old', cores=2, max_streams=8, encoders={}, streams=[])
+    assert state.candidates('h264:hw') == ['gpu', 'cpu']
+    assert state.candidates('h264:sw') == ['cpu', 'gpu']
+    assert state.candidates('h265:sw') == []
+
+
+def test_dead_node_streams_are_orphaned():
+    """Streams on a node that stops sending heartbeats are handed back for re-placement"""
+    clock = FakeClock()
+    state = ClusterState(node_timeout=10, clock=clock)
+    state.heartbeat('a', 'http://a', cores=4, encoders=SW)
+    state.heartbeat('b', 'http://b', cores=4, encoders=SW)
+    state.assign('s1', 'a', {'stream_name': 's1'})
+    state.assign('s2', 'b', {'stream_name': 's2'})
+    clock.now += 8
+    state.heartbeat('b', 'http://b', cores=4, encoders=SW, streams=['s2'])
+    clock.now += 5
+    assert state.expire_nodes() == ['a']
+    assert state.orphaned_streams() == [('s1', {'stream_name': 's1'}, 'a')]
+    assert state.candidates('h264:sw') == ['b']
+    state.assign('s1', 'b', {'stream_name': 's1'})
+    assert state.orphaned_streams() == []
+    assert state.assignment('s1')['placements'] == 2
+    assert state.heartbeat('a', 'http://a', cores=4, encoders=SW) is True  # Revived
+
+
+def test_release_restores_previous_assignment():
+    """A failed tentative placement leaves the earlier assignment untouched"""
+    state = ClusterState()
+    state.heartbeat('a', 'http://a', cores=4, encoders=SW)
+    state.assign('s1', 'a', {'stream_name': 's1'})
+    prev = state.assignment('s1')
+    state.assign('s1', 'b', {'stream_name': 's1'})
+    state.release('s1', prev)
+    assert state.assignment('s1') == prev
+    state.assign('s2', 'a', {'stream_name': 's2'})
+    state.release('s2')
+    assert state.assignment('s2') is None
+
+
+if __name__ == "__main__":
+    for test in [test_places_on_node_with_most_headroom, test_capacity_encoders_and_hardware_preference,
+                 test_dead_node_streams_are_orphaned, test_release_restores_previous_assignment]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All cluster tests passed!")
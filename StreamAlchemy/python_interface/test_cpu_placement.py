@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tests for NUMA- and core-aware CPU placement (cpu_placement.py).
+Uses a fake /sys topology in a temp directory; no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cpu_placement import (PlacementEngine, apply_affinity, estimate_cost, format_cpu_list, parse_cpu_list, read_topology,
+                           spawn_affinity)
+
+
+def _fake_sys(tmp, nodes=2, cores_per_node=2):
+    """Two NUMA nodes of two hyperthreaded cores: CPU n and n + 4 are siblings."""
+    threads = nodes * cores_per_node
+    for cpu in range(threads * 2):
+        topo = os.path.join(tmp, 'cpu', f"cpu{cpu}", 'topology')
+        os.makedirs(topo)
+        with open(os.path.join(topo, 'physical_package_id'), 'w') as f:
+            f.write(str((cpu % threads) // cores_per_node))
+        with open(os.path.join(topo, 'core_id'), 'w') as f:
+            f.write(str(cpu % cores_per_node))
+    with open(os.path.join(tmp, 'cpu', 'online'), 'w') as f:
+        f.write(f"0-{threads * 2 - 1}\n")
+    for node in range(nodes):
+        os.makedirs(os.path.join(tmp, 'node', f"node{node}"))
+        first = node * cores_per_node
+        with open(os.path.join(tmp, 'node', f"node{node}", 'cpulist'), 'w') as f:
+            f.write(f"{first}-{first + cores_per_node - 1},{first + threads}-{first + threads + cores_per_node - 1}\n")
+    return tmp
+
+
+def test_topology_groups_siblings_by_core_and_node():
+    """Hyperthread siblings form one core; reserved and disallowed CPUs are left out"""
+    assert parse_cpu_list('0-3,8,10-11') == [0, 1, 2, 3, 8, 10, 11]
+    assert format_cpu_list([0, 1, 2, 3, 8, 10, 11]) == '0-3,8,10-11'
+    with tempfile.TemporaryDirectory() as tmp:
+        cores = read_topology(_fake_sys(tmp), allowed=range(8))
+        assert [(c['node'], c['cpus']) for c in cores] == [(0, [0, 4]), (0, [1, 5]), (1, [2, 6]), (1, [3, 7])]
+        cores = read_topology(tmp, allowed=range(8), reserved=[0, 4])
+        assert [c['cpus'] for c in cores] == [[1, 5], [2, 6], [3, 7]]
+
+
+def test_cost_follows_encoder_resolution_and_fps():
+    """libx265 4K costs far more than libx264 1080p, which costs far more than a copy or a GPU encode"""
+    x264 = estimate_cost(['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx264', '-r', '30', '-s', '1920x1080', '-f', 'rtsp', 'out'])
+    x265_4k = estimate_cost(['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx265', '-r', '30', '-s', '3840x2160', '-f', 'rtsp', 'out'])
+    x264_720p15 = estimate_cost(['ffmpeg', '-i', 'in.mp4', '-c:v', 'libx264', '-r', '15', '-s', '1280x720', 'out'])
+    copy = estimate_cost(['ffmpeg', '-re', '-stream_loop', '-1', '-i', 'cache.mkv', '-map', '0', '-c', 'copy', 'out'])
+    nvenc = estimate_cost(['ffmpeg', '-i', 'in.mp4', '-c:v', 'h264_nvenc', '-r', '30', 'out'])
+    abr = estimate_cost(['ffmpeg', '-i', 'in', '-filter_complex', '[0:v]split=2[v0][v1];[v0]scale=1920:1080[s0];[v1]scale=1280:720[s1]',
+                         '-map', '[s0]', '-c:v', 'libx264', '-r', '30', 'a', '-map', '[s1]', '-c:v', 'libx264', '-r', '30', 'b'])
+    assert x264 == 1.6 and x264_720p15 < 0.5
+    assert x265_4k > 15 and copy < 0.2 and nvenc < 0.5
+    assert 2.2 < abr < 2.4
+
+
+def test_streams_spread_over_nodes_and_least_loaded_cores():
+    """Each stream gets whole cores (with siblings) on one node, spread by load"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = PlacementEngine(read_topology(_fake_sys(tmp), allowed=range(8)))
+    assert engine.place('a', 1.6) == [0, 1, 4, 5]  # Two cores on node 0
+    assert engine.place('b', 0.8) == [2, 6]        # Node 1 has more spare capacity
+    assert engine.place('c', 0.8) == [3, 7]
+    assert engine.place('d', 3.5) in ([0, 1, 4, 5], [2, 3, 6, 7])  # Capped at one node
+    snap = engine.snapshot()
+    assert snap['total_load'] == 6.7 and snap['streams']['b']['node'] == 1
+    assert engine.release('d') and not engine.release('d')
+    assert engine.snapshot()['total_load'] == 3.2
+
+
+def test_rebalance_moves_streams_off_busy_cores_after_stops():
+    """When streams stop, streams left on crowded cores move to the freed ones"""
+    engine = PlacementEngine([{'id': i, 'node': 0, 'cpus': [i]} for i in range(4)])
+    for i in range(8):
+        engine.place(f"s{i}", 0.5)  # Two per core
+    for name in ('s0', 's4', 's1', 's5'):  # Empties cores 0 and 1
+        engine.release(name)
+    loads = [c['load'] for c in engine.snapshot()['cores']]
+    assert loads == [0.0, 0.0, 1.0, 1.0]
+    moved = engine.rebalance()
+    assert len(moved) == 2 and all(len(cpus) == 1 for cpus in moved.values())
+    assert [c['load'] for c in engine.snapshot()['cores']] == [0.5, 0.5, 0.5, 0.5]
+    assert engine.rebalance() == {}
+
+
+def test_apply_affinity_pins_a_running_process():
+    """sched_setaffinity is applied to the process's threads"""
+    proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+    try:
+        cpu = min(os.sched_getaffinity(0))
+        assert apply_affinity(proc.pid, [cpu])
+        assert os.sched_getaffinity(proc.pid) == {cpu}
+    finally:
+        proc.kill()
+        proc.wait()
+    assert not apply_affinity(proc.pid, [cpu])
+
+
+def test_spawned_process_starts_on_its_cpus():
+    """A child spawned inside spawn_affinity() has its CPU set from the start; the spawning thread gets its own back"""
+    original = os.sched_getaffinity(0)
+    cpu = max(original)
+    seen = {}
+
+    def spawn():
+        with spawn_affinity([cpu]):
+            seen['proc'] = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        seen['after'] = os.sched_getaffinity(0)
+
+    worker = threading.Thread(target=spawn)
+    worker.start()
+    worker.join()
+    proc = seen['proc']
+    try:
+        assert os.sched_getaffinity(proc.pid) == {cpu}
+        assert seen['after'] == original and os.sched_getaffinity(0) == original
+    finally:
+        proc.kill()
+        proc.wait()
+    with spawn_affinity(None):
+        assert os.sched_getaffinity(0) == original
+
+
+if __name__ == "__main__":
+    for test in [test_topology_groups_siblings_by_core_and_node, test_cost_follows_encoder_resolution_and_fps,
+                 test_streams_spread_over_nodes_and_least_loaded_cores, test_rebalance_moves_streams_off_busy_cores_after_stops,
+                 test_apply_affinity_pins_a_running_process, test_spawned_process_starts_on_its_cpus]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All CPU placement tests passed!")
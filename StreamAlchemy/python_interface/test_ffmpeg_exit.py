@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for how StreamAlchemy handles an ffmpeg exit reported by the child reaper (_handle_ffmpeg_exit).
+Streams are registered with stand-in process handles, so no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from process_reaper import EXIT_UNKNOWN, ChildReaper
+
+
+class _GoneProcess:
+    """A process whose exit status cannot be collected: wait() fails and there is no returncode."""
+    pid = 2 ** 22 + 12345  # Above the default pid_max, so pidfd_open reports it as already gone
+    returncode = None
+    adopted = False
+
+    def poll(self):
+        return 0
+
+    def wait(self, timeout=None):
+        raise ChildProcessError("no child processes")
+
+
+class _AdoptedProcess(_GoneProcess):
+    returncode = -1  # ADOPTED_EXIT_UNKNOWN
+    adopted = True
+
+
+def _reaper_exit_code(proc):
+    """The return code the reaper hands to on_exit for ``proc``."""
+    reaper = ChildReaper(workers=1)
+    reaper.start()
+    seen, done = {}, threading.Event()
+    try:
+        reaper.watch(proc, lambda p, rc: (seen.update(rc=rc), done.set()))
+        assert done.wait(5), "exit callback never ran"
+    finally:
+        reaper.stop()
+    return seen['rc']
+
+
+def _exit_registered_stream(name, proc, rc):
+    """Register ``name`` with ``proc`` as its ffmpeg and run the exit handler with ``rc``, auto-restart on."""
+    import app
+    from stream_registry import StreamRecord
+    paths = app._get_stream_paths(name)
+    stop_ev, exit_ev = threading.Event(), threading.Event()
+    app.active_streams.add(StreamRecord(name, proc, ['ffmpeg'], stop_ev, exit_ev, paths, {'stream_name': name}, time.time(), 0))
+    old = getattr(app.config, 'ENABLE_AUTO_RESTART', False)
+    app.config.ENABLE_AUTO_RESTART = True
+    try:
+        app._handle_ffmpeg_exit(name, ['ffmpeg'], time.time(), 0, paths, stop_ev, exit_ev, proc, rc)
+    finally:
+        app.config.ENABLE_AUTO_RESTART = old
+    assert exit_ev.is_set() and name not in app.active_streams
+    with app._restart_lock:
+        state = (name in app._pending_restarts, name in app._parked_streams, name in app._restart_trackers)
+    timers = [t['name'] for t in app._scheduler.pending(f"restart:{name}")]
+    app._forget_restart_state(name)
+    return state, timers
+
+
+def test_reaper_unknown_exit_is_not_a_crash():
+    """The reaper's unknown exit code neither restarts nor parks the stream"""
+    rc = _reaper_exit_code(_GoneProcess())
+    assert rc is EXIT_UNKNOWN
+    state, timers = _exit_registered_stream('exit_unknown_test', _GoneProcess(), rc)
+    assert state == (False, False, False)
+    assert timers == []
+
+
+def test_adopted_exit_is_not_a_crash():
+    """An adopted process's -1 is not read as SIGHUP or counted as a crash"""
+    state, timers = _exit_registered_stream('exit_adopted_test', _AdoptedProcess(), -1)
+    assert state == (False, False, False)
+    assert timers == []
+
+
+def test_known_crash_still_restarts():
+    """A real non-zero exit code is still a crash that schedules a restart"""
+    state, timers = _exit_registered_stream('exit_crash_test', _GoneProcess(), 1)
+    assert state[0] and state[2]
+    assert timers == ['restart:exit_crash_test']
+
+
+if __name__ == "__main__":
+    for test in [test_reaper_unknown_exit_is_not_a_crash, test_adopted_exit_is_not_a_crash, test_known_crash_still_restarts]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All ffmpeg exit tests passed!")
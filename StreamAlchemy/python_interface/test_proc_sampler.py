@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Tests for the batched process sampler (proc_sampler.py).
+Samples real short-lived subprocesses, so no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from proc_sampler import ProcessSampler
+
+pytestmark = pytest.mark.skipif(not ProcessSampler().available, reason="needs /proc or psutil")
+
+
+def _spawn(code):
+    return subprocess.Popen([sys.executable, '-c', code])
+
+
+def test_busy_and_idle_processes_in_one_pass():
+    """A spinning process shows CPU, a sleeping one doesn't, and a pass doesn't block"""
+    busy = _spawn('while True: pass')
+    idle = _spawn('import time; bytearray(64 * 1024 * 1024); time.sleep(30)')
+    try:
+        sampler = ProcessSampler()
+        time.sleep(0.3)
+        sampler.sample([busy.pid, idle.pid])
+        time.sleep(0.5)
+        t0 = time.perf_counter()
+        stats = sampler.sample([busy.pid, idle.pid])
+        assert time.perf_counter() - t0 < 0.1
+        assert stats[busy.pid]['cpu_percent'] > 50
+        assert stats[idle.pid]['cpu_percent'] < 20
+        assert stats[idle.pid]['memory_mb'] > 1
+        assert sampler.latest(busy.pid) == stats[busy.pid]
+    finally:
+        busy.kill(); idle.kill()
+        busy.wait(); idle.wait()
+
+
+def test_gone_processes_are_skipped_and_pruned():
+    """Exited PIDs drop out of the results and the history"""
+    proc = _spawn('pass')
+    proc.wait()
+    sampler = ProcessSampler()
+    assert sampler.sample([proc.pid, os.getpid()]).keys() == {os.getpid()}
+    assert sampler.latest(proc.pid) is None
+    sampler.sample([])
+    assert sampler.latest(os.getpid()) is None
+
+
+def test_many_pids_sample_quickly():
+    """A pass over many PIDs takes milliseconds"""
+    procs = [_spawn('import time; time.sleep(30)') for _ in range(20)]
+    try:
+        sampler = ProcessSampler()
+        pids = [p.pid for p in procs]
+        t0 = time.perf_counter()
+        for _ in range(10):
+            stats = sampler.sample(pids)
+        assert len(stats) == 20
+        assert (time.perf_counter() - t0) / 10 < 0.05
+    finally:
+        for p in procs:
+            p.kill(); p.wait()
+
+
+def test_session_totals_include_forked_children():
+    """A session's totals count the busy child its leader forked, not just the leader"""
+    leader = subprocess.Popen([sys.executable, '-c', 'import subprocess, sys, time; '
+                               'subprocess.Popen([sys.executable, "-c", "while True: pass"]); time.sleep(30)'],
+                              start_new_session=True)
+    try:
+        sampler = ProcessSampler()
+        time.sleep(0.3)
+        sampler.sample_sessions([leader.pid])
+        time.sleep(0.5)
+        totals = sampler.sample_sessions([leader.pid])[leader.pid]
+        assert totals['processes'] == 2 and totals['status'] is not None
+        assert totals['cpu_percent'] > 50
+        assert sampler.sample([leader.pid])[leader.pid]['cpu_percent'] < 20  # The leader alone looks idle
+        assert sampler.latest_session(leader.pid) == totals
+    finally:
+        os.killpg(leader.pid, 9)
+        leader.wait()
+
+
+if __name__ == "__main__":
+    for test in [test_busy_and_idle_processes_in_one_pass, test_gone_processes_are_skipped_and_pruned, test_many_pids_sample_quickly,
+                 test_session_totals_include_forked_children]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All process sampler tests passed!")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for process identity checks and adoption (process_adoption.py).
+Uses short-lived real subprocesses; Linux only since identities come from /proc.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from process_adoption import ADOPTED_EXIT_UNKNOWN, adopt, identity_matches, process_identity
+from process_reaper import ChildReaper
+
+pytestmark = pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason="needs /proc")
+
+
+def _spawn(seconds):
+    return subprocess.Popen([sys.executable, '-c', f'import time; time.sleep({seconds})'])
+
+
+def _identity(pid):
+    # /proc/<pid>/cmdline can read empty for a moment right after exec
+    for _ in range(100):
+        ident = process_identity(pid)
+        if ident and ident['cmdline']:
+            return ident
+        time.sleep(0.01)
+    return process_identity(pid)
+
+
+def test_identity_of_live_process():
+    """The recorded identity matches the process until it exits"""
+    proc = _spawn(5)
+    try:
+        ident = _identity(proc.pid)
+        assert ident['cmdline'] == proc.args
+        assert identity_matches(proc.pid, ident['starttime'], ident['cmdline'])
+        assert not identity_matches(proc.pid, ident['starttime'] + 1, ident['cmdline'])
+        assert not identity_matches(proc.pid, ident['starttime'], ident['cmdline'] + ['extra'])
+    finally:
+        proc.kill()
+        proc.wait()
+    assert process_identity(proc.pid) is None
+
+
+def test_adopt_rejects_mismatch():
+    """adopt() only hands out a process whose start time and argv still match"""
+    proc = _spawn(5)
+    try:
+        ident = _identity(proc.pid)
+        assert adopt(proc.pid, ident['starttime'], ['ffmpeg', '-i', 'other']) is None
+        adopted = adopt(proc.pid, ident['starttime'], ident['cmdline'])
+        assert adopted is not None and adopted.poll() is None
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+def test_adopted_exit_seen_by_reaper():
+    """An adopted process can be watched by the reaper and reports an unknown exit code"""
+    proc = _spawn(0.3)
+    reaper = ChildReaper(workers=1)
+    reaper.start()
+    try:
+        ident = _identity(proc.pid)
+        adopted = adopt(proc.pid, ident['starttime'], ident['cmdline'])
+        done = threading.Event()
+        seen = {}
+
+        def on_exit(p, rc):
+            seen['rc'] = rc
+            done.set()
+
+        reaper.watch(adopted, on_exit)
+        proc.wait()  # Reap it as its real parent would
+        assert done.wait(2), "exit of adopted process never reported"
+        assert seen['rc'] == ADOPTED_EXIT_UNKNOWN
+    finally:
+        reaper.stop()
+        if proc.poll() is None:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    for test in [test_identity_of_live_process, test_adopt_rejects_mismatch, test_adopted_exit_seen_by_reaper]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All adoption tests passed!")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-thread child reaper (process_reaper.py).
+Uses short-lived real subprocesses, so no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from process_reaper import ChildReaper
+
+
+def _spawn(seconds):
+    return subprocess.Popen([sys.executable, '-c', f'import time; time.sleep({seconds})'])
+
+
+def test_exit_detected_quickly():
+    """A child exit is reported with its return code well under 100 ms"""
+    reaper = ChildReaper(workers=2)
+    reaper.start()
+    try:
+        done = threading.Event()
+        seen = {}
+
+        def on_exit(proc, rc):
+            seen['rc'] = rc
+            seen['at'] = time.time()
+            done.set()
+
+        # The child prints its exit time, so the test never waits on it alongside the reaper
+        proc = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(0.3); print(time.time(), flush=True)'],
+                                stdout=subprocess.PIPE, text=True)
+        reaper.watch(proc, on_exit)
+        assert done.wait(5), "exit callback never ran"
+        exited_at = float(proc.stdout.read())
+        proc.stdout.close()
+        assert seen['rc'] == 0
+        assert seen['at'] - exited_at < 0.1, f"exit noticed after {seen['at'] - exited_at:.3f}s"
+    finally:
+        reaper.stop()
+
+
+def test_exit_code_survives_a_concurrent_waiter():
+    """Another thread holding the process's wait lock (as the app's stop path does) does not turn the exit code into None"""
+    reaper = ChildReaper(workers=1)
+    reaper.start()
+    try:
+        done = threading.Event()
+        seen = {}
+        proc = subprocess.Popen([sys.executable, '-c', 'import time, sys; time.sleep(0.2); sys.exit(3)'])
+        with proc._waitpid_lock:  # What Popen.wait() holds while another thread waits on the process
+            reaper.watch(proc, lambda p, rc: (seen.setdefault('rc', rc), done.set()))
+            time.sleep(0.6)
+        assert done.wait(2), "exit callback never ran"
+        assert seen['rc'] == 3
+    finally:
+        reaper.stop()
+
+
+def test_many_children_one_thread():
+    """Watching many children does not add a thread per child"""
+    reaper = ChildReaper(workers=2)
+    reaper.start()
+    procs = []
+    try:
+        before = threading.active_count()
+        remaining = threading.Semaphore(0)
+        for _ in range(20):
+            p = _spawn(0.2)
+            procs.append(p)
+            reaper.watch(p, lambda proc, rc: remaining.release())
+        assert threading.active_count() - before <= 2
+        for _ in procs:
+            assert remaining.acquire(timeout=5)
+    finally:
+        reaper.stop()
+        for p in procs:
+            if p.poll() is None:
+                p.kill()
+
+
+def test_deadline_callback():
+    """The deadline callback fires once while the child is still running"""
+    reaper = ChildReaper(workers=1)
+    reaper.start()
+    proc = _spawn(5)
+    try:
+        fired = threading.Event()
+        exited = threading.Event()
+
+        def on_deadline(p):
+            fired.set()
+            p.terminate()
+
+        reaper.watch(proc, lambda p, rc: exited.set(), deadline=time.time() + 0.2, on_deadline=on_deadline)
+        assert fired.wait(2), "deadline callback never ran"
+        assert exited.wait(2), "exit callback never ran after termination"
+    finally:
+        reaper.stop()
+        if proc.poll() is None:
+            proc.kill()
+
+
+def test_already_exited_child():
+    """Watching a child that has already been reaped still reports it"""
+    reaper = ChildReaper(workers=1)
+    reaper.start()
+    try:
+        proc = _spawn(0)
+        proc.wait()
+        done = threading.Event()
+        reaper.watch(proc, lambda p, rc: done.set())
+        assert done.wait(2)
+    finally:
+        reaper.stop()
+
+
+if __name__ == "__main__":
+    for test in [test_exit_detected_quickly, test_exit_code_survives_a_concurrent_waiter, test_many_children_one_thread, test_deadline_callback, test_already_exited_child]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All reaper tests passed!")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests for crash restart backoff, crash-loop detection and the fleet rate limit (restart_policy.py).
+Pure in-memory tests with a fake clock; no ffmpeg needed.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from restart_policy import RestartPolicy, RestartTracker, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_backoff_doubles_caps_and_jitters():
+    """Delays grow 2x per attempt up to the cap, within the jitter band"""
+    policy = RestartPolicy(base_delay=2, max_delay=10, jitter=0.5)
+    assert [policy.delay(n, rng=lambda: 0.5) for n in (1, 2, 3, 4, 5)] == [2, 4, 8, 10, 10]
+    assert policy.delay(1, rng=lambda: 0.0) == 1.0
+    assert policy.delay(1, rng=lambda: 1.0) == 3.0
+
+
+def test_gives_up_after_max_retries_and_resets_when_stable():
+    """Short-lived crashes use up the retries; a long stable run starts over"""
+    clock = FakeClock()
+    policy = RestartPolicy(max_retries=2, jitter=0, crash_loop_threshold=100, stable_after=60)
+    tracker = RestartTracker(policy, clock=clock)
+    assert tracker.record_crash(uptime=1) == ('restart', 2)
+    assert tracker.record_crash(uptime=1) == ('restart', 4)
+    clock.now += 500
+    assert tracker.record_crash(uptime=120) == ('restart', 2)  # Stable run resets the count
+    tracker.record_crash(uptime=1)
+    action, reason = tracker.record_crash(uptime=1)
+    assert action == 'park' and 'Gave up' in reason
+    assert RestartTracker(policy, max_retries=0, clock=clock).record_crash(uptime=1)[0] == 'park'
+
+
+def test_crash_loop_detected_within_window():
+    """Too many crashes inside the window park the stream; old crashes age out"""
+    clock = FakeClock()
+    policy = RestartPolicy(max_retries=100, crash_loop_threshold=3, crash_loop_window=60, stable_after=1000)
+    tracker = RestartTracker(policy, clock=clock)
+    assert tracker.record_crash(uptime=5)[0] == 'restart'
+    clock.now += 100
+    assert tracker.record_crash(uptime=5)[0] == 'restart'
+    clock.now += 10
+    assert tracker.record_crash(uptime=5)[0] == 'restart'
+    assert tracker.recent_crashes() == 2
+    clock.now += 10
+    action, reason = tracker.record_crash(uptime=5)
+    assert action == 'park' and 'Crash loop' in reason
+
+
+def test_token_bucket_limits_fleet_restarts():
+    """The bucket allows a burst, then one token per 1/rate seconds"""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert [bucket.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert bucket.try_acquire() == 0.5
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0
+    assert TokenBucket(rate=0, burst=1, clock=clock).try_acquire() == 0
+
+
+if __name__ == "__main__":
+    for test in [test_backoff_doubles_caps_and_jitters, test_gives_up_after_max_retries_and_resets_when_stable,
+                 test_crash_loop_detected_within_window, test_token_bucket_limits_fleet_restarts]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All restart policy tests passed!")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Tests for StreamAlchemy async start jobs (POST /start_stream with "async", GET /jobs/<id>).
+Nothing is launched: the tests only exercise request handling before a job would run.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bad_wait_rejected_before_queueing():
+    import app
+    submitted = []
+    real_submit = app._submit_start_job
+    app._submit_start_job = lambda data: submitted.append(data)
+    try:
+        client = app.app.test_client()
+        with app._start_jobs_lock:
+            jobs_before = set(app._start_jobs)
+        for query, body in (('', {'stream_name': 'bad_wait', 'async': True, 'wait': 'soon'}),
+                            ('?async=1&wait=soon', {'stream_name': 'bad_wait'}),
+                            ('', {'stream_name': 'bad_wait', 'async': True, 'wait': -1}),
+                            ('', {'stream_name': 'bad_wait', 'async': True, 'wait': [5]})):
+            resp = client.post(f'/start_stream{query}', json=body)
+            assert resp.status_code == 400, (query, body, resp.status_code)
+            assert 'wait' in resp.get_json()['message']
+        assert submitted == []
+        with app._start_jobs_lock:
+            assert set(app._start_jobs) == jobs_before
+    finally:
+        app._submit_start_job = real_submit
+
+
+def test_parse_job_wait():
+    import app
+    assert app._parse_job_wait(None) == 0
+    assert app._parse_job_wait('') == 0
+    assert app._parse_job_wait('2.5') == 2.5
+    assert app._parse_job_wait(10 ** 6) == getattr(app.config, 'START_JOB_MAX_WAIT', 60)
+    for bad in ('soon', 'nan', 'inf', '-1'):
+        try:
+            app._parse_job_wait(bad)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} accepted")
+
+
+def test_get_job_bad_wait():
+    import app
+    job = {'id': 'testjob00001', 'stream_name': 'x', 'state': 'succeeded', 'message': '', 'ffmpeg_command': None,
+           'created_at': 0, 'started_at': 0, 'finished_at': None, 'done': app.threading.Event()}
+    with app._start_jobs_lock:
+        app._start_jobs[job['id']] = job
+    try:
+        client = app.app.test_client()
+        assert client.get('/jobs/testjob00001?wait=soon').status_code == 400
+        assert client.get('/jobs/testjob00001?wait=0').status_code == 200
+    finally:
+        with app._start_jobs_lock:
+            app._start_jobs.pop(job['id'], None)
+
+
+if __name__ == "__main__":
+    test_bad_wait_rejected_before_queueing()
+    test_parse_job_wait()
+    test_get_job_bad_wait()
+    print("✓ start job tests passed")
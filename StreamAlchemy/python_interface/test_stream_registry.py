@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Tests for the copy-on-write stream registry (stream_registry.py).
+Pure in-memory tests; no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stream_registry import StreamRecord, StreamRegistry
+
+
+def _record(name, enc='software', source='/videos/a.mp4'):
+    return StreamRecord(name, None, ['ffmpeg'], threading.Event(), threading.Event(), {},
+                        {'encoder_details': {'type': enc}, 'video_file_path': source}, 1000.0, 0)
+
+
+def test_record_behaves_like_a_details_dict():
+    """Existing details['x'] / details.get('x') / 'x' in details code keeps working"""
+    rec = _record('a')
+    assert rec['cmd'] == ['ffmpeg'] and rec.get('duration_s') == 0
+    assert 'start_time' in rec and 'hls_converter' not in rec and rec.get('hls_converter') is None
+    rec['suspend_requested'] = True
+    assert rec['suspend_requested'] is True
+    with pytest.raises(KeyError):
+        rec['nope'] = 1
+    with pytest.raises(KeyError):
+        rec['status'] = 'error'  # Indexed; must go through the registry
+
+
+def test_indexes_follow_adds_status_changes_and_removals():
+    """Filtered lookups stay in step with the table"""
+    reg = StreamRegistry()
+    reg.add(_record('a'))
+    reg.add(_record('b', enc='hardware_nvidia'))
+    reg.add(_record('c', source='rtsp://cam/1'))
+    assert reg.names(encoder_type='software') == ['a', 'c']
+    assert reg.names(source='/videos/a.mp4', encoder_type='hardware_nvidia') == ['b']
+    assert reg.set_status('a', 'error', 'boom') and reg['a'].error == 'boom'
+    assert reg.names(status='running') == ['b', 'c'] and reg.counts('status') == {'running': 2, 'error': 1}
+    reg.set_status('a', 'running')
+    assert reg['a'].error == ''
+    assert not reg.set_status('missing', 'running')
+    reg.pop('b')
+    assert reg.counts('encoder_type') == {'software': 2}
+    with pytest.raises(KeyError):
+        reg.names(codec='h264')
+
+
+def test_discard_only_removes_the_same_record():
+    """A late teardown of an old stream can't remove a newer stream with the same name"""
+    reg = StreamRegistry()
+    old, new = _record('a'), _record('a')
+    reg.add(old)
+    reg.add(new)
+    assert not reg.discard('a', old)
+    assert reg['a'] is new and reg.names() == ['a']
+    assert reg.discard('a', new) and 'a' not in reg
+
+
+def test_iteration_is_a_stable_snapshot_under_concurrent_changes():
+    """Readers iterate one snapshot while writers add and remove streams"""
+    reg = StreamRegistry()
+    for i in range(500):
+        reg.add(_record(f"s{i}"))
+    stop, errors = threading.Event(), []
+
+    def churn():
+        i = 500
+        while not stop.is_set():
+            reg.add(_record(f"s{i}"))
+            reg.pop(f"s{i - 500}")
+            i += 1
+
+    writer = threading.Thread(target=churn)
+    writer.start()
+    try:
+        for _ in range(200):
+            try:
+                items = list(reg.items())
+                assert len(items) in (500, 501)
+            except RuntimeError as e:  # "dictionary changed size during iteration"
+                errors.append(e)
+    finally:
+        stop.set()
+        writer.join()
+    assert not errors
+    assert len(reg) == 500 and sum(reg.counts('status').values()) == 500
+
+
+if __name__ == "__main__":
+    for test in [test_record_behaves_like_a_details_dict, test_indexes_follow_adds_status_changes_and_removals,
+                 test_discard_only_removes_the_same_record, test_iteration_is_a_stable_snapshot_under_concurrent_changes]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All stream registry tests passed!")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the supervisor Unix socket protocol (supervisor_ipc.py).
+Runs a real server on a temporary socket; no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from supervisor_ipc import SupervisorClient, SupervisorError, SupervisorServer, SupervisorUnavailable
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="needs Unix sockets")
+
+
+def _ops():
+    def fail():
+        raise ValueError("boom")
+    return {'echo': lambda **kw: kw, 'fail': fail, 'conn': threading.get_ident}
+
+
+def _server(path):
+    server = SupervisorServer(path, _ops())
+    server.start()
+    return server
+
+
+def test_call_round_trip():
+    """Ops get their arguments and their results come back unchanged"""
+    with tempfile.TemporaryDirectory() as d:
+        server = _server(os.path.join(d, 'sup.sock'))
+        try:
+            client = SupervisorClient(server.path, timeout=5)
+            assert client.call('echo', a=1, b=[1, 'x']) == {'a': 1, 'b': [1, 'x']}
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert not os.path.exists(server.path)
+
+
+def test_errors_are_reported():
+    """Op exceptions and unknown ops raise SupervisorError on the client"""
+    with tempfile.TemporaryDirectory() as d:
+        server = _server(os.path.join(d, 'sup.sock'))
+        try:
+            client = SupervisorClient(server.path, timeout=5)
+            with pytest.raises(SupervisorError, match='boom'):
+                client.call('fail')
+            with pytest.raises(SupervisorError, match='unknown op'):
+                client.call('nope')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_unavailable_supervisor():
+    """A missing socket raises SupervisorUnavailable"""
+    with tempfile.TemporaryDirectory() as d:
+        client = SupervisorClient(os.path.join(d, 'missing.sock'), timeout=1)
+        with pytest.raises(SupervisorUnavailable):
+            client.call('echo')
+
+
+def test_stale_socket_replaced_and_concurrent_calls():
+    """A leftover socket file is replaced, and many threads can call at once"""
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'sup.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        server = _server(path)
+        try:
+            client = SupervisorClient(path, timeout=5)
+            results = []
+            threads = [threading.Thread(target=lambda i=i: results.append(client.call('echo', i=i))) for i in range(20)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            assert sorted(r['i'] for r in results) == list(range(20))
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_connections_are_reused():
+    """Sequential calls share one pooled connection, and a connection the supervisor dropped is replaced"""
+    with tempfile.TemporaryDirectory() as d:
+        server = _server(os.path.join(d, 'sup.sock'))
+        try:
+            client = SupervisorClient(server.path, timeout=5)
+            first = client.call('conn')
+            assert all(client.call('conn') == first for _ in range(5))
+            assert len(client._idle) == 1
+            client._idle[0][0].shutdown(socket.SHUT_RDWR)  # As if the supervisor had hung up while it sat idle
+            assert client.call('echo', ok=True) == {'ok': True}
+            assert len(client._idle) == 1
+            client.close()
+            assert client._idle == []
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    for test in [test_call_round_trip, test_errors_are_reported, test_unavailable_supervisor,
+                 test_stale_socket_replaced_and_concurrent_calls, test_connections_are_reused]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All supervisor IPC tests passed!")
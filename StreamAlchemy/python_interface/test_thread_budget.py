@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Tests for the host-wide encoder thread budget (thread_budget.py).
+Pure argv and arithmetic tests; no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from thread_budget import ThreadBudget, apply_thread_budget
+
+X264 = ['ffmpeg', '-re', '-stream_loop', '-1', '-i', 'in.mp4', '-c:v', 'libx264', '-preset', 'veryfast', '-s', '1920x1080',
+        '-f', 'rtsp', 'rtsp://localhost:8554/cam1']
+
+
+def test_threads_shrink_as_streams_are_added():
+    """A lone stream gets headroom; once committed cost passes the core count each stream drops towards one thread"""
+    budget = ThreadBudget(cores=16, oversubscription=1.5)
+    assert budget.threads_for(1.6) == 3
+    assert budget.threads_for(4.0) == 6  # A heavier stream (e.g. 4K) gets more
+    for i in range(50):
+        budget.commit(f"s{i}", 1.6)
+    assert budget.threads_for(1.6) == 1
+    assert budget.stats()['encoders'] == 50 and budget.stats()['committed_cost'] == 80.0
+    for i in range(45):
+        assert budget.release(f"s{i}")
+    assert budget.threads_for(1.6) == 3
+    assert not budget.release('s0')
+    assert ThreadBudget(cores=64, max_threads=4).threads_for(10) == 4
+
+
+def test_reservations_made_in_parallel_see_each_other():
+    """Streams set up concurrently reserve as they are sized, so a burst of starts shares the budget instead of each seeing an idle host"""
+    budget = ThreadBudget(cores=16, oversubscription=1.5)
+    barrier = threading.Barrier(50)
+    threads = []
+
+    def start(i):
+        barrier.wait()
+        threads.append(budget.reserve(f"s{i}", 1.6))
+
+    workers = [threading.Thread(target=start, args=(i,)) for i in range(50)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    assert budget.stats()['encoders'] == 50 and budget.stats()['committed_cost'] == 80.0
+    assert min(threads) == 1 and sum(threads) < 50 * 3
+    assert budget.reserve('s0', 1.6) == 1  # Re-reserving replaces the stream's own entry
+    assert budget.stats()['encoders'] == 50
+    for i in range(50):
+        assert budget.release(f"s{i}")  # E.g. the spawns failed
+    assert budget.reserve('next', 1.6) == 3
+
+
+def test_x264_command_gets_encoder_decoder_and_filter_threads():
+    """-threads/x264-params follow the encoder, decoder threads precede -i, filter_threads is global"""
+    cmd = apply_thread_budget(X264, 4)
+    assert cmd[:3] == ['ffmpeg', '-filter_threads', '2']
+    i = cmd.index('-i')
+    assert cmd[i - 2:i] == ['-threads', '2']
+    j = cmd.index('libx264')
+    assert cmd[j + 1:j + 5] == ['-threads', '4', '-x264-params', 'threads=4:lookahead-threads=1']
+    assert cmd[-3:] == X264[-3:]
+    assert X264.count('-threads') == 0  # Input argv is not modified
+
+
+def test_existing_encoder_params_are_merged_not_repeated():
+    """An ABR libx265 output that already sets -x265-params (GOP alignment) gets the thread settings appended to it"""
+    cmd = ['ffmpeg', '-i', 'in', '-filter_complex', 'split=2[v0][v1]',
+           '-map', '[v0]', '-c:v', 'libx265', '-sc_threshold', '0', '-x265-params', 'scenecut=0:open-gop=0', '-f', 'tee', 'a',
+           '-map', '[v1]', '-c:v', 'libx265', '-x265-params', 'scenecut=0:open-gop=0', '-f', 'tee', 'b']
+    out = apply_thread_budget(cmd, 8)
+    assert out.count('-x265-params') == 2 and out.count('-threads') == 3
+    assert out.count('scenecut=0:open-gop=0:pools=4:frame-threads=2') == 2
+    first = out.index('libx265')
+    assert out[first + 1:first + 3] == ['-threads', '4'] and out[first + 3] == '-sc_threshold'
+    # An encoder without params of its own still gets them inserted, even when the next output has some
+    mixed = apply_thread_budget(['ffmpeg', '-i', 'in', '-c:v', 'libx264', 'a', '-c:v', 'libx264', '-x264-params', 'keyint=60', 'b'], 4)
+    assert mixed.count('-x264-params') == 2 and 'threads=2:lookahead-threads=1' in mixed
+    assert 'keyint=60:threads=2:lookahead-threads=1' in mixed
+
+
+def test_x265_abr_hardware_and_copy_commands():
+    """x265 uses pools/frame-threads, ABR renditions split the threads, GPU encoders and copies get no encoder threads"""
+    x265 = apply_thread_budget(['ffmpeg', '-i', 'in', '-c:v', 'libx265', 'out'], 8)
+    assert x265[x265.index('libx265') + 1:] == ['-threads', '8', '-x265-params', 'pools=8:frame-threads=4', 'out']
+    abr = apply_thread_budget(['ffmpeg', '-i', 'in', '-c:v', 'libx264', 'a', '-c:v', 'libx264', 'b'], 4)
+    assert abr.count('threads=2:lookahead-threads=1') == 2
+    nvenc = apply_thread_budget(['ffmpeg', '-i', 'in', '-c:v', 'h264_nvenc', 'out'], 4)
+    assert nvenc == ['ffmpeg', '-filter_threads', '2', '-threads', '2', '-i', 'in', '-c:v', 'h264_nvenc', 'out']
+    copy = ['ffmpeg', '-i', 'cache.mkv', '-map', '0', '-c', 'copy', 'out']
+    assert apply_thread_budget(copy, 4) == copy
+    assert apply_thread_budget(['ffmpeg', '-i', 'in', '-c:v', 'copy', 'out'], 4) == ['ffmpeg', '-i', 'in', '-c:v', 'copy', 'out']
+
+
+if __name__ == "__main__":
+    for test in [test_threads_shrink_as_streams_are_added, test_reservations_made_in_parallel_see_each_other,
+                 test_x264_command_gets_encoder_decoder_and_filter_threads, test_existing_encoder_params_are_merged_not_repeated,
+                 test_x265_abr_hardware_and_copy_commands]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All thread budget tests passed!")
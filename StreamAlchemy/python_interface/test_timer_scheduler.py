@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for the single-thread timer scheduler (timer_scheduler.py).
+Uses short real delays; no ffmpeg or MediaMTX is needed.
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from timer_scheduler import TimerScheduler
+
+
+def test_timers_fire_in_order_and_on_time():
+    """One-shot timers run once, soonest first, close to their due time"""
+    sched = TimerScheduler()
+    try:
+        fired, done = [], threading.Event()
+        t0 = time.monotonic()
+        for delay, label in [(0.3, 'c'), (0.1, 'a'), (0.2, 'b')]:
+            sched.call_later(delay, lambda label=label: (fired.append((label, time.monotonic() - t0)), label == 'c' and done.set()))
+        assert done.wait(2)
+        assert [label for label, _ in fired] == ['a', 'b', 'c']
+        assert all(abs(at - expected) < 0.05 for (_, at), expected in zip(fired, (0.1, 0.2, 0.3)))
+        assert sched.pending() == []
+    finally:
+        sched.stop()
+
+
+def test_named_timers_replace_and_cancel():
+    """Scheduling an existing name replaces it; cancel() and handles stop timers"""
+    sched = TimerScheduler()
+    try:
+        fired = []
+        sched.call_later(0.05, fired.append, 'old', name='expire:s1')
+        sched.call_later(0.1, fired.append, 'new', name='expire:s1')
+        handle = sched.call_later(0.05, fired.append, 'handle')
+        sched.call_later(0.05, fired.append, 'cancelled', name='health:s2')
+        assert [t['name'] for t in sched.pending(prefix='expire:')] == ['expire:s1']
+        assert sched.cancel('health:s2') and not sched.cancel('health:s2')
+        assert handle.cancel()
+        time.sleep(0.3)
+        assert fired == ['new']
+    finally:
+        sched.stop()
+
+
+def test_periodic_timers_do_not_overlap_and_slow_lanes_stay_separate():
+    """A slow periodic job never runs twice at once and doesn't delay the default lane"""
+    sched = TimerScheduler(lanes={'slow': 1})
+    try:
+        active, overlaps, runs = [0], [0], []
+        lock = threading.Lock()
+
+        def slow():
+            with lock:
+                active[0] += 1
+                overlaps[0] += active[0] > 1
+            time.sleep(0.15)
+            with lock:
+                active[0] -= 1
+                runs.append(time.monotonic())
+
+        sched.every(0.01, slow, name='slow', first_delay=0, lane='slow')
+        quick = threading.Event()
+        t0 = time.monotonic()
+        sched.call_later(0.05, quick.set)
+        assert quick.wait(1) and time.monotonic() - t0 < 0.1
+        time.sleep(0.5)
+        sched.cancel('slow')
+        assert overlaps[0] == 0 and 2 <= len(runs) <= 4
+    finally:
+        sched.stop()
+
+
+def test_idle_scheduler_does_not_spin():
+    """With one far-off timer the scheduler thread sleeps instead of polling"""
+    sched = TimerScheduler()
+    try:
+        sched.call_later(3600, lambda: None, name='cleanup')
+        time.sleep(0.3)
+        assert sched.stats()['wakeups'] <= 1
+        assert sched.pending()[0]['name'] == 'cleanup'
+    finally:
+        sched.stop()
+
+
+if __name__ == "__main__":
+    for test in [test_timers_fire_in_order_and_on_time, test_named_timers_replace_and_cancel,
+                 test_periodic_timers_do_not_overlap_and_slow_lanes_stay_separate, test_idle_scheduler_does_not_spin]:
+        test()
+        print(f"✓ {test.__name__}")
+    print("\n✅ All timer scheduler tests passed!")
@@ -0,0 +1,132 @@
+"""
+Host-wide encoder thread budget for StreamAlchemy.
+
+By default libx264 and libx265 start about 1.5 threads per core. The
+decoder and the scaler add threads of their own. Fifty streams on a
+32-core host therefore create thousands of threads, mostly busy
+context-switching. ``ThreadBudget`` shares ``cores x oversubscription``
+threads among the running streams in proportion to each stream's expected
+cost in cores (see ``cpu_placement.estimate_cost()``). Each stream is also
+capped at what its own cost needs:
+
+* A lone 1080p libx264 stream on an idle host gets about 3 threads.
+* On an oversubscribed host every stream drops to 1 encoder thread.
+
+``apply_thread_budget()`` writes the result into an ffmpeg argv:
+
+* ``-threads`` plus ``lookahead-threads`` for libx264;
+* ``pools``/``frame-threads`` for libx265;
+* ``-threads`` for other software encoders;
+* decoder threads before the input;
+* ``-filter_threads`` for the scaler.
+
+Copies and hardware encoders get no encoder threads. Threads are fixed when
+ffmpeg starts, so a budget only affects streams started after it changes.
+"""
+
+import math
+import threading
+
+HARDWARE_SUFFIXES = ('_nvenc', '_vaapi', '_qsv', '_amf', '_videotoolbox', '_v4l2m2m')
+
+
+class ThreadBudget:
+    """Tracks the expected cost of running encoders and hands out thread counts. Thread-safe."""
+
+    def __init__(self, cores, oversubscription=1.5, max_threads=16):
+        self.cores = max(1, cores)
+        self.oversubscription = oversubscription
+        self.max_threads = max(1, max_threads)
+        self._costs = {}  # name -> expected cost in cores of a running encoder
+        self._lock = threading.Lock()
+
+    def threads_for(self, cost):
+        """Threads for a new encoder of ``cost`` cores, given the encoders already counted. Reserves nothing."""
+        with self._lock:
+            return self._threads(sum(self._costs.values()) + cost, cost)
+
+    def reserve(self, name, cost):
+        """Threads for encoder ``name`` of ``cost`` cores, counted against the budget in the same step
+        (replacing an earlier entry for ``name``). Streams being set up in parallel therefore see each other.
+        Release the reservation if the encoder never starts."""
+        with self._lock:
+            threads = self._threads(sum(c for n, c in self._costs.items() if n != name) + cost, cost)
+            self._costs[name] = cost
+        return threads
+
+    def _threads(self, total, cost):
+        budget = self.cores * self.oversubscription
+        # The stream's share of the budget once the host is full; never more than its own cost needs
+        share = budget * cost / max(total, self.cores)
+        return max(1, min(self.max_threads, math.ceil(min(share, cost * self.oversubscription) - 1e-9)))
+
+    def commit(self, name, cost):
+        """Count a started encoder against the budget (replacing an earlier entry for ``name``)."""
+        with self._lock:
+            self._costs[name] = cost
+
+    def release(self, name):
+        with self._lock:
+            return self._costs.pop(name, None) is not None
+
+    def stats(self):
+        with self._lock:
+            committed = round(sum(self._costs.values()), 2)
+            count = len(self._costs)
+        return {'cores': self.cores, 'oversubscription': self.oversubscription, 'threads': int(self.cores * self.oversubscription),
+                'encoders': count, 'committed_cost': committed}
+
+
+def _encoder_thread_args(encoder, threads):
+    if encoder == 'copy' or encoder.endswith(HARDWARE_SUFFIXES):
+        return []
+    if encoder.startswith('libx264'):
+        # x264's default lookahead is threads/6; keep at least one so rate control never stalls the encoder
+        return ['-threads', str(threads), '-x264-params', f"threads={threads}:lookahead-threads={max(1, threads // 4)}"]
+    if encoder.startswith('libx265'):
+        return ['-threads', str(threads), '-x265-params', f"pools={threads}:frame-threads={max(1, min(4, threads // 2))}"]
+    return ['-threads', str(threads)]
+
+
+def _is_video_codec_option(arg):
+    return arg in ('-c:v', '-vcodec') or arg.startswith('-c:v:')
+
+
+def apply_thread_budget(cmd, threads):
+    """A copy of ffmpeg argv ``cmd`` with every video encoder capped at ``threads`` threads in total,
+    plus matching decoder and filter thread counts. Commands that only copy are returned unchanged.
+    Where an output already passes ``-x264-params``/``-x265-params`` after its ``-c:v``, the thread settings
+    are appended to that value: ffmpeg keeps only the last of a repeated option, so a second one would drop either."""
+    encoder_at = [i for i, arg in enumerate(cmd[:-1]) if _is_video_codec_option(arg)]
+    encoders = [cmd[i + 1] for i in encoder_at]
+    software = [e for e in encoders if e != 'copy' and not e.endswith(HARDWARE_SUFFIXES)]
+    if not encoders or all(e == 'copy' for e in encoders):
+        return list(cmd)
+    per_encoder = max(1, threads // max(1, len(software)))  # ABR renditions split the stream's threads
+    helper = max(1, min(4, threads // 2))  # Decoding and scaling need fewer threads than encoding
+    inserted, merged = {}, {}  # -c:v index -> args to add after the encoder; option index -> params to append
+    for n, i in enumerate(encoder_at):
+        args = _encoder_thread_args(cmd[i + 1], per_encoder)
+        end = encoder_at[n + 1] if n + 1 < len(encoder_at) else len(cmd)
+        existing = next((j for j in range(i + 2, end - 1) if cmd[j] == args[2]), None) if len(args) == 4 else None
+        if existing is None:
+            inserted[i] = args
+        else:
+            inserted[i], merged[existing] = args[:2], args[3]
+    out = [cmd[0], '-filter_threads', str(helper)]
+    decoder_set = False
+    i = 1
+    while i < len(cmd):
+        arg = cmd[i]
+        if arg == '-i' and not decoder_set:
+            out += ['-threads', str(helper)]  # Before -i, -threads sets the decoder's thread count
+            decoder_set = True
+        out.append(arg)
+        if i in inserted:
+            out += [cmd[i + 1]] + inserted[i]
+            i += 1
+        elif i in merged:
+            out.append(f"{cmd[i + 1]}:{merged[i]}" if cmd[i + 1] else merged[i])
+            i += 1
+        i += 1
+    return out
@@ -0,0 +1,203 @@
+"""
+Single-thread timer scheduler for StreamAlchemy.
+
+All timed work in the app runs here instead of on sleeping threads and
+threading.Timer objects. That covers stream expiry, per-stream health checks,
+crash and HLS converter restarts, the idle watcher, periodic cleanup and
+cluster heartbeats. One thread keeps the timers in a heap and sleeps until the
+earliest is due, so an idle server wakes up only when something is due.
+
+Callbacks run on worker pools called lanes, so a slow job can't delay an
+expiry. Each timer names its lane. Slow work such as health probes or
+directory cleanup gets a lane of its own. Quick callbacks use the default
+lane.
+
+Timers have unique names. Scheduling a name that is already pending replaces
+the old timer, which gives per-stream timers ("health:cam1") a simple cancel
+and reschedule story. Periodic timers are re-armed after their callback
+returns, so a run never overlaps the previous one.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class _Timer:
+    __slots__ = ('name', 'due', 'fn', 'args', 'interval', 'lane', 'runs', 'cancelled', 'seq')
+
+    def __init__(self, name, due, fn, args, interval, lane, seq):
+        self.name = name
+        self.due = due
+        self.fn = fn
+        self.args = args
+        self.interval = interval
+        self.lane = lane
+        self.runs = 0
+        self.cancelled = False
+        self.seq = seq
+
+
+class TimerHandle:
+    """Returned by call_later()/every(); cancel() stops the timer if it hasn't fired yet."""
+
+    __slots__ = ('_scheduler', '_timer')
+
+    def __init__(self, scheduler, timer):
+        self._scheduler = scheduler
+        self._timer = timer
+
+    @property
+    def name(self):
+        return self._timer.name
+
+    def cancel(self):
+        return self._scheduler._cancel_timer(self._timer)
+
+
+class TimerScheduler:
+    """Heap-based scheduler. ``lanes`` maps lane name -> worker count, besides the default lane of ``workers``."""
+
+    def __init__(self, workers=2, lanes=None, logger=None, clock=time.monotonic):
+        self.logger = logger or logging.getLogger(__name__)
+        self._clock = clock
+        self._lanes = {None: ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='timer')}
+        for lane, count in (lanes or {}).items():
+            self._lanes[lane] = ThreadPoolExecutor(max_workers=max(1, count), thread_name_prefix=f"timer-{lane}")
+        self._cond = threading.Condition()
+        self._heap = []       # (due, seq, _Timer); cancelled timers are dropped when they reach the top
+        self._by_name = {}    # name -> live _Timer
+        self._seq = itertools.count(1)
+        self._running_jobs = 0
+        self._thread = None
+        self._stopped = False
+        self.fired = 0
+        self.wakeups = 0
+
+    # --- public API ---
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='timer-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=2)
+        for pool in self._lanes.values():
+            pool.shutdown(wait=False)
+
+    def call_later(self, delay, fn, *args, name=None, lane=None):
+        """Run ``fn(*args)`` once after ``delay`` seconds. Replaces a pending timer with the same name."""
+        return self._schedule(name, max(0.0, delay), fn, args, None, lane)
+
+    def every(self, interval, fn, *args, name=None, first_delay=None, lane=None):
+        """Run ``fn(*args)`` every ``interval`` seconds, first after ``first_delay`` (default: one interval)."""
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        return self._schedule(name, interval if first_delay is None else max(0.0, first_delay), fn, args, interval, lane)
+
+    def cancel(self, name):
+        """Cancel the pending timer called ``name``. Returns True if there was one."""
+        with self._cond:
+            timer = self._by_name.get(name)
+            return self._cancel_locked(timer) if timer else False
+
+    def pending(self, prefix=None):
+        """Pending timers, soonest first, as dicts for introspection."""
+        now = self._clock()
+        with self._cond:
+            timers = sorted((t for t in self._by_name.values() if prefix is None or t.name.startswith(prefix)),
+                            key=lambda t: (t.due, t.seq))
+            return [{'name': t.name, 'due_in': round(t.due - now, 3), 'interval': t.interval, 'lane': t.lane or 'default',
+                     'runs': t.runs, 'callback': getattr(t.fn, '__name__', repr(t.fn))} for t in timers]
+
+    def stats(self):
+        with self._cond:
+            return {'pending': len(self._by_name), 'heap_size': len(self._heap), 'running': self._running_jobs,
+                    'fired': self.fired, 'wakeups': self.wakeups,
+                    'lanes': {lane or 'default': pool._max_workers for lane, pool in self._lanes.items()}}
+
+    # --- internals ---
+
+    def _schedule(self, name, delay, fn, args, interval, lane):
+        if lane not in self._lanes:
+            raise KeyError(f"unknown lane {lane!r}")
+        with self._cond:
+            seq = next(self._seq)
+            timer = _Timer(name or f"timer-{seq}", self._clock() + delay, fn, args, interval, lane, seq)
+            old = self._by_name.get(timer.name)
+            if old:
+                old.cancelled = True
+            self._by_name[timer.name] = timer
+            heapq.heappush(self._heap, (timer.due, seq, timer))
+            if self._heap[0][2] is timer:
+                self._cond.notify()  # New earliest timer; shorten the current sleep
+        self.start()
+        return TimerHandle(self, timer)
+
+    def _cancel_timer(self, timer):
+        with self._cond:
+            return self._cancel_locked(timer)
+
+    def _cancel_locked(self, timer):
+        if timer.cancelled:
+            return False
+        timer.cancelled = True
+        if self._by_name.get(timer.name) is timer:
+            del self._by_name[timer.name]
+        # Many cancellations (streams stopping) would otherwise leave the heap full of dead entries
+        if len(self._heap) > 64 and len(self._heap) > 2 * len(self._by_name):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+        return True
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                else:
+                    delay = self._heap[0][0] - self._clock()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                    else:
+                        _, _, timer = heapq.heappop(self._heap)
+                        self._fire_locked(timer)
+                        continue
+                self.wakeups += 1
+
+    def _fire_locked(self, timer):
+        if timer.interval is None and self._by_name.get(timer.name) is timer:
+            del self._by_name[timer.name]
+        self.fired += 1
+        self._running_jobs += 1
+        try:
+            self._lanes[timer.lane].submit(self._call, timer)
+        except RuntimeError:
+            self._running_jobs -= 1  # Pool shut down
+
+    def _call(self, timer):
+        try:
+            timer.fn(*timer.args)
+        except Exception as e:
+            self.logger.error(f"Timer {timer.name} ({getattr(timer.fn, '__name__', timer.fn)}) failed: {e}", exc_info=True)
+        finally:
+            with self._cond:
+                self._running_jobs -= 1
+                timer.runs += 1
+                if timer.interval is not None and not timer.cancelled and self._by_name.get(timer.name) is timer:
+                    timer.due = self._clock() + timer.interval
+                    heapq.heappush(self._heap, (timer.due, next(self._seq), timer))
+                    self._cond.notify()